@@ -1,2 +1,10 @@
+import os
+import sys
+
+# transport and sweep are shared with scripts/ and live there only
+_SCRIPTS = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "scripts"))
+if _SCRIPTS not in sys.path:
+    sys.path.insert(0, _SCRIPTS)
+
 from .utils import *
 from .wiscs_widgets import wiscs_widget
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""On-disk cache of model fits.
+
+Fits are keyed by a content hash of the dataset and everything that
+changes the fit (formulas, extra script lines, optimizer and `maxfun`), so
+re-running a notebook cell or refitting overlapping data is a lookup
+instead of an lme4 run. Entries are evicted least-recently-used once the
+cache grows beyond `max_bytes`.
+"""
+
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+import pandas as pd
+
+import rinterface.rinterface as R # type: ignore
+
+from .utils import fit_script
+
+def fit_key(df:pd.DataFrame, **spec) -> str:
+    """Content hash of the dataset columns and the fit specification"""
+    h = hashlib.sha256()
+    h.update(",".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    for name in sorted(spec):
+        h.update(f"{name}={spec[name]!s};".encode())
+    return h.hexdigest()
+
+
+class FitCache:
+    """Size-bounded LRU cache of fit results on disk.
+
+    Parameters
+    ----------
+    path: str
+        Cache directory. Default is ".fitcache".
+    max_bytes: int
+        Size above which the least recently used entries are evicted.
+        Default is 512 MB.
+    """
+    def __init__(self, path:str=".fitcache", max_bytes:int=512 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key:str) -> str:
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key:str):
+        """Cached value for `key` or None. A hit marks the entry as recently used; an unreadable entry is dropped."""
+        fname = self._file(key)
+        try:
+            with open(fname, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception: # truncated or corrupt, or pickled by code that no longer exists
+            os.remove(fname)
+            return None
+        os.utime(fname)
+        return value
+
+    def put(self, key:str, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp, self._file(key)) # atomic, so readers never see half an entry
+        self.evict()
+
+    def evict(self):
+        entries = sorted(glob.glob(os.path.join(self.path, "*.pkl")), key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in entries)
+        for fname in entries:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(fname)
+            os.remove(fname)
+
+    def clear(self):
+        for fname in glob.glob(os.path.join(self.path, "*.pkl")):
+            os.remove(fname)
+
+
+def cached_fit(df:pd.DataFrame, shared_re, separate_re=None, shared_fixed:str="rt ~ modality + question",
+               separate_fixed:str=" rt ~ modality * question", add:list[str]=None, optimizer:str="bobyqa",
+               maxfun:int=10000, cache:FitCache=None) -> dict:
+    """Fit the shared and separate models, or return the cached fit.
+
+    Parameters
+    ----------
+    df, shared_re, separate_re, shared_fixed, separate_fixed, add, optimizer, maxfun
+        As in `fmt_script`.
+    cache: FitCache
+        Cache to use. Default is `FitCache()`.
+
+    Returns
+    -------
+    dict
+        "stats" (logLik, AIC, BIC, npar per model), "varcorr" and "anova",
+        each a DataFrame.
+    """
+    cache = cache or FitCache()
+    spec = dict(shared_re=shared_re, separate_re=separate_re or shared_re, shared_fixed=shared_fixed,
+                separate_fixed=separate_fixed, add=add, optimizer=optimizer, maxfun=maxfun)
+    key = fit_key(df, **spec)
+
+    result = cache.get(key)
+    if result is None:
+        with tempfile.TemporaryDirectory() as outdir:
+            R(fit_script(df, outdir, **spec))
+            result = {name: pd.read_csv(os.path.join(outdir, f"{name}.csv")) for name in ("stats", "varcorr", "anova")}
+        cache.put(key, result)
+    return result
@@ -0,0 +1,165 @@
+"""Counterbalancing and order-effect injection for simulated data.
+
+A counterbalancing scheme is a lookup table `table[group, modality, question]`
+holding the order code of that block for subjects in `group`
+(modality 0 = "word", 1 = "image"). Two schemes cover the designs used in
+`order_effects.ipynb` and `diagnostics.ipynb`:
+
+- `question_table(Q)`: groups are cyclic question orders, the code is the
+  position of the question (0-based). For two questions this is
+  `qorder = question != tag`.
+- `block_table(Q)`: groups are modality order x cyclic question order and
+  the code is the block position (1-based), e.g. "word-image_Q1Q2".
+
+`OrderEffects` assigns groups to subjects, maps every row through the table
+and shifts the rt of the targeted blocks, all with array operations, on a
+DataFrame or on a `(n_iter, n_rows)` batch of replicates.
+
+Example
+-------
+>>> stage = OrderEffects(block_table(2), shift=300, noise_sd=50)
+>>> df = stage.transform(DG.to_pandas(), seed=44)
+"""
+
+import numpy as np
+import pandas as pd
+
+MODALITIES = ("word", "image")
+IMAGE = 1
+
+
+def _cyclic(n:int) -> np.ndarray:
+    """Latin-square orders: row g is (g, g+1, ..., g-1) mod n"""
+    return (np.arange(n)[:, None] + np.arange(n)[None, :]) % n
+
+
+def question_table(n_question:int=2) -> np.ndarray:
+    """Question position (0-based) per (group, modality, question); one group per cyclic question order"""
+    rank = np.argsort(_cyclic(n_question), axis=1) # rank[g, q] = position of q in order g
+    return np.repeat(rank[:, None, :], 2, axis=1)
+
+
+def block_table(n_question:int=2) -> np.ndarray:
+    """Block position (1-based) per (group, modality, question).
+
+    Groups are modality order (word first, image first) x cyclic question
+    order, in that nesting, so for two questions the groups are
+    word-image_Q1Q2, word-image_Q2Q1, image-word_Q1Q2, image-word_Q2Q1.
+    """
+    q_rank = np.argsort(_cyclic(n_question), axis=1)
+    m_rank = np.array([[0, 1], [1, 0]]) # [modality order, modality]
+    table = m_rank[:, None, :, None] * n_question + q_rank[None, :, None, :] + 1
+    return table.reshape(2 * n_question, 2, n_question)
+
+
+def group_labels(table:np.ndarray) -> list[str]:
+    """Readable names for the groups of a `block_table`"""
+    n_question = table.shape[2]
+    labels = []
+    for g in range(table.shape[0]):
+        modality = "-".join(MODALITIES[m] for m in np.argsort(table[g, :, 0]))
+        question = "".join(f"Q{q + 1}" for q in np.argsort(table[g, 0]))
+        labels.append(f"{modality}_{question}" if n_question > 1 else modality)
+    return labels
+
+
+def assign_groups(n_subject:int, n_groups:int, balanced:bool=True, rng=None) -> np.ndarray:
+    """Counterbalancing group of every subject.
+
+    With `balanced`, groups are tiled and shuffled so their sizes differ by
+    at most one; otherwise each subject draws a group independently.
+    """
+    rng = np.random.default_rng(rng)
+    if balanced:
+        return rng.permutation(np.resize(np.arange(n_groups), n_subject))
+    return rng.integers(0, n_groups, n_subject)
+
+
+def first_image_block(table:np.ndarray) -> np.ndarray:
+    """Boolean lookup table marking each group's earliest image block"""
+    image = table[:, IMAGE, :]
+    target = np.zeros(table.shape, dtype=bool)
+    target[:, IMAGE, :] = image == image.min(axis=1, keepdims=True)
+    return target
+
+
+class OrderEffects:
+    """Pipeline stage adding counterbalancing columns and order effects.
+
+    Parameters
+    ----------
+    table: np.ndarray
+        Order codes per (group, modality, question), e.g. `block_table(2)`.
+    shift: float
+        Mean rt shift of a targeted block. Default is 300.
+    noise_sd: float
+        SD of the per-trial noise added to the shift. Default is 50.
+    target: np.ndarray
+        Boolean table of the same shape marking the shifted blocks.
+        Default is `first_image_block(table)`.
+    proportion: float
+        Share of subjects that show the effect. Default is 1.
+    balanced: bool
+        Balance group sizes (see `assign_groups`). Default is True.
+    """
+    def __init__(self, table:np.ndarray, shift:float=300, noise_sd:float=50, target:np.ndarray=None,
+                 proportion:float=1.0, balanced:bool=True):
+        self.table = np.asarray(table)
+        self.target = first_image_block(self.table) if target is None else np.asarray(target, dtype=bool)
+        self.shift = shift
+        self.noise_sd = noise_sd
+        self.proportion = proportion
+        self.balanced = balanced
+
+    def assign(self, n_subject:int, rng=None) -> tuple[np.ndarray, np.ndarray]:
+        """Group and effect flag of every subject"""
+        rng = np.random.default_rng(rng)
+        groups = assign_groups(n_subject, len(self.table), self.balanced, rng)
+        affected = np.zeros(n_subject, dtype=bool)
+        affected[rng.choice(n_subject, int(self.proportion * n_subject), replace=False)] = True
+        return groups, affected
+
+    @staticmethod
+    def _codes(df:pd.DataFrame):
+        subject = np.unique(df["subject"].to_numpy(), return_inverse=True)[1]
+        modality = (np.asarray(df["modality"]) == MODALITIES[IMAGE]).astype(int)
+        question = df["question"].to_numpy().astype(int)
+        return subject, modality, question
+
+    def columns(self, df:pd.DataFrame, groups:np.ndarray, affected:np.ndarray) -> tuple[dict, np.ndarray]:
+        """Counterbalancing columns for `df` and the row mask of shifted trials"""
+        subject, modality, question = self._codes(df)
+        tag = groups[subject]
+        columns = {
+            "tag": tag,
+            "qorder": self.table[tag, modality, question],
+            "first_image_block": first_image_block(self.table)[tag, modality, question].astype(int),
+        }
+        return columns, self.target[tag, modality, question] & affected[subject]
+
+    def shifts(self, mask:np.ndarray, shape:tuple, rng=None) -> np.ndarray:
+        """Order-effect shifts (zero outside `mask`) of the given shape, noise drawn only where needed"""
+        rng = np.random.default_rng(rng)
+        out = np.zeros(shape)
+        out[..., mask] = self.shift + rng.normal(0, self.noise_sd, shape[:-1] + (int(mask.sum()),))
+        return out
+
+    def transform(self, df:pd.DataFrame, seed=None) -> pd.DataFrame:
+        """Copy of `df` with tag, qorder and first_image_block columns and shifted rt"""
+        rng = np.random.default_rng(seed)
+        groups, affected = self.assign(len(np.unique(df["subject"])), rng)
+        columns, mask = self.columns(df, groups, affected)
+        out = df.assign(**columns)
+        out["rt"] = df["rt"].to_numpy() + self.shifts(mask, (len(df),), rng)
+        return out
+
+    def replicates(self, design:pd.DataFrame, Y:np.ndarray, seed=None) -> tuple[pd.DataFrame, np.ndarray]:
+        """Apply the stage to a batch of replicates (e.g. from `BatchGenerator.replicates`).
+
+        Group assignment is part of the design and shared by every
+        replicate; the trial noise is drawn independently per replicate.
+        """
+        rng = np.random.default_rng(seed)
+        groups, affected = self.assign(len(np.unique(design["subject"])), rng)
+        columns, mask = self.columns(design, groups, affected)
+        return design.assign(**columns), Y + self.shifts(mask, Y.shape, rng)
@@ -2,8 +2,15 @@ import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
+from sweep import Sweep, Cell # lazy alternative to `grid`
+
+__all__ = ["grid", "Sweep", "Cell"]
+
 def grid(**kwargs):
     """Generate all possible combinations of elements in K arrays
+
+    The product is built in memory; see `Sweep` for a lazy version that
+    also sweeps generating parameters.
     
     **kwargs
     -------
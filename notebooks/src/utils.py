@@ -4,6 +4,7 @@ import os
 import ipywidgets as widgets # type: ignore
 import pandas as pd
 from rinterface.utils import to_r # type: ignore
+from transport import READER, to_r_binary
 
 from wiscs.utils import make_tasks # type: ignore
 from wiscs.formula import Formula # type: ignore
@@ -142,28 +143,15 @@ def extract_params_from_widget(widget):
 
     return params
 
-def fmt_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula=None, shared_fixed:str="rt ~ modality + question", 
-               separate_fixed:str=" rt ~ modality * question", add:list[str]=None, VarCorr_only:bool=False, optimizer:str="bobyqa",
-               maxfun:int=10000) -> str:
-    
-    if separate_re is None:
-        separate_re = shared_re
+def _model_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula, shared_fixed:str, separate_fixed:str,
+                  add:list[str], optimizer:str, maxfun:int, remove:bool=True, start=None) -> str:
+    """Shared part of `fmt_script` and `fit_script`: load data, factorize, fit both models.
 
-    """Format R script for mixed-effects model analysis.
-    
-    Parameters
-    ----------
-    shared_f: str
-        Shared fixed effects formula.
-    separate_f: str
-        Separate fixed effects formula. 
-    df: pd.DataFrame
-        Dataframe containing the data.
-    add: list[str]  
-        Additional lines to add to the script.
+    With `remove`, R deletes the temporary data file once it has read it.
     """
     _add = "\n".join(add) if add else ""
-    optimizer_control = f', control = lmerControl(optimizer = "{optimizer}", optCtrl = list(maxfun = {maxfun}))' if optimizer else ""
+    control = f'lmerControl(optimizer = "{optimizer}", optCtrl = list(maxfun = {maxfun}))' if optimizer else "lmerControl()"
+    start = "NULL" if start is None else "c(" + ", ".join(repr(float(v)) for v in np.ravel(start)) + ")"
     return(rf"""
     # imports
     suppressMessages(library(lme4))
@@ -172,7 +160,8 @@ def fmt_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula=None, sha
     suppressMessages(library(lmerTest))
 
     # import data from Python
-    df <- {to_r(df)}
+    {READER}
+    df <- {to_r_binary(df, remove=remove)}
 
     # factorize + treatment coding
     df$question <- as.factor(df$question)
@@ -190,9 +179,47 @@ def fmt_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula=None, sha
 
 
     # model
-    shared <- lmer({shared_fixed + " + " + str(shared_re)}, data = df, REML = FALSE, {optimizer_control}) # nolint
-    separate <- lmer({separate_fixed + " + " + str(separate_re)}, data = df, REML = FALSE, {optimizer_control}) # nolint
+    # warm start: the shared fit starts from `start`, the separate fit from the shared fit;
+    # a warm fit that errors or does not converge is redone from lme4's default start
+    warm_lmer <- function(formula, theta = NULL) {{
+        fit <- NULL
+        if (!is.null(theta)) {{
+            fit <- tryCatch(lmer(formula, data = df, REML = FALSE, control = {control}, start = list(theta = theta)),
+                            error = function(e) NULL)
+            if (!is.null(fit) && length(fit@optinfo$conv$lme4$messages) > 0) fit <- NULL
+        }}
+        if (is.null(fit)) fit <- lmer(formula, data = df, REML = FALSE, control = {control})
+        fit
+    }}
+    shared <- warm_lmer({shared_fixed + " + " + str(shared_re)}, {start}) # nolint
+    separate <- warm_lmer({separate_fixed + " + " + str(separate_re)}, getME(shared, "theta")) # nolint
+    """)
 
+def fmt_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula=None, shared_fixed:str="rt ~ modality + question", 
+               separate_fixed:str=" rt ~ modality * question", add:list[str]=None, VarCorr_only:bool=False, optimizer:str="bobyqa",
+               maxfun:int=10000, start=None) -> str:
+    
+    if separate_re is None:
+        separate_re = shared_re
+
+    """Format R script for mixed-effects model analysis.
+    
+    Parameters
+    ----------
+    shared_f: str
+        Shared fixed effects formula.
+    separate_f: str
+        Separate fixed effects formula. 
+    df: pd.DataFrame
+        Dataframe containing the data.
+    add: list[str]  
+        Additional lines to add to the script.
+    start: array-like
+        Starting theta for the shared model, e.g. `getME(shared, "theta")`
+        from an earlier fit. The separate model always starts from the
+        shared fit.
+    """
+    return _model_script(df, shared_re, separate_re, shared_fixed, separate_fixed, add, optimizer, maxfun, start=start) + rf"""
     if ({to_r(VarCorr_only)}) {{
 
         cat("\n\033[1m Variance components (Shared Model)\033[0m\n")
@@ -215,4 +242,40 @@ def fmt_script(df:pd.DataFrame, shared_re:Formula, separate_re:Formula=None, sha
         cat("\n\033[1m Variance components\033[0m\n")
         print(VarCorr(shared))
     }}
-    """)
\ No newline at end of file
+    """
+
+def fit_script(df:pd.DataFrame, outdir:str, shared_re:Formula, separate_re:Formula=None, shared_fixed:str="rt ~ modality + question",
+               separate_fixed:str=" rt ~ modality * question", add:list[str]=None, optimizer:str="bobyqa", maxfun:int=10000,
+               start=None) -> str:
+    """Format R script that fits both models and writes their results to `outdir`.
+
+    Writes `stats.csv` (logLik, AIC, BIC and npar per model), `varcorr.csv`
+    (VarCorr of both models) and `anova.csv` (the model comparison). See
+    `fmt_script` for the other parameters. `cache.cached_fit` runs it and
+    caches the tables on disk.
+    """
+    if separate_re is None:
+        separate_re = shared_re
+
+    outdir = outdir.replace(os.sep, "/")
+    return _model_script(df, shared_re, separate_re, shared_fixed, separate_fixed, add, optimizer, maxfun, start=start) + rf"""
+    ll <- list(shared = logLik(shared), separate = logLik(separate))
+    stats <- data.frame(
+        model = names(ll),
+        logLik = sapply(ll, as.numeric),
+        AIC = c(AIC(shared), AIC(separate)),
+        BIC = c(BIC(shared), BIC(separate)),
+        npar = sapply(ll, function(x) attr(x, "df"))
+    )
+    write.csv(stats, file.path("{outdir}", "stats.csv"), row.names = FALSE)
+
+    varcorr <- rbind(
+        cbind(model = "shared", as.data.frame(VarCorr(shared))),
+        cbind(model = "separate", as.data.frame(VarCorr(separate)))
+    )
+    write.csv(varcorr, file.path("{outdir}", "varcorr.csv"), row.names = FALSE)
+
+    comparison <- as.data.frame(anova(shared, separate))
+    comparison <- cbind(model = rownames(comparison), comparison)
+    write.csv(comparison, file.path("{outdir}", "anova.csv"), row.names = FALSE)
+    """
@@ -18,6 +18,9 @@
 import requests
 from typing import Union
 import os
+import re
+import sys
+import numpy as np
 import pandas as pd
 
 DATA_PATH = "https://raw.githubusercontent.com/w-decker/wiscs-stats/main/data/"
@@ -57,29 +60,104 @@ def download_data(url:str, file:Union[str, list[str]]):
         else:
             print(f"Failed to download: {fname} (Status Code: {response.status_code})")
 
-def import_data(path:str, file:Union[str, list[str]]) -> list[pd.DataFrame]:
+# @markdown Files ending in `.wscb` (written by `scripts/transport.py`, e.g. `python transport.py data/*.csv`) are memory-mapped instead of parsed
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts"))
+import transport # the one WSCB reader; raises ValueError on a bad magic or version
+
+# @markdown Large CSVs are streamed in chunks with fixed dtypes, so peak memory is bounded by `CHUNKSIZE` rows rather than the file
+
+CHUNKSIZE = 500_000
+DTYPES = {"subject": "int32", "item": "int32", "question": "int16", "rt": "float64",
+          "modality": pd.CategoricalDtype(["word", "image"])}
+
+def stream_data(path:str, columns:list[str]=None, chunksize:int=CHUNKSIZE):
+  """Yield a dataset in chunks of at most `chunksize` rows, only reading `columns` (all of them must exist)"""
+  if path.endswith(".wscb"):
+    df = transport.read(path, columns)
+    missing = [] if columns is None else [c for c in columns if c not in df]
+    if missing:
+      raise ValueError(f"Columns {missing} not in {path}")
+    for start in range(0, len(df), chunksize):
+      yield df.iloc[start:start + chunksize]
+    return
+  usecols = None if columns is None else list(columns) # read_csv raises on missing columns
+  yield from pd.read_csv(path, usecols=usecols, dtype=DTYPES, chunksize=chunksize)
+
+def formula_columns(*formulas:str, groups:str=None) -> list[str]:
+  """Data columns used by (re_)formulas and the grouping column.
+
+  Names followed by "(" or "." (functions such as `C(question)` or `np.log`) are not columns;
+  any other name that is not a known data column (`DTYPES`) raises a ValueError.
+  """
+  tokens = re.findall(r"([A-Za-z_]\w*)\s*([(.]?)", " ".join(f for f in formulas if f))
+  names = {name for name, call in tokens if not call}
+  if groups is not None:
+    names.add(groups)
+  unknown = sorted(names - set(DTYPES))
+  if unknown:
+    raise ValueError(f"Unknown columns {unknown}; expected some of {list(DTYPES)}")
+  return [c for c in DTYPES if c in names]
+
+def summarize(path:str, by:list[str]=("modality", "question"), value:str="rt", chunksize:int=CHUNKSIZE) -> pd.DataFrame:
+  """Count, mean and sd of `value` per group, accumulated one chunk at a time"""
+  parts = []
+  for chunk in stream_data(path, columns=list(by) + [value], chunksize=chunksize):
+    x = chunk[value].astype("float64")
+    parts.append(x.groupby([chunk[b] for b in by], observed=True)
+                  .agg(n="count", total="sum", squares=lambda v: (v ** 2).sum()))
+    # fold partial sums as we go so only one summary per chunk is ever held
+    parts = [pd.concat(parts).groupby(level=list(range(len(by)))).sum()]
+  out = parts[0]
+  out["mean"] = out["total"] / out["n"]
+  out["sd"] = np.sqrt((out["squares"] - out["n"] * out["mean"] ** 2) / (out["n"] - 1))
+  return out[["n", "mean", "sd"]]
+
+def load_for(path:str, formula:str, groups:str="subject", re_formula:str=None, chunksize:int=CHUNKSIZE) -> pd.DataFrame:
+  """Materialize only the columns a `mixedlm_wrapper` call needs"""
+  columns = formula_columns(formula, re_formula, groups=groups)
+  return pd.concat(stream_data(path, columns=columns, chunksize=chunksize), ignore_index=True)
+
+# formulas and grouping column of the models below; `import_data` only loads their columns
+FORMULAS = ["rt ~ modality * question", "~question + item"]
+GROUPS = "subject"
+
+def import_data(path:str, file:Union[str, list[str]], columns:list[str]=None, chunksize:int=CHUNKSIZE,
+                stream:bool=False) -> dict:
+  """
+  Load datasets by file name. Only `columns` are read (default: the columns of `FORMULAS` and `GROUPS`).
+
+  Each dataset is one DataFrame, built from chunks of at most `chunksize` rows. With `stream`, each is
+  instead a generator of those chunks, so peak memory is bounded by `chunksize` rather than the file.
+  """
+  file = [file] if isinstance(file, str) else file
+  columns = formula_columns(*FORMULAS, groups=GROUPS) if columns is None else formula_columns(" ".join(columns))
   df = {}
   for fname in file:
-    df[fname] = pd.read_csv(os.path.join(path, fname))
+    chunks = stream_data(os.path.join(path, fname), columns, chunksize)
+    df[fname] = chunks if stream else pd.concat(chunks, ignore_index=True)
   print('Data imported')
   return df
 
-download_data(DATA_PATH, datasets_to_use)
-df = import_data(LOCAL_DATA_PATH, datasets_to_use)
+# @markdown The script body only runs as `__main__`, so worker processes that import this file (`fit_batch` under spawn or forkserver) do not rerun it
+
+if __name__ == "__main__":
+  download_data(DATA_PATH, datasets_to_use)
+  df = import_data(LOCAL_DATA_PATH, datasets_to_use)
 
-keys = list(df.keys())
+  keys = list(df.keys())
 
-potter1975 = df["simulated_Potter1975.csv"] if "simulated_Potter1975.csv" in keys else None
-main = df['simulated_main.csv'] if 'simulated_main.csv' in keys else None
-alt = df['simulated_alt.csv'] if 'simulated_alt.csv' in keys else None
+  potter1975 = df["simulated_Potter1975.csv"] if "simulated_Potter1975.csv" in keys else None
+  main = df['simulated_main.csv'] if 'simulated_main.csv' in keys else None
+  alt = df['simulated_alt.csv'] if 'simulated_alt.csv' in keys else None
 
 
 # In[41]:
 
 
 # @markdown This is what the data look like
-main.head()
+if __name__ == "__main__":
+  print(main.head())
 
 
 # In[48]:
@@ -99,7 +177,6 @@ import statsmodels.formula.api as smf # type: ignore
 from statsmodels.regression.linear_model import RegressionResults
 from typing import Mapping, Tuple
 import pandas as pd
-import itertools
 from scipy.stats import chi2
 
 def mixedlm_wrapper(formula:str, data:pd.DataFrame, groups:pd.Series, re_formula:str=None):
@@ -113,31 +190,34 @@ def mixedlm_wrapper(formula:str, data:pd.DataFrame, groups:pd.Series, re_formula
                         re_formula=re_formula)
   return model, model.fit(reml=False)
 
+def pairwise_lrt(names:list, llf:np.ndarray, df:np.ndarray) -> pd.DataFrame:
+    """
+    log-likelihood ratio tests for every pair (i < j), vectorized over a loglik/df table.
+    """
+    names, llf, df = np.asarray(names, dtype=object), np.asarray(llf, dtype=float), np.asarray(df, dtype=float)
+    i, j = np.triu_indices(len(names), k=1)
+    llr = 2 * (llf[j] - llf[i])
+    ddf = df[j] - df[i]
+    return pd.DataFrame({
+        "model1": names[i],
+        "model2": names[j],
+        "LLR": llr,
+        "p-value": chi2.sf(llr, ddf),
+        "df": ddf,
+        "winner": np.where(llf[i] > llf[j], names[i], names[j]),
+    })
+
 def llr_test(models:Mapping[any, MixedLMResultsWrapper], print_results:bool=True):
     """
     log-likelihood ratio tests for all pairs of models.
     """
-    llr_results = {}
-    model_scores = {name: 0 for name in models.keys()}
-
-    for (name1, model1), (name2, model2) in itertools.combinations(models.items(), 2):
-
-        # ll
-        ll1, ll2 = model1.llf, model2.llf
-
-        # LLR test
-        llr = 2 * (ll2 - ll1)
-        df = model2.df_modelwc - model1.df_modelwc
-        pval = chi2.sf(llr, df)
-
-        # Which model is better?
-        winner = name1 if ll1 > ll2 else name2
-        llr_results[f"{name1} & {name2}"] = {
-            "LLR": llr,
-            "p-value": pval,
-            "df": df,
-            "winner": winner,
-        }
+    table = pairwise_lrt(list(models), [m.llf for m in models.values()], [m.df_modelwc for m in models.values()])
+    llr_results = {
+        f"{row.pop('model1')} & {row.pop('model2')}": row
+        for row in table.to_dict("records")
+    }
+    if print_results:
+        print(table.to_string(index=False))
 
     return llr_results
 
@@ -161,6 +241,91 @@ def best_model(models: Mapping[any, MixedLMResultsWrapper], # type: ignore
       return label, winner
 
 
+# In[ ]:
+
+
+# @title # Batch fitting
+# @markdown `fit_batch()` $\rightarrow$ fits every {dataset × formula × re_formula} spec in a process pool and returns a loglik/df/AIC/BIC table \
+# @markdown `expand_specs()` $\rightarrow$ crosses datasets with model specs \
+# @markdown `pairwise_lrt()` $\rightarrow$ all pairwise LRTs from that table at once
+
+from concurrent.futures import ProcessPoolExecutor
+
+_DATA = {} # read-only datasets, set once per worker process
+
+def _share(data:Mapping[str, pd.DataFrame]):
+  global _DATA
+  _DATA = data
+
+def _fit_spec(label, spec:dict) -> dict:
+  data = _DATA[spec["dataset"]]
+  if spec.get("crossed"):
+    fit = crossed_mixedlm(spec["formula"], data)
+  else:
+    groups = spec.get("groups", "subject")
+    _, fit = mixedlm_wrapper(spec["formula"], data, groups=data[groups], re_formula=spec.get("re_formula"))
+  return {"label": label, **spec, "llf": fit.llf, "df": fit.df_modelwc, "aic": fit.aic, "bic": fit.bic,
+          "converged": fit.converged}
+
+def expand_specs(datasets:list[str], models:Mapping[str, dict]) -> dict:
+  """{"<dataset>:<model>": spec} for every dataset and model spec (formula, re_formula, groups)"""
+  return {f"{d}:{m}": {"dataset": d, **spec} for d in datasets for m, spec in models.items()}
+
+def fit_batch(data:Mapping[str, pd.DataFrame], specs:Mapping[any, dict], n_jobs:int=None) -> pd.DataFrame:
+  """
+  Fit every spec ({"dataset", "formula", "re_formula", "groups"}) in a process pool.
+  Specs with "crossed": True are fitted with `crossed_mixedlm` instead.
+
+  `data` is passed explicitly to each worker once, by the pool initializer, rather than with every spec
+  (pickled under spawn/forkserver, shared copy-on-write under fork).
+  """
+  with ProcessPoolExecutor(n_jobs, initializer=_share, initargs=(data,)) as executor:
+    futures = [executor.submit(_fit_spec, label, spec) for label, spec in specs.items()]
+    return pd.DataFrame([f.result() for f in futures]).set_index("label")
+
+
+# In[ ]:
+
+
+# @title # Crossed random effects
+# @markdown `crossed_mixedlm()` $\rightarrow$ ML fit of the shared (`rt ~ modality + question`) or separate (`rt ~ modality * question`) model
+# @markdown with `(1 + question | subject) + (1 + question | item)`, the models the paper compares, through `scripts/lmm.py`. \
+# @markdown `mixedlm_wrapper` can only group by one factor, so crossed items end up as dense `re_formula` columns. `lmm.CrossedLMM` uses sparse
+# @markdown random-effect designs and lme4's profiled deviance; log-likelihoods are comparable to `lmer(..., REML = FALSE)` with the same formula.
+
+import lmm
+
+CROSSED = {"rt ~ modality + question": False, "rt ~ modality * question": True} # formula -> interaction
+
+class CrossedResults:
+  """Minimal results object, usable with `llr_test`, `best_model` and `aic`/`bic`"""
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+  def summary(self):
+    return pd.concat({"fixed": self.fe_params, "variance": self.vcomp})
+
+def crossed_mixedlm(formula:str, data:pd.DataFrame) -> CrossedResults:
+  """
+  ML fit of `formula + (1 + question | subject) + (1 + question | item)`; `formula` is the shared or separate model.
+  """
+  key = " ".join(formula.split())
+  if key not in CROSSED:
+    raise ValueError(f"crossed_mixedlm fits {list(CROSSED)}, got {formula!r}")
+  columns = (data["subject"], data["item"], data["question"], data["modality"].astype(str))
+  model = lmm.CrossedLMM(*columns, interaction=CROSSED[key])
+  fit = model.fit(data["rt"])
+  vcomp = {}
+  for group, cov in zip(("subject", "item"), model.covariance(fit["theta"], fit["sigma"])):
+    vcomp.update({f"{group} {term}": v for term, v in zip(["(Intercept)", *model.names[2:model.k + 1]], np.diag(cov))})
+  vcomp["residual"] = fit["sigma"] ** 2
+  return CrossedResults(
+      llf=fit["loglik"], df_modelwc=model.n_par, aic=fit["aic"], bic=fit["bic"],
+      fe_params=pd.Series(fit["beta"], index=model.names), vcomp=pd.Series(vcomp),
+      converged=fit["converged"], nfev=fit["nfev"],
+  )
+
+
 # # Fitting a model
 # 
 # This statistical analysis uses a $\text{Linear Mixed Effects Model}$. The term $\text{mixed}$ refers to experimental variables being modeled as _**random**_ and/or _**fixed**_ effects. The design is _mixed_.
@@ -175,10 +340,11 @@ def best_model(models: Mapping[any, MixedLMResultsWrapper], # type: ignore
 
 # @markdown Here is a vanilla fixed effects model that evaluates data associated with both main and alternative hypotheses
 
-model_main_vanilla, fit_main_vanilla = mixedlm_wrapper("rt ~ modality", main, groups=main["subject"])
+if __name__ == "__main__":
+  model_main_vanilla, fit_main_vanilla = mixedlm_wrapper("rt ~ modality", main, groups=main["subject"])
 
-model_alt_vanilla, fit_alt_vanilla = mixedlm_wrapper("rt ~ modality", alt,
-                                     groups=alt["subject"])
+  model_alt_vanilla, fit_alt_vanilla = mixedlm_wrapper("rt ~ modality", alt,
+                                       groups=alt["subject"])
 
 
 # In[45]:
@@ -186,9 +352,21 @@ model_alt_vanilla, fit_alt_vanilla = mixedlm_wrapper("rt ~ modality", alt,
 
 # @markdown Let's add some variables as random effects into the model
 
-model_main, fit_main = mixedlm_wrapper("rt ~ modality", main, groups=main["subject"], re_formula="~question + item")
+if __name__ == "__main__":
+  model_main, fit_main = mixedlm_wrapper("rt ~ modality", main, groups=main["subject"], re_formula="~question + item")
+
+  model_alt, fit_alt = mixedlm_wrapper("rt ~ modality", alt, groups=alt["subject"], re_formula="~question + item")
 
-model_alt, fit_alt = mixedlm_wrapper("rt ~ modality", alt, groups=alt["subject"], re_formula="~question + item")
+
+# In[ ]:
+
+
+# @markdown Or the paper's comparison, with subject and item crossed: `(1 + question | subject) + (1 + question | item)` in lme4 terms
+
+if __name__ == "__main__":
+  fit_main_shared = crossed_mixedlm("rt ~ modality + question", main)
+  fit_main_separate = crossed_mixedlm("rt ~ modality * question", main)
+  llr_test({"shared": fit_main_shared, "separate": fit_main_separate})
 
 
 # # Which data does the model best fit?
@@ -200,22 +378,33 @@ model_alt, fit_alt = mixedlm_wrapper("rt ~ modality", alt, groups=alt["subject"]
 # In[47]:
 
 
-models = {
-    "MAIN":fit_main,
-    "ALT":fit_alt,
-}
+if __name__ == "__main__":
+  models = {
+      "MAIN":fit_main,
+      "ALT":fit_alt,
+  }
 
-label, winner = best_model(models, metric="aic", print_results=True)
+  label, winner = best_model(models, metric="aic", print_results=True)
 
-print('-'*50)
-print(f'\nwinner: "{label}"\n')
-print('-'*50)
-print('Model Summary')
-winner.summary()
+  print('-'*50)
+  print(f'\nwinner: "{label}"\n')
+  print('-'*50)
+  print('Model Summary')
+  winner.summary()
 
 
 # In[ ]:
 
 
+# @markdown The same comparison as a batch: every dataset × model spec is fitted in parallel, then compared from one table
 
-
+if __name__ == "__main__":
+  specs = expand_specs(["MAIN", "ALT"], {
+      "vanilla": {"formula": "rt ~ modality"},
+      "random": {"formula": "rt ~ modality", "re_formula": "~question + item"},
+      "shared": {"formula": "rt ~ modality + question", "crossed": True},
+      "separate": {"formula": "rt ~ modality * question", "crossed": True},
+  })
+  table = fit_batch({"MAIN": main, "ALT": alt}, specs)
+  print(table[["llf", "df", "aic", "bic", "converged"]])
+  pairwise_lrt(table.index, table["llf"], table["df"])
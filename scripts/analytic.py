@@ -0,0 +1,138 @@
+"""Analytic power approximation for screening a sweep.
+
+In the balanced, fully crossed designs simulated here every subject and
+item is seen in both modalities at every question, and the random-effect
+terms of `simulate.BatchGenerator` (intercept, question, modality) are the
+same for both modalities or the same for every question. Differences
+image - word at one (subject, question, item) therefore cancel all of
+them, and the modality x question interaction is estimated from those
+differences alone:
+
+    dbar_q ~ N(delta_q, 2 sd.error^2 / (n_subject n_item))
+
+with delta_q = mu[image, q] - mu[word, q]. The chi-square test of the
+interaction (df = n_question - 1) then has noncentrality
+
+    lambda = n_subject n_item sum_q (delta_q - mean(delta))^2 / (2 sd.error^2)
+
+and a cell's success rate (the shared model winning, p > p_threshold) is
+the probability that the statistic stays below the chi-square critical
+value. With method "f", the statistic is taken as df times a noncentral F
+with the residual df of the fit, which accounts for the slightly liberal
+LRT in small designs. With equal word and image tasks (as `cell_update`
+sets them) lambda is 0 and the success rate is about 1 - p_threshold.
+
+`screen` classifies cells as clearly met, clearly ruled out or near the
+boundary; `screened_agg` simulates only the latter and `report` compares
+the approximation against simulated cells.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, ncf, ncx2
+
+from simulate import BatchGenerator
+from sweep import cells, tag
+from utils import agg, cell_update
+
+
+def noncentrality(params:dict) -> tuple[float, int, int]:
+    """Noncentrality, numerator df and residual df of the interaction test.
+
+    Parameters
+    ----------
+    params: dict
+        Full generating parameters of one cell (base params updated with
+        `cell_update`).
+    """
+    S, I, Q = (int(params[f"n.{k}"]) for k in ("subject", "item", "question"))
+    mu = BatchGenerator(params).mean({}, Q)
+    delta = mu[1] - mu[0]
+    lam = S * I * np.sum((delta - delta.mean())**2) / (2 * params["sd.error"]**2)
+    # trials minus fixed effects and subject- and item-by-question effects
+    ddf = max(2 * S * I * Q - 2 * Q - (S - 1) * Q - (I - 1) * Q, 1)
+    return float(lam), Q - 1, ddf
+
+
+def success_rate(params:dict, p_threshold:float=0.05, method:str="f") -> float:
+    """Approximate probability that the shared model wins (the power reported by `run`)"""
+    lam, df, ddf = noncentrality(params)
+    crit = chi2.ppf(1 - p_threshold, df)
+    if method == "chisq":
+        return float(ncx2.cdf(crit, df, lam)) if lam > 0 else float(chi2.cdf(crit, df))
+    if method == "f":
+        return float(ncf.cdf(crit / df, df, ddf, lam))
+    raise ValueError(f"Unknown method {method!r}; use 'chisq' or 'f'")
+
+
+def screen(params:dict, combinations, question_sd, desired_power:float, p_threshold:float=0.05,
+           margin:float=0.1, method:str="f") -> pd.DataFrame:
+    """Approximate power of every cell and whether it needs simulating.
+
+    Parameters
+    ----------
+    params: dict
+        Base generating parameters.
+    combinations: array-like or sweep.Sweep
+        Cells as passed to `agg`.
+    margin: float
+        Cells whose approximate power is within `margin` of
+        `desired_power` are sent to simulation.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per cell with `power_approx` and `decision` ("met",
+        "ruled out" or "simulate").
+    """
+    rows = []
+    for cell in cells(combinations):
+        power = success_rate({**params, **cell_update(cell.row, question_sd, cell.params)}, p_threshold, method)
+        decision = "simulate" if abs(power - desired_power) <= margin else "met" if power > desired_power else "ruled out"
+        rows.append(tag(pd.DataFrame({"n_subjects": [cell.n_subjects], "n_items": [cell.n_items], "n_questions": [cell.n_questions],
+                                      "power_approx": [power], "decision": [decision]}), cell.params))
+    return pd.concat(rows, ignore_index=True)
+
+
+def screened_agg(DG, p_threshold, desired_power, combinations, question_sd, params:dict=None, margin:float=0.1,
+                 method:str="f", **kwargs) -> pd.DataFrame:
+    """`agg` over the cells `screen` leaves near the boundary; the rest keep their approximation.
+
+    `params` defaults to `DG.params` (a `BatchGenerator`). Other keyword
+    arguments go to `agg`. The result has the columns of `agg` plus
+    `power_approx` and `source` ("analytic" or "simulated"), in the order
+    of `combinations`.
+    """
+    params = DG.params if params is None else params
+    specs = list(cells(combinations))
+    screened = screen(params, specs, question_sd, desired_power, p_threshold, margin, method)
+    simulate = screened["decision"].eq("simulate").to_numpy()
+
+    out = screened.rename(columns={"decision": "decision_approx"})
+    out["power"] = out["power_approx"]
+    out["decision"] = out["decision_approx"]
+    out["iterations_run"] = 0
+    out["source"] = "analytic"
+    if simulate.any():
+        simulated = agg(DG, p_threshold, desired_power, [c for c, s in zip(specs, simulate) if s], question_sd, **kwargs)
+        for column in simulated:
+            out.loc[simulate, column] = simulated[column].to_numpy()
+        out.loc[simulate, "source"] = "simulated"
+    return out.drop(columns="decision_approx")
+
+
+def report(results:pd.DataFrame) -> pd.DataFrame:
+    """Approximation error against simulated cells (e.g. `screened_agg` output, or `agg` output
+    with a `power_approx` column added by `screen`).
+
+    Returns one row per simulated cell with the error and whether the
+    approximation lies inside the simulated confidence interval; the mean
+    absolute error and coverage are in `.attrs`.
+    """
+    sim = results[results["iterations_run"] > 0].copy()
+    sim["error"] = sim["power_approx"] - sim["power"]
+    if {"power_lower", "power_upper"} <= set(sim):
+        sim["covered"] = sim["power_approx"].between(sim["power_lower"], sim["power_upper"])
+        sim.attrs["coverage"] = float(sim["covered"].mean())
+    sim.attrs["mae"] = float(sim["error"].abs().mean())
+    return sim
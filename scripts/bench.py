@@ -0,0 +1,233 @@
+"""Benchmarks for the stages of the power loop.
+
+Times data generation (`DataGenerator.fit_transform` + `to_pandas` and
+`BatchGenerator.replicates`), serialization to R (`to_r` and
+`to_r_binary`), R worker startup, the `code()` fits, the numpy engine and
+statsmodels' `mixedlm` on the pipeline's `~question + item` spec
+(`MIXEDLM_SPEC`, fitted as `mixedlm_wrapper` does), over a ladder of
+(n_subject, n_item, n_question) sizes that includes the shapes of the
+CSVs in `data/`.
+
+Every benchmark records the best wall time of `--repeat` runs and the peak
+Python memory of one run (tracemalloc; memory used inside R is not
+included). Benchmarks whose dependency is missing are recorded as skipped.
+
+A run counts as a regression if any benchmark is slower than `--tolerance`
+times its baseline, or if its peak memory grows by more than
+`--memory-tolerance` times the baseline plus 1 MB. The extra megabyte keeps
+benchmarks that allocate almost nothing from flagging noise.
+
+No baseline is committed, because timings only compare on one machine.
+To create one, run the benchmarks on the machine that will be compared,
+at the commit to compare against, and keep the output:
+
+    git checkout <reference commit>
+    python bench.py --out bench_baseline.json
+    git checkout -
+
+A baseline whose python, machine or cpus differ from the current run is
+still compared, with a warning.
+
+Usage:
+    python bench.py --out bench.json
+    python bench.py --out bench.json --baseline bench_baseline.json    # exit 1 on regressions
+    python bench.py --only fit_numpy,serialize_binary --ladder 10x10x2
+"""
+
+import argparse
+import atexit
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from simulate import BatchGenerator
+from utils import cell_update, code
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+LADDER = [(10, 10, 2), (30, 20, 2), (50, 40, 3), (100, 40, 4)]
+PARAMS = {'word.perceptual': 100, 'image.perceptual': 95, 'word.conceptual': 100, 'image.conceptual': 100,
+          'sd.item': 30, 'sd.subject': 20, "sd.modality": 10, "sd.error": 50,
+          "sd.re_formula": "(1 + question | subject) + (1 + question | item)"}
+QUESTION_SD = np.array([10, 12, 15, 18, 11])
+
+
+def data_shapes() -> list[tuple]:
+    """(n_subject, n_item, n_question) of every CSV in data/"""
+    shapes = []
+    for path in sorted(glob.glob(os.path.join(DATA, "*.csv"))):
+        df = pd.read_csv(path, usecols=["subject", "item", "question"])
+        shapes.append(tuple(int(df[c].nunique()) for c in ("subject", "item", "question")))
+    return shapes
+
+
+def dataset(size) -> pd.DataFrame:
+    update = cell_update(size, QUESTION_SD)
+    design, Y = BatchGenerator(PARAMS).replicates(1, update, seed=2025)
+    return design.assign(rt=Y[0])
+
+
+def measure(fn, repeat:int=3) -> dict:
+    """Best wall time over `repeat` runs and peak traced memory of one run"""
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "peak_mb": peak / 2**20}
+
+
+# each benchmark: size -> zero-argument callable, or raises ImportError/RuntimeError to skip
+def generate_wiscs(size):
+    import wiscs
+    from wiscs.simulate import DataGenerator
+    update = {**PARAMS, **cell_update(size, QUESTION_SD)}
+    wiscs.set_params(update, verbose=False)
+    DG = DataGenerator()
+    return lambda: DG.fit_transform(seed=2025).to_pandas()
+
+def generate_batch(size):
+    BG, update = BatchGenerator(PARAMS), cell_update(size, QUESTION_SD)
+    return lambda: BG.replicates(10, update, seed=2025)
+
+def serialize_text(size):
+    from rinterface.utils import to_r
+    df = dataset(size)
+    return lambda: to_r(df)
+
+def serialize_binary(size):
+    from transport import write
+    df = dataset(size)
+    def run():
+        os.remove(write(df))
+    return run
+
+def r_startup(size):
+    from rpool import RWorker
+    if shutil.which("Rscript") is None:
+        raise RuntimeError("Rscript not found")
+    return lambda: RWorker().close()
+
+def fit_r(size):
+    from rpool import RWorker
+    if shutil.which("Rscript") is None:
+        raise RuntimeError("Rscript not found")
+    worker, df = RWorker(), dataset(size)
+    atexit.register(worker.close)
+    return lambda: worker.eval(code(df, 0.05), grab="success")
+
+def fit_numpy(size):
+    import lmm
+    df = dataset(size)
+    return lambda: lmm.compare(df)
+
+# the "random" spec of raw/stats_pipeline.py's batch comparison (which cannot be imported here)
+MIXEDLM_SPEC = {"formula": "rt ~ modality", "groups": "subject", "re_formula": "~question + item"}
+
+def fit_mixedlm(size):
+    import statsmodels.formula.api as smf
+    df = dataset(size)
+    formula, groups, re_formula = (MIXEDLM_SPEC[k] for k in ("formula", "groups", "re_formula"))
+    # the call mixedlm_wrapper makes for that spec
+    return lambda: smf.mixedlm(formula, df, groups=df[groups], re_formula=re_formula).fit(reml=False)
+
+BENCHMARKS = {
+    "generate_wiscs": generate_wiscs,
+    "generate_batch": generate_batch,
+    "serialize_text": serialize_text,
+    "serialize_binary": serialize_binary,
+    "r_startup": r_startup,
+    "fit_r": fit_r,
+    "fit_numpy": fit_numpy,
+    "fit_mixedlm": fit_mixedlm,
+}
+PER_SIZE = set(BENCHMARKS) - {"r_startup"}
+
+
+def bench(ladder:list[tuple], only:list[str]=None, repeat:int=3) -> dict:
+    """Run the benchmarks and return {"meta": ..., "results": [...]}"""
+    results = []
+    for name in only or BENCHMARKS:
+        for size in ladder if name in PER_SIZE else ladder[:1]:
+            entry = {"benchmark": name, "size": "x".join(map(str, size)) if name in PER_SIZE else "-"}
+            try:
+                entry.update(measure(BENCHMARKS[name](size), repeat))
+            except (ImportError, RuntimeError, OSError) as e:
+                entry["skipped"] = f"{type(e).__name__}: {e}"
+            results.append(entry)
+            print(entry, file=sys.stderr)
+    meta = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+
+def compare(current:dict, baseline:dict, tolerance:float=1.25, memory_tolerance:float=1.25) -> pd.DataFrame:
+    """Side-by-side timings and peak memory.
+
+    `regression` where current is slower than `tolerance` x baseline or
+    its peak memory exceeds `memory_tolerance` x baseline + 1 MB.
+    Benchmarks missing or skipped in either run are never regressions.
+    """
+    key = ["benchmark", "size"]
+    cur = pd.DataFrame(current["results"]).reindex(columns=key + ["seconds", "peak_mb"])
+    base = pd.DataFrame(baseline["results"]).reindex(columns=key + ["seconds", "peak_mb"])
+    out = cur.merge(base, on=key, how="left", suffixes=("", "_baseline"))
+    out["ratio"] = out["seconds"] / out["seconds_baseline"]
+    out["memory_ratio"] = out["peak_mb"] / out["peak_mb_baseline"]
+    out["regression"] = (out["ratio"] > tolerance) | (out["peak_mb"] > memory_tolerance * out["peak_mb_baseline"] + 1)
+    return out
+
+
+def mismatch(current:dict, baseline:dict) -> list[str]:
+    """Fields of `meta` that differ between the runs, which makes their timings incomparable"""
+    before, after = baseline.get("meta", {}), current["meta"]
+    return [f"{k}: {before.get(k)} -> {after.get(k)}" for k in ("python", "machine", "cpus") if before.get(k) != after.get(k)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    parser.add_argument("--memory-tolerance", type=float, default=1.25,
+                        help="peak memory ratio (plus 1 MB) counted as a regression")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--ladder", help="comma-separated SxIxQ sizes; default is LADDER plus the data/ shapes")
+    args = parser.parse_args(argv)
+
+    if args.ladder:
+        ladder = [tuple(int(n) for n in s.split("x")) for s in args.ladder.split(",")]
+    else:
+        ladder = sorted(set(LADDER + data_shapes()), key=np.prod)
+    only = args.only.split(",") if args.only else None
+
+    current = bench(ladder, only, args.repeat)
+    with open(args.out, "w") as f:
+        json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for field in mismatch(current, baseline):
+            print(f"warning: baseline from another environment ({field})", file=sys.stderr)
+        table = compare(current, baseline, args.tolerance, args.memory_tolerance)
+        print(table.to_string(index=False))
+        if table["regression"].any():
+            sys.exit(1)
+    else:
+        print(pd.DataFrame(current["results"]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""Native linear mixed models for the shared vs. separate comparison.
+
+Fits, by maximum likelihood,
+
+    shared:    rt ~ modality + question + (1 + question | subject) + (1 + question | item)
+    separate:  rt ~ modality * question + (1 + question | subject) + (1 + question | item)
+
+with the same coding as `code()`: modality levels ("word", "image") with
+contrast (-0.5, 0.5) and treatment-coded question (reference "0").
+
+The objective is lme4's profiled ML deviance (Bates et al., 2015). Writing
+u = Lambda' b for the spherical random effects and L for the Cholesky
+factor of Lambda' Z'Z Lambda + I,
+
+    d(theta) = log|L|^2 + n * (1 + log(2 * pi * r2(theta) / n))
+
+where r2 is the penalized residual sum of squares. Z'Z is sparse and
+block structured: the subject block is block diagonal (one k x k block per
+subject), so it is factored block by block and eliminated first. What is
+left is a dense system the size of the item and fixed-effect columns.
+
+The response only enters through the cross-products Zs'y, Zi'y, X'y and
+y'y. When the design is balanced (every subject x item x question x
+modality cell observed once, as simulated), these follow from the cell
+sums in a `Summary`: sums of y per (subject, question), (item, question)
+and (modality, question) plus y'y. Both models of a comparison are fitted
+from one `Summary`, and unbalanced data fall back to the row-level
+sparse products.
+
+Agreement with lme4 is checked by `validate_lmm.py`, which needs R and
+records its comparison in `VALIDATION`. `validated` reads that record;
+`power.py` only runs the numpy backend once it exists and agrees.
+"""
+
+import csv
+import os
+from typing import NamedTuple
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import minimize
+from scipy.stats import chi2
+
+LEVELS = ("word", "image")
+CONTRAST = np.array([-0.5, 0.5])
+INFLATE = (0.01, 0.1, 1.0) # variance added to singular fits before a restart, relative to the mean variance
+VALIDATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "validate_lmm.csv")
+AGREEMENT = {"loglik_shared": 0.01, "loglik_separate": 0.01, "aic_shared": 0.02, "aic_separate": 0.02,
+             "chisq": 0.02, "p_value": 1e-3} # largest absolute difference from lme4 in `VALIDATION`
+
+
+def _codes(values):
+    """Integer codes 0..K-1 for a column of labels, in sorted label order"""
+    return np.unique(np.asarray(values), return_inverse=True)[1]
+
+
+class Summary(NamedTuple):
+    """Sufficient statistics of a response on a balanced design"""
+    subject_question: np.ndarray # (n_subject, k) sums of y
+    item_question: np.ndarray # (n_item, k)
+    modality_question: np.ndarray # (2, k)
+    yy: float
+
+
+class CrossedLMM:
+    """ML fit of `rt ~ fixed + (1 + question | subject) + (1 + question | item)`.
+
+    The design (and everything in the cross-products that does not depend
+    on the response) is built once; `fit` can then be called with any
+    response vector of matching length.
+
+    Parameters
+    ----------
+    subject, item, question: array-like
+        Integer or label codes, one per row.
+    modality: array-like
+        "word"/"image" labels or 0/1 codes.
+    interaction: bool
+        Include the modality x question interaction (the separate model).
+        Default is False (the shared model).
+    """
+    def __init__(self, subject, item, question, modality, interaction:bool=False):
+        modality = np.asarray(modality)
+        if modality.dtype.kind in "OUS":
+            modality = np.array([LEVELS.index(m) for m in modality])
+        self.subject = _codes(subject)
+        self.item = _codes(item)
+        self.question = _codes(question)
+        self.modality = modality.astype(int)
+        self.interaction = interaction
+
+        self.n = len(self.subject)
+        self.n_subject = self.subject.max() + 1
+        self.n_item = self.item.max() + 1
+        self.k = self.question.max() + 1 # random terms per grouping factor
+
+        # random-effect template: intercept + treatment-coded question
+        T = np.zeros((self.n, self.k))
+        T[:, 0] = 1
+        T[np.arange(self.n), self.question] = 1
+        self.X = self._fixed(T)
+        self.p = self.X.shape[1]
+        self.Zs = self._z(self.subject, self.n_subject, T)
+        self.Zi = self._z(self.item, self.n_item, T)
+
+        self.ZsZs = self._blocks(self.Zs.T @ self.Zs, self.n_subject)
+        self.ZiZi = self._blocks(self.Zi.T @ self.Zi, self.n_item)
+        self.ZsZi = (self.Zs.T @ self.Zi).toarray().reshape(self.n_subject, self.k, self.n_item, self.k)
+        self.ZsX = (self.Zs.T @ self.X).reshape(self.n_subject, self.k, self.p)
+        self.ZiX = (self.Zi.T @ self.X).reshape(self.n_item, self.k, self.p)
+        self.XX = self.X.T @ self.X
+
+        # balanced: every (modality, subject, question, item) cell exactly once
+        cell = ((self.modality * self.n_subject + self.subject) * self.k + self.question) * self.n_item + self.item
+        self.balanced = self.n == 2 * self.n_subject * self.k * self.n_item and \
+            np.array_equal(np.bincount(cell, minlength=self.n), np.ones(self.n, dtype=int))
+        order = np.argsort(cell) if self.balanced else None
+        self._order = None if order is None or np.array_equal(order, np.arange(self.n)) else order
+
+        self._tril = np.tril_indices(self.k)
+        self._diag = np.flatnonzero(self._tril[0] == self._tril[1])
+        self.n_theta = 2 * len(self._tril[0])
+        self.n_par = self.p + self.n_theta + 1 # fixed effects, theta, residual sd
+
+    @property
+    def names(self) -> list[str]:
+        """Fixed-effect names in lme4's order"""
+        questions = [f"question{q}" for q in range(1, self.k)]
+        return ["(Intercept)", "modality", *questions] + ([f"modality:{q}" for q in questions] if self.interaction else [])
+
+    def covariance(self, theta, sigma) -> tuple[np.ndarray, np.ndarray]:
+        """Random-effect covariance matrices (subject, item) at `theta` with residual SD `sigma`"""
+        return tuple(sigma**2 * L @ L.T for L in self._lambda(np.asarray(theta)))
+
+    def _fixed(self, T):
+        c = CONTRAST[self.modality]
+        columns = [T[:, :1], c[:, None], T[:, 1:]]
+        if self.interaction:
+            columns.append(c[:, None] * T[:, 1:])
+        return np.hstack(columns)
+
+    def _z(self, group, n_group, T):
+        rows = np.repeat(np.arange(self.n), self.k)
+        cols = (group[:, None] * self.k + np.arange(self.k)).ravel()
+        return sp.csr_matrix((T.ravel(), (rows, cols)), shape=(self.n, n_group * self.k))
+
+    def _blocks(self, M, n_group):
+        """Diagonal k x k blocks of a block-diagonal sparse matrix"""
+        M = M.tocoo()
+        out = np.zeros((n_group, self.k, self.k))
+        np.add.at(out, (M.row // self.k, M.row % self.k, M.col % self.k), M.data)
+        return out
+
+    def _lambda(self, theta):
+        half = len(theta) // 2
+        Ls, Li = np.zeros((self.k, self.k)), np.zeros((self.k, self.k))
+        Ls[self._tril] = theta[:half]
+        Li[self._tril] = theta[half:]
+        return Ls, Li
+
+    def reduce(self, y) -> Summary:
+        """Cell sums of `y` (balanced designs only, see `balanced`)"""
+        if not self.balanced:
+            raise ValueError("Cell sums need a balanced design; use the row-level response")
+        y = np.asarray(y, dtype=float)
+        Y = (y if self._order is None else y[self._order]).reshape(2, self.n_subject, self.k, self.n_item)
+        return Summary(Y.sum(axis=(0, 3)), Y.sum(axis=(0, 1)).T, Y.sum(axis=(1, 3)), float(y @ y))
+
+    def cross(self, y):
+        """Response cross-products (Zs'y, Zi'y, X'y, y'y) from a response vector or its `Summary`"""
+        if not isinstance(y, Summary) and self.balanced:
+            y = self.reduce(y)
+        if isinstance(y, Summary):
+            sq, iq, mq, yy = y
+            Zsy = np.column_stack([sq.sum(axis=1), sq[:, 1:]])
+            Ziy = np.column_stack([iq.sum(axis=1), iq[:, 1:]])
+            by_modality = CONTRAST @ mq
+            Xy = [[mq.sum(), by_modality.sum()], mq[:, 1:].sum(axis=0)]
+            if self.interaction:
+                Xy.append(by_modality[1:])
+            return Zsy, Ziy, np.concatenate(Xy), yy
+        y = np.asarray(y, dtype=float)
+        return (
+            (self.Zs.T @ y).reshape(self.n_subject, self.k),
+            (self.Zi.T @ y).reshape(self.n_item, self.k),
+            self.X.T @ y,
+            y @ y,
+        )
+
+    def _factor(self, theta, cross):
+        """Block Cholesky factorization of the penalized system at `theta`"""
+        Zsy, Ziy, Xy, yy = cross
+        S, I, k, p = self.n_subject, self.n_item, self.k, self.p
+        Ls, Li = self._lambda(theta)
+
+        # subject blocks: A_ss[s] = Ls' Zs'Zs[s] Ls + I
+        A_ss = Ls.T @ self.ZsZs @ Ls + np.eye(k)
+        C_ss = np.linalg.cholesky(A_ss)
+        logdet = 2 * np.log(np.diagonal(C_ss, axis1=1, axis2=2)).sum()
+
+        # everything coupled to the subject blocks, eliminated through C_ss
+        A_si = np.einsum("ba,sbic,cd->said", Ls, self.ZsZi, Li).reshape(S, k, I * k)
+        rhs = np.concatenate([A_si, Ls.T @ self.ZsX, (Zsy @ Ls)[:, :, None]], axis=2)
+        W = np.linalg.solve(C_ss, rhs).reshape(S * k, -1)
+
+        # augmented system [[A_ii, B_i, c_i], [B_i', X'X, X'y], [c_i', y'X, y'y]]
+        m = I * k + p
+        M = np.zeros((m + 1, m + 1))
+        A_ii = Li.T @ self.ZiZi @ Li + np.eye(k)
+        for i in range(I):
+            M[i * k:(i + 1) * k, i * k:(i + 1) * k] = A_ii[i]
+        M[:I * k, I * k:m] = (Li.T @ self.ZiX).reshape(I * k, p)
+        M[:I * k, m] = (Ziy @ Li).ravel()
+        M[I * k:m, I * k:m] = self.XX
+        M[I * k:m, m] = Xy
+        M[m, m] = yy
+        M = np.triu(M) + np.triu(M, 1).T
+        M -= W.T @ W
+
+        C = np.linalg.cholesky(M)
+        d = np.diagonal(C)
+        logdet += 2 * np.log(d[:I * k]).sum()
+        r2 = d[m] ** 2
+        dev = logdet + self.n * (1 + np.log(2 * np.pi * r2 / self.n))
+        # beta solves the upper triangle of the fixed-effect block against the last row
+        beta = np.linalg.solve(C[I * k:m, I * k:m].T, C[m, I * k:m])
+        return dev, r2, beta, (Ls, Li, A_ss, A_si, C[:I * k, :I * k])
+
+    def deviance(self, theta, cross, fixef:bool=False):
+        """Profiled ML deviance at `theta` for response cross-products `cross`.
+
+        Returns the deviance and the penalized residual sum of squares, and
+        with `fixef` also the conditional estimates of the fixed effects.
+        """
+        dev, r2, beta, _ = self._factor(theta, cross)
+        return (dev, r2, beta) if fixef else (dev, r2)
+
+    def gradient(self, theta, cross) -> tuple[float, np.ndarray]:
+        """Profiled ML deviance at `theta` and its gradient.
+
+        With G = Lambda Lambda', V0 = Z G Z' + I and the conditional
+        residual r = y - X beta - Z Lambda u,
+
+            d dev = tr(Z' V0^-1 Z dG) - n / r2 * (Z'r)' dG (Z'r)
+
+        and Z' V0^-1 Z Lambda = Z'Z Lambda A^-1 with A = Lambda' Z'Z Lambda + I,
+        so only the diagonal blocks of A^-1 and its subject x item block
+        are needed.
+        """
+        Zsy, Ziy, Xy, yy = cross
+        S, I, k = self.n_subject, self.n_item, self.k
+        dev, r2, beta, (Ls, Li, A_ss, A_si, C_ii) = self._factor(theta, cross)
+
+        # spherical modes u from A u = Lambda' Z'(y - X beta), item block via its Schur complement
+        ys = Zsy - self.ZsX @ beta
+        yi = Ziy - self.ZiX @ beta
+        P = np.linalg.solve(A_ss, A_si) # A_ss^-1 A_si per subject, (S, k, I k)
+        Sinv = np.linalg.inv(C_ii)
+        Sinv = Sinv.T @ Sinv # inverse Schur complement of the item block
+        rs = ys @ Ls
+        zs = np.linalg.solve(A_ss, rs[:, :, None])[:, :, 0]
+        ui = Sinv @ ((yi @ Li).ravel() - np.einsum("sk,skj->j", zs, A_si))
+        us = zs - P @ ui
+        ui = ui.reshape(I, k)
+
+        # Z'r per group
+        ZsZi_Li = np.einsum("sbic,cd->sbid", self.ZsZi, Li) # Zs'Zi Li, (S, k, I, k)
+        ZiZs_Ls = np.einsum("sbic,bd->icsd", self.ZsZi, Ls) # Zi'Zs Ls, (I, k, S, k)
+        vs = ys - np.einsum("sbc,sc->sb", self.ZsZs @ Ls, us) - np.einsum("sbid,id->sb", ZsZi_Li, ui)
+        vi = yi - np.einsum("ibc,ic->ib", self.ZiZi @ Li, ui) - np.einsum("icsd,sd->ic", ZiZs_Ls, us)
+
+        # diagonal blocks of Z' V0^-1 Z Lambda = Z'Z Lambda A^-1
+        PS = P @ Sinv # -(A^-1)_si, (S, k, I k)
+        Ainv_ss = np.linalg.inv(A_ss) + np.einsum("sak,sbk->sab", PS, P)
+        Ts = self.ZsZs @ Ls @ Ainv_ss - np.einsum("sbj,saj->sba", ZsZi_Li.reshape(S, k, I * k), PS)
+        Sinv_ii = Sinv.reshape(I, k, I, k)[np.arange(I), :, np.arange(I), :]
+        PS = PS.reshape(S, k, I, k)
+        Ti = self.ZiZi @ Li @ Sinv_ii - np.einsum("icsd,sdia->ica", ZiZs_Ls, PS)
+
+        scale = self.n / r2
+        gs = 2 * (Ts.sum(axis=0) - scale * np.einsum("sa,sb->ab", vs, us))
+        gi = 2 * (Ti.sum(axis=0) - scale * np.einsum("ia,ib->ab", vi, ui))
+        return dev, np.concatenate([gs[self._tril], gi[self._tril]])
+
+    def default_start(self) -> np.ndarray:
+        """lme4's starting theta (identity relative factors)"""
+        start = np.zeros(self.n_theta)
+        start[self._diag] = 1
+        start[len(self._tril[0]) + self._diag] = 1
+        return start
+
+    def _inflate(self, theta, delta:float=0.1) -> np.ndarray:
+        """Theta of the covariances at `theta` with `delta` x their mean variance added to the diagonal"""
+        out = []
+        for L in self._lambda(theta):
+            G = L @ L.T
+            G += delta * max(np.trace(G) / self.k, 1e-2) * np.eye(self.k)
+            out.append(np.linalg.cholesky(G)[self._tril])
+        return np.concatenate(out)
+
+    def _optimal(self, theta, grad, cross, gtol:float) -> bool:
+        """Whether the gradient `grad` of the deviance at `theta` is zero within `gtol`.
+
+        Diagonals of theta at their bound may only push into it. Over
+        thousands of observations, rounding alone can leave a gradient
+        above `gtol`; the check then falls back to lme4's scaled gradient,
+        the Newton step H^-1 grad on the free parameters.
+        """
+        at_bound = np.zeros(self.n_theta, dtype=bool)
+        diag = np.concatenate([self._diag, len(self._tril[0]) + self._diag])
+        at_bound[diag] = theta[diag] <= 0
+        if np.any(grad[at_bound] < -gtol):
+            return False
+        free = np.flatnonzero(~at_bound)
+        step = grad[free]
+        if np.max(np.abs(step), initial=0) > gtol:
+            hessian = np.empty((len(free), len(free)))
+            for col, j in enumerate(free):
+                h = 1e-4 * max(1, abs(theta[j]))
+                e = np.zeros(self.n_theta)
+                e[j] = h
+                change = self.gradient(theta + e, cross)[1] - self.gradient(theta - e, cross)[1]
+                hessian[:, col] = change[free] / (2 * h)
+            try:
+                step = np.linalg.solve((hessian + hessian.T) / 2, step)
+            except np.linalg.LinAlgError:
+                return False
+        return bool(np.max(np.abs(step), initial=0) <= gtol)
+
+    def fit(self, y, start=None, maxiter:int=10000, gtol:float=1e-3, restarts:int=5) -> dict:
+        """Fit the model to response `y` by ML.
+
+        L-BFGS-B on the analytic gradient (`gradient`). A fit that ends with
+        a variance diagonal of theta on its bound (a singular covariance)
+        can be a local optimum of the Cholesky parameterization only, since
+        the zero fixes which random term is the dependent one. Such fits are
+        restarted from the same covariances with some variance added to the
+        diagonal (`INFLATE`) and re-factored, as long as that improves the
+        deviance.
+
+        Parameters
+        ----------
+        y: array-like or Summary
+            Response vector, or its cell sums for a balanced design.
+        start: array-like
+            Starting theta. Default is `default_start`. A start of the
+            wrong length falls back to the default, and a start that does
+            not reach a converged optimum is also refitted from the default,
+            keeping the better fit.
+        maxiter: int
+            Maximum number of optimizer iterations per run.
+        gtol: float
+            Optimality tolerance on the projected gradient of the deviance.
+        restarts: int
+            Most restarts from a singular fit.
+
+        Returns
+        -------
+        dict
+            loglik, aic, bic, deviance, theta, sigma, beta (fixed effects in
+            the column order of `names`), nfev, converged (the gradient is zero
+            within `gtol`, see `_optimal`) and singular (a diagonal of
+            theta at its bound, as lme4's `isSingular`).
+        """
+        cross = self.cross(y)
+        warm = start is not None and len(start) == self.n_theta
+        diag = np.concatenate([self._diag, len(self._tril[0]) + self._diag])
+        bounds = [(None, None)] * self.n_theta
+        for j in diag:
+            bounds[j] = (0, None)
+
+        def objective(theta):
+            try:
+                return self.gradient(theta, cross)
+            except np.linalg.LinAlgError:
+                return np.inf, np.zeros(self.n_theta)
+
+        nfev = 0
+
+        def optimize(theta0):
+            nonlocal nfev
+            res = minimize(objective, np.asarray(theta0, dtype=float), jac=True, method="L-BFGS-B", bounds=bounds,
+                           options={"maxiter": maxiter, "ftol": 1e-14, "gtol": gtol / 10})
+            nfev += res.nfev
+            theta, best = res.x, res.fun
+            for _ in range(restarts):
+                if not np.any(theta[diag] < 1e-4):
+                    break
+                # nearby optima can be reached from some inflations and not others
+                for delta in INFLATE:
+                    res = minimize(objective, self._inflate(theta, delta), jac=True, method="L-BFGS-B", bounds=bounds,
+                                   options={"maxiter": maxiter, "ftol": 1e-14, "gtol": gtol / 10})
+                    nfev += res.nfev
+                    if res.fun < best - 1e-8:
+                        theta, best = res.x, res.fun
+                        break
+                else:
+                    break
+            dev, grad = objective(theta)
+            return theta, dev, bool(np.isfinite(dev)) and self._optimal(theta, grad, cross, gtol)
+
+        theta, dev, converged = optimize(start if warm else self.default_start())
+        if warm and not converged:
+            cold = optimize(self.default_start())
+            if cold[1] <= dev:
+                theta, dev, converged = cold
+        dev, r2, beta = self.deviance(theta, cross, fixef=True)
+        return {
+            "loglik": -dev / 2,
+            "aic": dev + 2 * self.n_par,
+            "bic": dev + np.log(self.n) * self.n_par,
+            "deviance": dev,
+            "theta": theta,
+            "sigma": np.sqrt(r2 / self.n),
+            "beta": beta,
+            "nfev": nfev,
+            "converged": converged,
+            "singular": bool(np.any(theta[diag] < 1e-4)),
+        }
+
+
+def validated(path:str=VALIDATION) -> bool:
+    """Whether the lme4 comparison recorded by `validate_lmm.py --out` exists and agrees within `AGREEMENT`"""
+    if not os.path.exists(path):
+        return False
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row["field"] in AGREEMENT]
+    return bool(rows) and all(float(row["abs_diff"]) <= AGREEMENT[row["field"]] for row in rows)
+
+
+def build_models(df) -> tuple[CrossedLMM, CrossedLMM]:
+    """Shared and separate models for the design of `df` (rt is not used)"""
+    columns = (df["subject"], df["item"], df["question"], df["modality"])
+    return CrossedLMM(*columns), CrossedLMM(*columns, interaction=True)
+
+
+def compare(df, start:dict=None, models:tuple=None) -> dict:
+    """Fit the shared and separate models to `df` and run the chi-square LRT.
+
+    Equivalent to `anova(shared, separate, test="Chisq")` in `code()`.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Data with subject, item, question, modality and rt columns.
+    start: dict
+        Optional starting theta per model ({"shared": ..., "separate": ...}).
+        The separate model defaults to the shared model's estimate, which
+        it nests.
+    models: tuple[CrossedLMM, CrossedLMM]
+        Shared and separate models built by `build_models` for the same design
+        and row order, reused instead of building the design again.
+
+    Returns
+    -------
+    dict
+        Shared/separate loglik and AIC, the chi-square statistic, its df,
+        the p-value, the theta of both fits, their total nfev and whether
+        both converged / either is singular.
+    """
+    start = start or {}
+    shared_model, separate_model = models or build_models(df)
+    # one reduction feeds both fits; unbalanced designs keep the rows
+    y = shared_model.reduce(df["rt"]) if shared_model.balanced else df["rt"]
+    shared = shared_model.fit(y, start.get("shared"))
+    separate = separate_model.fit(y, start.get("separate", shared["theta"]))
+    return {
+        **_lrt(shared, separate, len(df["question"].unique()) - 1),
+        "theta_shared": shared["theta"],
+        "theta_separate": separate["theta"],
+        "nfev": int(shared["nfev"] + separate["nfev"]),
+        "converged": shared["converged"] and separate["converged"],
+        "singular": shared["singular"] or separate["singular"],
+    }
+
+
+def _lrt(shared:dict, separate:dict, df:int) -> dict:
+    chisq = max(2 * (separate["loglik"] - shared["loglik"]), 0)
+    return {
+        "loglik_shared": shared["loglik"],
+        "loglik_separate": separate["loglik"],
+        "aic_shared": shared["aic"],
+        "aic_separate": separate["aic"],
+        "chisq": chisq,
+        "df": df,
+        "p_value": chi2.sf(chisq, df),
+    }
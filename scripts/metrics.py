@@ -0,0 +1,106 @@
+"""Per-phase timings and fit diagnostics of a power sweep.
+
+Every fitted iteration produces a `Record`: seconds spent in each phase
+
+- update: building the cell's generator parameters (`cell_update`)
+- generate: simulating data (`fit_transform` or `BatchGenerator.replicates`)
+- convert: turning the simulated data into the fitted DataFrame/design
+- script: building the R script (`code`, `refit_code`)
+- execute: running the fits (R or `lmm.compare`)
+- parse: reading the results back
+
+plus the fit's optimizer evaluations (`nfev`, both models) and its
+`converged` and `singular` flags. Phases that happen once per cell (the
+update and, for a `BatchGenerator`, the generation of all replicates) are
+charged to the first iteration fitted after them.
+
+Pass a `Metrics` to `run`/`agg` to collect the records; `summary()` then
+aggregates them per cell and names the phase each cell spent most time in:
+
+    >>> metrics = Metrics("metrics.jsonl")
+    >>> results = agg(DG, 0.05, 0.8, combinations, question_sd, metrics=metrics)
+    >>> metrics.summary()
+
+With a `path`, every record is also appended to that JSON-lines file as it
+arrives. Worker processes (`scheduler="cell"` without a pool) cannot hand
+records back to the parent, so they only reach it through the file.
+"""
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+import pandas as pd
+
+from sweep import label
+
+PHASES = ("update", "generate", "convert", "script", "execute", "parse")
+DIAGNOSTICS = ("nfev", "converged", "singular")
+
+
+class Record(dict):
+    """Phase timings and fit diagnostics of one iteration"""
+    @contextmanager
+    def phase(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0.0) + time.perf_counter() - start
+
+
+class Metrics:
+    """Collects `Record`s from `run`/`agg`.
+
+    Parameters
+    ----------
+    path: str
+        Optional JSON-lines file every record is appended to.
+    """
+    def __init__(self, path:str=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a copy in a worker process only writes to the file
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def add(self, row, j:int, record:Record, params:dict=None):
+        """Store the record of iteration `j` of cell `row` (with parameter overrides `params`)"""
+        n_subject, n_item, n_question = (int(n) for n in row)
+        entry = {"n_subjects": n_subject, "n_items": n_item, "n_questions": n_question,
+                 **{name: label(value) for name, value in (params or {}).items()}, "iteration": int(j), **record}
+        with self._lock:
+            self.records.append(entry)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def frame(self) -> pd.DataFrame:
+        """One row per record; read from `path` if set, so records of worker processes are included"""
+        if self.path is not None:
+            try:
+                return pd.read_json(self.path, lines=True)
+            except (FileNotFoundError, ValueError):
+                pass
+        return pd.DataFrame(self.records)
+
+    def summary(self) -> pd.DataFrame:
+        """Per-cell totals of every phase, mean nfev, convergence and singular rates and the dominant phase"""
+        df = self.frame()
+        if df.empty:
+            return df
+        cell = [c for c in df if c not in PHASES + DIAGNOSTICS + ("iteration",)]
+        phases = [p for p in PHASES if p in df]
+        df[phases] = df[phases].fillna(0)
+        out = df.groupby(cell, dropna=False).agg(iterations=("iteration", "size"), **{p: (p, "sum") for p in phases})
+        for column in DIAGNOSTICS:
+            if column in df:
+                out[column] = df.groupby(cell, dropna=False)[column].mean()
+        out["seconds"] = out[phases].sum(axis=1)
+        out["bound"] = out[phases].idxmax(axis=1)
+        return out.reset_index()
@@ -0,0 +1,131 @@
+"""Adaptive search for the minimum-n frontier.
+
+Power is monotone in n_subject and n_item, so a full `grid()` sweep wastes
+most of its cells. The search bisects along one of these two axes: for
+every (n_question, n_item) line it finds the smallest n_subject reaching
+`desired_power` (or, with `over="items"`, the smallest n_item for every
+(n_question, n_subject) line), and every finished cell settles its
+neighbours:
+
+    pass at (s, i)  ->  pass for every s' >= s, i' >= i
+    fail at (s, i)  ->  fail for every s' <= s, i' <= i
+
+Power need not be monotone in n_question, so questions are never bisected:
+every n_question gets its own frontier. Lines are searched concurrently.
+Pending probes whose outcome a finished cell already implies are
+cancelled.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from copy import deepcopy
+import numpy as np
+import pandas as pd
+
+from utils import run
+
+
+AXES = ("subjects", "items")
+
+
+class _Line:
+    """Bisection state for one line (n_question, index `fixed` of the other axis) over indices of the searched axis"""
+    def __init__(self, question, fixed, n):
+        self.question, self.fixed = question, fixed
+        self.lo, self.hi = 0, n # every index < lo fails, every index >= hi passes
+        self.probe = None
+
+    @property
+    def done(self):
+        return self.lo >= self.hi
+
+
+def frontier(DG, p_threshold, desired_power, subjects, items, questions, question_sd, over="subjects", n_jobs=8,
+             pool=None, **kwargs):
+    """Minimum n_subject reaching `desired_power` for each (n_question, n_item).
+
+    With `over="items"`, the minimum n_item for each (n_question, n_subject)
+    instead.
+
+    Parameters
+    ----------
+    DG, p_threshold, desired_power, question_sd
+        As in `run`.
+    subjects, items, questions: array-like
+        Candidate design sizes, searched in ascending order.
+    over: str
+        Axis to bisect, "subjects" or "items". Every candidate of the other
+        two axes gets its own line.
+    n_jobs: int
+        Number of cells simulated concurrently.
+    pool: rpool.RPool
+        Warm R workers; cells then run on threads instead of processes.
+    **kwargs
+        Passed on to `run` (e.g. `n_iter`, `backend`, `stopping`).
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        The frontier (`min_subjects` or `min_items` is NaN where no
+        candidate reaches `desired_power`) and the results of every
+        simulated cell.
+    """
+    if over not in AXES:
+        raise ValueError(f"over must be one of {AXES}, got {over!r}")
+    subjects, items, questions = (np.sort(np.asarray(a)) for a in (subjects, items, questions))
+    searched, fixed = (subjects, items) if over == "subjects" else (items, subjects)
+    lines = [_Line(q, f, len(searched)) for q in range(len(questions)) for f in range(len(fixed))]
+    kwargs.setdefault("verbose", False)
+
+    if pool is not None:
+        executor = ThreadPoolExecutor(len(pool))
+        kwargs["pool"] = pool
+    else:
+        executor = ProcessPoolExecutor(n_jobs)
+
+    def submit(line):
+        line.probe = (line.lo + line.hi) // 2
+        s, i = (line.probe, line.fixed) if over == "subjects" else (line.fixed, line.probe)
+        row = (subjects[s], items[i], questions[line.question])
+        generator = deepcopy(DG) if pool is not None else DG
+        return executor.submit(run, generator, p_threshold, desired_power, row, question_sd, **kwargs)
+
+    def settle(question, fixed, probe, passed):
+        for line in lines:
+            if line.question != question:
+                continue
+            if passed and line.fixed >= fixed:
+                line.hi = min(line.hi, probe)
+            elif not passed and line.fixed <= fixed:
+                line.lo = max(line.lo, probe + 1)
+
+    cells, pending = [], {}
+    with executor:
+        while True:
+            for line in lines:
+                if not line.done and line.probe is None:
+                    pending[submit(line)] = line
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                line = pending.pop(future)
+                result = future.result()
+                cells.append(result)
+                settle(line.question, line.fixed, line.probe, bool(result["power"].iloc[0] >= desired_power))
+                line.probe = None
+
+            # drop probes whose outcome is already implied
+            for future, line in list(pending.items()):
+                if not (line.lo <= line.probe < line.hi) and future.cancel():
+                    pending.pop(future)
+                    line.probe = None
+
+    other = "items" if over == "subjects" else "subjects"
+    rows = [{
+        "n_questions": questions[line.question],
+        f"n_{other}": fixed[line.fixed],
+        f"min_{over}": searched[line.hi] if line.hi < len(searched) else np.nan,
+    } for line in lines]
+    cells = pd.concat(cells, ignore_index=True) if cells else pd.DataFrame()
+    return pd.DataFrame(rows), cells
@@ -1,48 +1,309 @@
-#!/usr/bin/bash
-
-from utils import grid, agg
-
-import wiscs
-from wiscs.utils import make_tasks
-from wiscs.simulate import DataGenerator
-from wiscs.formula import Formula
-
-import numpy as np
-
-# create a baseline model
-n_question = 2
-n_item = 2
-n_subject = 2
-task = make_tasks(low=100, high=200, n=n_question, seed=2025)
-re_formula = Formula("(1 + question | subject) + (1 + question | item)")
-question_sd = [10, 12, 15, 18, 11] # must be n_q - 1
-params = {'word.perceptual': 100, 'image.perceptual': 95, 'word.conceptual': 100, 'image.conceptual': 100, 'word.task': task, 'image.task': task,
-        # noise parameters     
-        'sd.item': 30,     'sd.question': question_sd[:n_question-1],    'sd.subject': 20,       "sd.modality": 10, "sd.error": 50, "sd.re_formula": str(re_formula),
-        # correlations among random effects    
-        "corr.subject": np.eye(n_question), 'corr.item':np.eye(n_question),
-        # design parameters
-        'n.subject': n_subject, 'n.question': n_question, 'n.item': n_item
+"""Command-line entry point for power sweeps.
+
+A sweep is described by a JSON config; `python power.py init sweep.json`
+writes the example below:
+
+    params          base generating parameters, as for `wiscs.set_params`
+    question_sd     SDs of the question effects (cut to n_question - 1 per cell)
+    subjects, items, questions
+                    design sizes: a list or {"start": .., "stop": .., "step": ..}
+    axes            optional generating-parameter axes, see `sweep.Sweep`
+    n_iter, desired_power, p_threshold, seed
+    backend         "R" or "numpy" (needs the lme4 comparison recorded by validate_lmm.py)
+    generator       "wiscs" (DataGenerator) or "batch" (simulate.BatchGenerator)
+    r_workers       size of an `rpool.RPool` for the R backend (optional)
+    r_timeout       seconds before a hung R worker is killed and replaced (optional)
+    options         passed on to `agg` (parallelize, n_jobs, stopping, crn, ...)
+
+Usage:
+    python power.py cells sweep.json                  # list the cells
+    python power.py run sweep.json --dry-run          # finished / started / remaining cells
+    python power.py run sweep.json -o power.csv       # run, resuming from --db
+
+Instead of the full grid, `frontier` bisects the config's candidates for
+the smallest n_subject (or, with `--over items`, n_item) reaching
+desired_power on every other combination (`planner.frontier`):
+
+    python power.py frontier sweep.json -o frontier.csv --cells probed.csv
+
+A sweep split over nodes runs each shard as an independent job (the
+shard defaults to the SLURM array task) and merges the shard results:
+
+    python power.py run sweep.json --shard 3 --n-shards 16 --out shards/
+    python power.py merge shards/ -o power.csv
+
+Cells are dealt to shards by decreasing cost (`sweep.Sweep.shard`). Each
+shard checkpoints to its own store in `--out`, so a killed job resumes.
+Seeds depend only on the config seed and the cell, and fits start from
+lme4's default start, so the results do not depend on the number of
+shards. With `"warm_start": true` in `options` they can: a warm fit starts
+from whichever iteration its worker ran before, and where the likelihood
+has several optima this can flip an LRT (see `schedule.sweep`).
+
+Only the standard library, `sweep` and `store` are imported up front, so
+listing cells, dry runs and resuming a finished sweep take milliseconds.
+The fitting code is imported once there is work to do, and worker
+processes fork from a server that has already imported it.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+from sweep import Sweep, label, tag
+from store import ResultStore, result_key
+
+SHARD = "shard-{:04d}-of-{:04d}"
+
+EXAMPLE = {
+    "params": {"word.perceptual": 100, "image.perceptual": 95, "word.conceptual": 100, "image.conceptual": 100,
+               "sd.item": 30, "sd.subject": 20, "sd.modality": 10, "sd.error": 50,
+               "sd.re_formula": "(1 + question | subject) + (1 + question | item)"},
+    "question_sd": [10, 12, 15, 18, 11],
+    "subjects": {"start": 2, "stop": 4},
+    "items": {"start": 2, "stop": 4},
+    "questions": {"start": 2, "stop": 4},
+    "axes": {},
+    "n_iter": 3,
+    "desired_power": 0.8,
+    "p_threshold": 0.05,
+    "seed": 2025,
+    "backend": "R",
+    "generator": "wiscs",
+    "r_workers": None,
+    "r_timeout": None,
+    "options": {"parallelize": False},
 }
-wiscs.set_params(params, verbose=False)
 
-# generate baseline data
-DG = DataGenerator()
-df = DG.fit_transform(seed=2025).to_pandas()
 
-# save baseline
-df.to_csv("baseline.csv")
-print(f"Baseline saved\n")
+def _axis(value) -> list:
+    if isinstance(value, dict):
+        return list(range(value["start"], value["stop"], value.get("step", 1)))
+    return list(value)
+
+
+def load(path:str) -> dict:
+    """Read a sweep config, filling in defaults from `EXAMPLE`"""
+    with open(path) as f:
+        config = json.load(f)
+    for key in ("params", "question_sd", "subjects", "items", "questions"):
+        if key not in config:
+            raise KeyError(f"{path} has no '{key}'")
+    return {**EXAMPLE, **config}
+
+
+def spec(config:dict) -> Sweep:
+    return Sweep(_axis(config["subjects"]), _axis(config["items"]), _axis(config["questions"]), **config["axes"])
+
+
+def open_store(config:dict, db:str) -> ResultStore:
+    """Result store keyed by everything in the config that determines the results (see `store.result_key`)"""
+    return ResultStore(db, result_key(config["params"], config["question_sd"], config["p_threshold"],
+                                      config["desired_power"], n_iter=config["n_iter"], backend=config["backend"],
+                                      generator=config["generator"], **config["options"]))
+
+
+def status(config:dict, cells:Sweep, store:ResultStore) -> list[str]:
+    """"done", "started" or "todo" for every cell, from the store alone"""
+    if config["seed"] is None or not os.path.exists(store.path):
+        return ["todo"] * len(cells)
+    stored = store.status(config["seed"])
+    out = []
+    for cell in cells:
+        n, finished = stored.get(cell.row + (store.with_params(cell.params).param_hash,), (0, False))
+        out.append("done" if finished else "started" if n else "todo")
+    return out
+
+
+def generator(config:dict):
+    """Data generator of the config (imports wiscs or simulate)"""
+    if config["generator"] == "batch":
+        from simulate import BatchGenerator
+        return BatchGenerator(config["params"])
+    import wiscs
+    from wiscs.simulate import DataGenerator
+    from utils import cell_update
+    first = Sweep(_axis(config["subjects"]), _axis(config["items"]), _axis(config["questions"]))[0]
+    wiscs.set_params({**config["params"], **cell_update(first.row, config["question_sd"])}, verbose=False)
+    return DataGenerator()
+
+
+def forkserver(backend:str):
+    """Multiprocessing context whose workers fork from a server with the fitting code imported"""
+    import multiprocessing
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["utils", "schedule", "lmm" if backend == "numpy" else "rinterface.rinterface"])
+    return context
+
+
+def collect(cells:Sweep, store:ResultStore, seed):
+    """Results of a finished sweep, read back from the store"""
+    import pandas as pd
+    return pd.concat([tag(store.with_params(cell.params).cell(cell.row, seed), cell.params) for cell in cells],
+                     ignore_index=True)
+
+
+def run(config:dict, cells:Sweep, store:ResultStore, resume:bool=True):
+    """Run (or resume) the sweep over `cells`; returns the results table"""
+    if config["seed"] is None:
+        import secrets
+        config["seed"] = secrets.randbits(64)
+        print(f"No seed in config; using {config['seed']} (add it to the config to resume)", file=sys.stderr)
+    elif resume and all(s == "done" for s in status(config, cells, store)):
+        return collect(cells, store, config["seed"])
+
+    from utils import agg
+    options = dict(config["options"])
+    pool = None
+    if config["backend"] == "R" and config["r_workers"]:
+        from rpool import RPool
+        pool = RPool(config["r_workers"], timeout=config["r_timeout"])
+    if options.get("parallelize", True) and options.get("scheduler", "iteration") == "iteration" and pool is None:
+        options.setdefault("mp_context", forkserver(config["backend"]))
+    try:
+        return agg(generator(config), config["p_threshold"], config["desired_power"], cells, config["question_sd"],
+                   n_iter=config["n_iter"], backend=config["backend"], pool=pool, seed=config["seed"],
+                   store=store, resume=resume, **options)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def plan(config:dict, store:ResultStore, over:str="subjects", resume:bool=True):
+    """Search the frontier of the config's design sizes (see `planner.frontier`); returns (frontier, cells).
+
+    Parameter axes and common random numbers are not supported.
+    """
+    options = dict(config["options"])
+    for name in ("parallelize", "scheduler", "window", "mp_context", "crn"):
+        options.pop(name, None)
+    if config["seed"] is None:
+        import secrets
+        config["seed"] = secrets.randbits(64)
+        print(f"No seed in config; using {config['seed']} (add it to the config to resume)", file=sys.stderr)
+
+    from planner import frontier
+    pool = None
+    if config["backend"] == "R" and config["r_workers"]:
+        from rpool import RPool
+        pool = RPool(config["r_workers"], timeout=config["r_timeout"])
+    try:
+        return frontier(generator(config), config["p_threshold"], config["desired_power"], _axis(config["subjects"]),
+                        _axis(config["items"]), _axis(config["questions"]), config["question_sd"], over=over,
+                        pool=pool, n_iter=config["n_iter"], backend=config["backend"], seed=config["seed"],
+                        store=store, resume=resume, **options)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def merge(out:str):
+    """Combine the shard results in `out` into the table of the whole sweep.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no shard results are found or some shards are missing.
+    """
+    import pandas as pd
+    files = sorted(glob.glob(os.path.join(out, "shard-*-of-*.csv")))
+    if not files:
+        raise FileNotFoundError(f"No shard results in {out}")
+    found = {tuple(map(int, re.search(r"shard-(\d+)-of-(\d+)", f).groups())) for f in files}
+    n_shards = {n for _, n in found}
+    if len(n_shards) != 1:
+        raise ValueError(f"Shard results from different splits in {out}: {sorted(n_shards)}")
+    n_shards = n_shards.pop()
+    missing = sorted(set(range(n_shards)) - {k for k, _ in found})
+    if missing:
+        raise FileNotFoundError(f"Missing shards {missing} of {n_shards} in {out}")
+    results = pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+    return results.sort_values("cell").drop(columns="cell").reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="write an example config")
+    p.add_argument("config")
+
+    for name, help in (("cells", "list the cells of a sweep"), ("run", "run or resume a sweep")):
+        p = sub.add_parser(name, help=help)
+        p.add_argument("config")
+        p.add_argument("--db", help="result store to resume from (default power.db, or one per shard in --out)")
+        p.add_argument("--shard", type=int, default=int(os.environ.get("SLURM_ARRAY_TASK_ID", 0)))
+        p.add_argument("--n-shards", type=int, default=int(os.environ.get("SLURM_ARRAY_TASK_COUNT", 1)))
+        p.add_argument("--out", default="shards", help="directory of the shard results")
+    p.add_argument("-o", "--output", default="power.csv", help="results of an unsharded sweep")
+    p.add_argument("--dry-run", action="store_true", help="report progress from the store and exit")
+    p.add_argument("--no-resume", dest="resume", action="store_false")
+
+    p = sub.add_parser("frontier", help="bisect for the smallest design reaching desired_power")
+    p.add_argument("config")
+    p.add_argument("--over", choices=["subjects", "items"], default="subjects", help="axis to bisect")
+    p.add_argument("--db", default="frontier.db", help="result store to resume from")
+    p.add_argument("-o", "--output", default="frontier.csv")
+    p.add_argument("--cells", help="also write the results of every probed cell here")
+    p.add_argument("--no-resume", dest="resume", action="store_false")
+
+    p = sub.add_parser("merge", help="merge the shard results of a sweep")
+    p.add_argument("out")
+    p.add_argument("-o", "--output", default="power.csv")
+
+    args = parser.parse_args(argv)
+    if args.command == "init":
+        with open(args.config, "w") as f:
+            json.dump(EXAMPLE, f, indent=2)
+        return
+    if args.command == "merge":
+        merge(args.out).to_csv(args.output, index=False)
+        return
+
+    config = load(args.config)
+    if config["backend"] == "numpy" and (args.command == "frontier" or args.command == "run" and not args.dry_run):
+        import lmm
+        if not lmm.validated(lmm.VALIDATION):
+            parser.error(f"the numpy backend has no recorded lme4 agreement at {lmm.VALIDATION}; "
+                         "run validate_lmm.py --out there (needs R) or use the R backend")
+    if args.command == "frontier":
+        if config["axes"] or config["options"].get("crn"):
+            parser.error("frontier searches design sizes only; remove the config's axes and crn")
+        edge, probed = plan(config, open_store(config, args.db), args.over, args.resume)
+        edge.to_csv(args.output, index=False)
+        if args.cells:
+            probed.to_csv(args.cells, index=False)
+        return
+    sharded = args.n_shards > 1
+    cells = spec(config).shard(args.shard, args.n_shards) if sharded else spec(config)
+    name = os.path.join(args.out, SHARD.format(args.shard, args.n_shards))
+    if args.db is None:
+        args.db = f"{name}.db" if sharded else "power.db"
+    store = open_store(config, args.db)
 
-# set up some simulation vars
-n_iter = 3 # how many interations to do?
-desired_power = 0.8
-p_threshold = 0.05
-n_subjects_range = np.arange(2, 4, 1) # range of subjects to test
-n_items_range = np.arange(2, 4, 1) # range of items to test
-n_questions_range = np.arange(2, 4, 1) # range of questions to test
-combinations = grid(subjects=n_subjects_range, items=n_items_range, questions=n_questions_range) # get all combinatinos
+    if args.command == "cells":
+        names = list(config["axes"])
+        print("\t".join(["index", "n_subjects", "n_items", "n_questions", *names, "status"]))
+        for cell, state in zip(cells, status(config, cells, store)):
+            print("\t".join(str(v) for v in (cell.index, *cell.row, *(label(cell.params[n]) for n in names), state)))
+    elif args.dry_run:
+        states = status(config, cells, store)
+        counts = {s: states.count(s) for s in ("done", "started", "todo")}
+        print(f"{len(cells)} cells x {config['n_iter']} iterations | backend {config['backend']} | "
+              + " | ".join(f"{n} {s}" for s, n in counts.items()))
+    elif sharded:
+        if config["seed"] is None:
+            parser.error("a sharded sweep needs a seed in its config")
+        os.makedirs(args.out, exist_ok=True)
+        results = run(config, cells, store, args.resume)
+        results.insert(0, "cell", list(cells.indices))
+        results.to_csv(f"{name}.csv", index=False)
+    else:
+        run(config, cells, store, args.resume).to_csv(args.output, index=False)
 
-results = agg(DG, p_threshold, desired_power, combinations, question_sd, n_iter=n_iter, parallelize=False)
 
-results.to_csv("power.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
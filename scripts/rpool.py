@@ -0,0 +1,245 @@
+import os
+import queue
+import atexit
+import tempfile
+import threading
+import subprocess
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.R")
+TAG = "@@wiscs "
+
+
+class RWorker:
+    """A single long-lived R process running `worker.R`.
+
+    lme4, dplyr and lmerTest are loaded once when the process starts. Scripts
+    are passed as files and evaluated in a fresh environment, so nothing leaks
+    between fits unless a script assigns into `globalenv()` on purpose.
+
+    Parameters
+    ----------
+    rscript: str
+        Path to the `Rscript` executable. Default is "Rscript".
+    tmpdir: str
+        Directory for script files. Default is the system temp directory.
+    timeout: float
+        Seconds to wait for an `eval` reply. A worker that does not answer
+        in time is killed and `eval` raises TimeoutError. Default is None
+        (wait forever).
+    """
+    def __init__(self, rscript:str="Rscript", tmpdir:str=None, timeout:float=None):
+        self.rscript = rscript
+        self.tmpdir = tmpdir
+        self.timeout = timeout
+        self.proc = subprocess.Popen(
+            [rscript, "--vanilla", WORKER],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1,
+        )
+        # stdout is drained on a thread so replies can be awaited with a timeout
+        self._lines = queue.Queue()
+        threading.Thread(target=self._drain, daemon=True).start()
+        try:
+            status, _ = self._reply(timeout=120)
+        except (EOFError, TimeoutError):
+            self.kill()
+            raise
+        if status != "READY":
+            self.kill()
+            raise RuntimeError(f"R worker failed to start (got {status!r})")
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def _drain(self):
+        for line in self.proc.stdout:
+            if line.startswith(TAG):
+                self._lines.put(line)
+        self._lines.put(None)
+
+    def _send(self, *fields):
+        self.proc.stdin.write("\t".join(fields) + "\n")
+        self.proc.stdin.flush()
+
+    def _reply(self, timeout:float=None):
+        """Wait for the next tagged line; anything else the script printed is dropped"""
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("R worker did not answer in time")
+        if line is None:
+            self._lines.put(None)
+            raise EOFError("R worker exited")
+        status, _, value = line[len(TAG):].rstrip("\n").partition("\t")
+        return status, value
+
+    def ping(self, timeout:float=10) -> bool:
+        """Health check: True if the process answers PING"""
+        if not self.alive:
+            return False
+        try:
+            self._send("PING")
+            return self._reply(timeout=timeout)[0] == "PONG"
+        except (OSError, EOFError, TimeoutError):
+            return False
+
+    def eval(self, script:str, grab:str="success") -> str:
+        """Evaluate `script` and return the formatted value of the R variable `grab`.
+
+        Vector elements are joined by ","; several variables can be grabbed
+        at once as "a;b", and their values are then joined by ";". Raises
+        TimeoutError, and kills the process, if R does not answer within
+        `timeout` seconds.
+        """
+        fd, path = tempfile.mkstemp(suffix=".R", dir=self.tmpdir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(script)
+            self._send("EVAL", path, grab)
+            status, value = self._reply(timeout=self.timeout)
+        except TimeoutError:
+            # a late reply would be read as the answer to the next script
+            self.kill()
+            raise
+        finally:
+            os.remove(path)
+        if status != "OK":
+            raise RuntimeError(f"R error: {value}")
+        return value
+
+    def kill(self):
+        if self.alive:
+            self.proc.kill()
+        self.proc.wait()
+
+    def close(self, timeout:float=5):
+        if self.alive:
+            try:
+                self._send("QUIT")
+                self.proc.wait(timeout=timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+
+
+class RPool:
+    """Pool of warm R workers, one per core by default.
+
+    `eval` is thread-safe: each call borrows an idle worker and blocks while
+    all of them are busy. Because fitting happens inside the R processes, a
+    thread per worker is enough to keep the pool saturated (see `agg`).
+
+    Parameters
+    ----------
+    n_workers: int
+        Number of R processes. Default is `os.cpu_count()`.
+    rscript: str
+        Path to the `Rscript` executable. Default is "Rscript".
+    tmpdir: str
+        Directory for script files. Default is the system temp directory.
+    timeout: float
+        Seconds a single `eval` may take before its worker is killed and
+        replaced (see `RWorker`). Default is None (wait forever).
+
+    Example
+    -------
+    >>> with RPool(4) as pool:
+    ...     results = agg(DG, 0.05, 0.8, combinations, question_sd, pool=pool)
+    """
+    def __init__(self, n_workers:int=None, rscript:str="Rscript", tmpdir:str=None, timeout:float=None):
+        self.n_workers = n_workers or os.cpu_count()
+        self.rscript = rscript
+        self.tmpdir = tmpdir
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.workers = []
+        self._closed = False
+        try:
+            for _ in range(self.n_workers):
+                self._add_worker()
+        except BaseException:
+            # do not leave the workers that did start running
+            self.close()
+            raise
+        atexit.register(self.close)
+
+    def __len__(self):
+        return self.n_workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _add_worker(self) -> RWorker:
+        worker = RWorker(self.rscript, self.tmpdir, self.timeout)
+        with self._lock:
+            self.workers.append(worker)
+        self._idle.put(worker)
+        return worker
+
+    def _replace(self, worker:RWorker):
+        with self._lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        worker.close()
+        self._add_worker()
+
+    def eval(self, script:str, grab:str="success", retries:int=1) -> str:
+        """Run `script` on an idle worker and return the value of `grab`.
+
+        A worker that dies or times out mid-fit is replaced and the script is
+        retried on a fresh worker up to `retries` times. R-level errors are
+        not retried.
+        """
+        if self._closed:
+            raise RuntimeError("RPool is closed")
+        worker = self._idle.get()
+        try:
+            value = worker.eval(script, grab)
+        except (OSError, EOFError): # includes TimeoutError
+            self._replace(worker)
+            if retries <= 0:
+                raise
+            return self.eval(script, grab, retries=retries - 1)
+        except RuntimeError:
+            self._idle.put(worker)
+            raise
+        self._idle.put(worker)
+        return value
+
+    def health(self, timeout:float=10) -> list[bool]:
+        """Ping every idle worker and replace the ones that do not answer.
+
+        Returns
+        -------
+        list[bool]
+            Health of each checked worker before replacement.
+        """
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        status = []
+        for worker in checked:
+            ok = worker.ping(timeout=timeout)
+            status.append(ok)
+            if ok:
+                self._idle.put(worker)
+            else:
+                self._replace(worker)
+        return status
+
+    def close(self):
+        """Shut down all workers. Safe to call more than once."""
+        if getattr(self, "_closed", True):
+            return
+        self._closed = True
+        with self._lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.close()
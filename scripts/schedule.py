@@ -0,0 +1,298 @@
+"""Cost-aware scheduling of a power sweep at (cell, iteration) granularity.
+
+Handing each grid row to a worker leaves most of the workers idle while the
+largest cells finish their iterations serially. Here every iteration of
+every cell is a unit of work. Units are queued largest cell first, using
+`n_subject * n_item * n_question` as the cost, and each worker takes the
+next unit when it goes idle. That keeps every core busy until the queue
+drains.
+
+Early stopping still works per cell: the stopping rule is applied to the
+longest run of finished iterations 0..m-1, so the decision does not depend
+on which workers happen to finish first. Once a cell is decided, its
+queued units are dropped and in-flight results are discarded.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from copy import deepcopy
+import heapq
+import threading
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from simulate import BatchGenerator
+from utils import cell_update, fit, fix_design, release_design, wiscs_seed, iteration_seed, seed_key
+from metrics import Record
+from sweep import Sweep, cells as sweep_cells, tag
+import sequential
+
+
+def cost(row) -> float:
+    """Relative fitting cost of a cell"""
+    return float(np.prod(row, dtype=float))
+
+
+# warm-start state and model structures per open cell, local to each worker
+# process (shared by threads, guarded by _LOCK)
+_WARM = {}
+_KEEP = 32
+_LOCK = threading.Lock()
+
+def _release(live):
+    """Drop the warm state of cells that are no longer open (all but `live`) and keep at most `_KEEP`"""
+    with _LOCK:
+        for slot in [s for s in _WARM if live is not None and s not in live]:
+            release_design(_WARM.pop(slot))
+        while len(_WARM) > _KEEP:
+            release_design(_WARM.pop(next(iter(_WARM))))
+
+def _unit(DG, p_threshold, row, question_sd, seed, backend, pool, nest=None, warm_start=False, refit=True,
+          params=None, slot=None, live=None):
+    """Simulate and fit one iteration of one cell; returns success and the iteration's `Record`.
+
+    `params` are the cell's parameter overrides and `slot` the key of its
+    warm-start state (default `row`). `live` holds the slots of the cells
+    still open; the state of every other cell is released first.
+    """
+    slot = row if slot is None else slot
+    record = Record()
+    with record.phase("update"):
+        update = cell_update(row, question_sd, params)
+    warm = None
+    if warm_start or refit:
+        _release(live)
+        with _LOCK:
+            warm = _WARM.setdefault(slot, {})
+    if isinstance(DG, BatchGenerator):
+        with record.phase("generate"):
+            design, Y = DG.replicates(1, update, seed=seed, nest=nest)
+        with record.phase("convert"):
+            df = design.assign(rt=Y[0])
+            if refit and (backend == "numpy" or pool is not None):
+                with _LOCK: # threads of one cell build its models once
+                    fix_design(warm, design, backend)
+    else:
+        with record.phase("generate"):
+            DG.fit_transform(update, overwrite=True, seed=wiscs_seed(seed))
+        with record.phase("convert"):
+            df = DG.to_pandas()
+    success = fit(df, p_threshold, backend, pool, warm, record)
+    if not warm_start and warm is not None:
+        warm.pop("theta", None)
+    return success, record
+
+
+def decide(k, n, n_iter, desired_power, stopping="heuristic", alpha=0.05, min_iter=5):
+    """Stopping decision after the first n of n_iter iterations, as in `run`.
+
+    Returns
+    -------
+    tuple[str, float]
+        ("met" | "ruled out" | "undecided", power)
+    """
+    if stopping != "heuristic":
+        decision, _, _ = sequential.decide(k, n, desired_power, stopping, alpha, min_iter)
+        return decision, k / n
+    power = k / n_iter
+    if n - k >= n_iter - (0.8 * n_iter) + 1:
+        return "ruled out", power
+    if power >= desired_power:
+        return "met", power
+    return "undecided", power
+
+
+class _Cell:
+    """Bookkeeping for one cell while its iterations are in flight"""
+    def __init__(self, row, n_iter, seed, done=None, params=None, store=None):
+        self.row = tuple(int(n) for n in row)
+        self.params = params or {}
+        self.store = store
+        self.n_iter = n_iter
+        self.seed = seed
+        self.success = np.full(n_iter, -1)
+        for j, s in (done or {}).items():
+            if j < n_iter:
+                self.success[j] = s
+        self.decision, self.power, self.n_run = "undecided", 0.0, 0
+        self.closed = False
+
+    def update(self, desired_power, stopping, alpha, min_iter):
+        """Re-apply the stopping rule to the finished prefix; True once the cell is closed"""
+        finished = np.flatnonzero(self.success < 0)
+        prefix = finished[0] if len(finished) else self.n_iter
+        if prefix == 0 or prefix == self.n_run:
+            return self.closed
+        # walk the prefix like `run` does, stopping at the first decision
+        for n in range(self.n_run + 1, prefix + 1):
+            k = int(self.success[:n].sum())
+            self.decision, self.power = decide(k, n, self.n_iter, desired_power, stopping, alpha, min_iter)
+            self.n_run = n
+            if self.decision != "undecided":
+                break
+        self.closed = self.decision != "undecided" or self.n_run == self.n_iter
+        return self.closed
+
+    def result(self, stopping, alpha) -> pd.DataFrame:
+        k = int(self.success[:self.n_run].sum())
+        lower, upper = sequential.interval(k, self.n_run, "wilson" if stopping == "heuristic" else stopping, alpha)
+        return tag(pd.DataFrame({
+            "n_subjects": [self.row[0]],
+            "n_items": [self.row[1]],
+            "n_questions": [self.row[2]],
+            "power": [self.power],
+            "power_lower": [lower],
+            "power_upper": [upper],
+            "decision": [self.decision],
+            "iterations_run": [self.n_run],
+        }), self.params)
+
+
+def sweep(DG, p_threshold, desired_power, combinations, question_sd, n_iter=10, n_jobs=8, pool=None, backend="R",
+          seed=None, stopping="heuristic", alpha=0.05, min_iter=5, store=None, resume=True, verbose=True, nest=None,
+          warm_start=False, refit=True, metrics=None, window=None, mp_context=None):
+    """Run a power sweep with (cell, iteration) units, largest cells first.
+
+    Parameters
+    ----------
+    DG, p_threshold, desired_power, question_sd, n_iter, backend, stopping, alpha, min_iter, store, resume
+        As in `run`.
+    combinations: array-like or sweep.Sweep
+        Grid rows (n_subject, n_item, n_question), e.g. from `grid`, or a
+        lazy `Sweep` whose cells may carry parameter overrides.
+    n_jobs: int
+        Number of worker processes.
+    pool: rpool.RPool
+        Warm R workers; units then run on one thread per R worker.
+    seed: int or np.random.SeedSequence
+        Root seed. Every (cell, iteration) gets its own child seed, so the
+        simulated data do not depend on scheduling.
+    nest: tuple[int, int]
+        Largest (n_subject, n_item) for common random numbers. Iteration j
+        of every cell then shares one seed and nested draws.
+    warm_start: bool
+        Start each fit from the last theta its worker estimated for the
+        same cell (see `fit`). That theta depends on which units the
+        worker ran before, so where the likelihood has several optima the
+        results can depend on the number of workers. Default is False:
+        cold fits, whose results do not depend on scheduling.
+    refit: bool
+        Build each cell's model structures once per worker and only refit
+        the response (see `run`). This does not change the results.
+    metrics: metrics.Metrics
+        Collects the phase timings and fit diagnostics of every unit,
+        including units of cells that were decided while they ran.
+    window: int
+        Most cells open at once. Cells are read from `combinations` as
+        earlier ones close, and the largest-first order applies within
+        the open cells. Default is every cell for arrays and
+        `8 * n_workers` for a `Sweep`.
+    mp_context: multiprocessing context
+        Start method of the worker processes, e.g. a "forkserver" context
+        with preloaded modules (see `power.py`).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per cell, in the order of `combinations`, as returned by `run`.
+    """
+    if backend != "R":
+        pool = None
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    key = seed_key(seed)
+
+    if pool is not None:
+        executor, n_workers = ThreadPoolExecutor(len(pool)), len(pool)
+    else:
+        executor, n_workers = ProcessPoolExecutor(n_jobs, mp_context=mp_context), n_jobs
+    if window is None:
+        window = 8 * n_workers if isinstance(combinations, Sweep) else len(combinations)
+
+    source = enumerate(sweep_cells(combinations))
+    open_cells, results, queue = {}, {}, []
+    total = len(combinations) if hasattr(combinations, "__len__") else None
+    progress = tqdm(total=total, desc="Processing Grid", disable=not verbose)
+
+    def admit():
+        """Open cells from the stream until `window` are open; False once the stream is exhausted"""
+        while len(open_cells) < window:
+            try:
+                c, spec = next(source)
+            except StopIteration:
+                return False
+            view = store.with_params(spec.params) if store is not None else None
+            cached = view.cell(spec.row, key) if view is not None and resume else None
+            if cached is not None:
+                results[c] = tag(cached, spec.params)
+                progress.update(1)
+                continue
+            done = view.iterations(spec.row, key) if view is not None and resume else {}
+            cell = open_cells[c] = _Cell(spec.row, n_iter, seed, done, spec.params, view)
+            if cell.update(desired_power, stopping, alpha, min_iter):
+                close(c)
+                continue
+            for j in np.flatnonzero(cell.success < 0):
+                heapq.heappush(queue, (-cost(cell.row), c, int(j)))
+        return True
+
+    def submit(c, j):
+        cell = open_cells[c]
+        generator = deepcopy(DG) if pool is not None else DG
+        child = iteration_seed(seed, cell.row, j, cell.params, nest)
+        return executor.submit(_unit, generator, p_threshold, cell.row, question_sd, child, backend, pool, nest,
+                               warm_start, refit, cell.params, c, frozenset(open_cells))
+
+    def close(c):
+        cell = open_cells.pop(c)
+        cell.closed = True
+        results[c] = cell.result(stopping, alpha)
+        if pool is not None:
+            # units ran on threads of this process
+            with _LOCK:
+                release_design(_WARM.pop(c, {}))
+        if cell.store is not None:
+            cell.store.add_cell(cell.row, key, results[c])
+        progress.update(1)
+
+    pending, streaming = {}, True
+    with executor:
+        while True:
+            if streaming:
+                streaming = admit()
+            if not (queue or pending):
+                if streaming:
+                    continue
+                break
+            # top up idle workers with the most expensive open units
+            while queue and len(pending) < n_workers:
+                _, c, j = heapq.heappop(queue)
+                if c in open_cells:
+                    pending[submit(c, j)] = (c, j, open_cells[c])
+            if not pending:
+                continue
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                c, j, cell = pending.pop(future)
+                if cell.closed and future.exception() is not None:
+                    continue # a discarded unit's error does not abort the sweep
+                if cell.closed and metrics is None:
+                    continue
+                success, record = future.result()
+                if metrics is not None:
+                    metrics.add(cell.row, j, record, cell.params)
+                if cell.closed:
+                    continue
+                cell.success[j] = success
+                if cell.store is not None:
+                    cell.store.add_iteration(cell.row, key, j, cell.success[j])
+                if cell.update(desired_power, stopping, alpha, min_iter):
+                    close(c)
+
+            # cancel queued futures of cells decided meanwhile
+            for future, (c, j, cell) in list(pending.items()):
+                if cell.closed and future.cancel():
+                    pending.pop(future)
+    progress.close()
+
+    return pd.concat([results[c] for c in sorted(results)], ignore_index=True)
@@ -0,0 +1,63 @@
+"""Confidence-based stopping for Monte Carlo power estimates.
+
+After every iteration the running success count is turned into a
+confidence interval for the true power. A cell stops as soon as the
+interval lies entirely above `desired_power` (target met) or entirely
+below it (target ruled out). Intervals are recomputed at every look, so
+`alpha` is per look rather than a family-wise error rate; use a smaller
+`alpha` when decisions near the boundary matter.
+"""
+
+import numpy as np
+
+METHODS = ("wilson", "clopper-pearson")
+
+
+def wilson(k:int, n:int, alpha:float=0.05) -> tuple[float, float]:
+    """Wilson score interval for k successes in n trials"""
+    if n == 0:
+        return 0.0, 1.0
+    from scipy.stats import norm # scipy.stats is slow to import
+    z = norm.ppf(1 - alpha / 2)
+    p = k / n
+    center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+    half = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    # exact at the edges, where rounding can leave the bounds a hair off 0 or 1
+    lower = 0.0 if k == 0 else max(center - half, 0.0)
+    upper = 1.0 if k == n else min(center + half, 1.0)
+    return float(lower), float(upper)
+
+
+def clopper_pearson(k:int, n:int, alpha:float=0.05) -> tuple[float, float]:
+    """Exact (Clopper-Pearson) interval for k successes in n trials"""
+    if n == 0:
+        return 0.0, 1.0
+    from scipy.stats import beta
+    lower = beta.ppf(alpha / 2, k, n - k + 1) if k > 0 else 0.0
+    upper = beta.ppf(1 - alpha / 2, k + 1, n - k) if k < n else 1.0
+    return float(lower), float(upper)
+
+
+def interval(k:int, n:int, method:str="wilson", alpha:float=0.05) -> tuple[float, float]:
+    if method == "wilson":
+        return wilson(k, n, alpha)
+    if method == "clopper-pearson":
+        return clopper_pearson(k, n, alpha)
+    raise ValueError(f"Unknown interval method {method!r}, expected one of {METHODS}")
+
+
+def decide(k:int, n:int, desired_power:float, method:str="wilson", alpha:float=0.05, min_iter:int=5):
+    """Sequential decision for a cell after n iterations with k successes.
+
+    Returns
+    -------
+    tuple[str, float, float]
+        ("met" | "ruled out" | "undecided", lower, upper)
+    """
+    lower, upper = interval(k, n, method, alpha)
+    if n >= min_iter:
+        if lower >= desired_power:
+            return "met", lower, upper
+        if upper < desired_power:
+            return "ruled out", lower, upper
+    return "undecided", lower, upper
@@ -0,0 +1,220 @@
+"""Batched replicate generation for power simulations.
+
+`BatchGenerator` draws every Monte Carlo replicate of one design cell in a
+single vectorized call. It uses the same parameter dictionary as
+`wiscs.set_params` and the generative model behind the
+`(1 + question | subject) + (1 + question | item)` style formulas:
+
+    rt = mu[modality, question] + T(modality, question) . b_subject
+                                + T(modality, question) . b_item + error
+
+with mu = <modality>.perceptual + <modality>.conceptual + <modality>.task,
+T the random-effect terms of the grouping factor (intercept, treatment-coded
+question, modality contrast) and b ~ N(0, D corr D) where D holds the
+matching `sd.*` entries.
+
+Rows are laid out modality-major: modality, subject, question, item.
+
+Differences from `wiscs.simulate.DataGenerator`, which this model is
+written from rather than derived from (`validate_simulate.py` compares
+the two; it needs wiscs and has not been run against it yet):
+
+- Columns come as subject, question, item, modality, rt; wiscs writes
+  subject, rt, question, item, modality. The row layout is the same,
+  with word before image.
+- Modality random effects exist only when `modality` is a term of
+  `sd.re_formula`, and use the -0.5/0.5 contrast. With the repo's
+  `(1 + question | subject) + (1 + question | item)`, `sd.modality` is
+  unused. The wiscs-generated files in `data/` show image - word
+  variance of about 100 for both subjects and items (`components` on
+  data_15_3.csv), and a larger subject variance for images. This
+  suggests that wiscs adds an `sd.modality` deviation for images even
+  without a modality term. Those files do not record their generating
+  parameters, so this is unconfirmed, and the difference is kept rather
+  than guessed at. Until `validate_simulate.py` has been run against
+  wiscs, do not mix "batch" and "wiscs" power results. The closest match
+  is `(1 + question + modality | subject) + (1 + question + modality |
+  item)`, which gives image - word differences of variance
+  `sd.modality`^2.
+
+With `nest=(max_subjects, max_items)`, replicates use common random
+numbers across cells: all standard-normal draws are made once at the
+largest design and every smaller cell takes the leading subjects and
+items. A 150-subject dataset is then exactly the first 150 subjects of
+the 200-subject one, so power differences between neighbouring cells
+reflect the design and not fresh noise.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+LEVELS = np.array(["word", "image"])
+CONTRAST = np.array([-0.5, 0.5])
+
+
+def parse_re_formula(formula:str) -> dict:
+    """Random-effect terms per grouping factor, e.g. {"subject": ["1", "question"]}"""
+    terms = {}
+    for lhs, group in re.findall(r"\(([^|()]+)\|\s*(\w+)\s*\)", str(formula)):
+        terms[group] = [t.strip() for t in lhs.split("+")]
+    return terms
+
+
+class BatchGenerator:
+    """Vectorized generator of replicate response vectors.
+
+    Parameters
+    ----------
+    params: dict
+        Generating parameters, in the format used by `wiscs.set_params`.
+
+    Example
+    -------
+    >>> BG = BatchGenerator(params)
+    >>> design, Y = BG.replicates(100, {'n.subject': 50}, seed=2025)
+    >>> Y.shape
+    (100, len(design))
+    """
+    def __init__(self, params:dict):
+        self.params = dict(params)
+
+    def _get(self, update:dict, key:str, default=None):
+        return update[key] if key in update else self.params.get(key, default)
+
+    def design(self, n_subject:int, n_item:int, n_question:int) -> pd.DataFrame:
+        """Design columns shared by every replicate of a cell"""
+        m, s, q, i = np.indices((2, n_subject, n_question, n_item)).reshape(4, -1)
+        return pd.DataFrame({
+            "subject": s.astype(np.int32),
+            "question": q.astype(np.int32),
+            "item": i.astype(np.int32),
+            "modality": pd.Categorical.from_codes(m, categories=LEVELS),
+        })
+
+    def _terms(self, terms:list, n_question:int) -> np.ndarray:
+        """Random-effect term values T[modality, question, term]"""
+        columns = []
+        for term in terms:
+            if term == "1":
+                columns.append(np.ones((2, n_question, 1)))
+            elif term == "question":
+                columns.append(np.broadcast_to(np.eye(n_question)[:, 1:], (2, n_question, n_question - 1)))
+            elif term == "modality":
+                columns.append(np.broadcast_to(CONTRAST[:, None, None], (2, n_question, 1)))
+            else:
+                raise ValueError(f"Unsupported random-effect term: {term!r}")
+        return np.concatenate(columns, axis=2)
+
+    def _sd(self, group:str, terms:list, update:dict, n_question:int) -> np.ndarray:
+        sd = []
+        for term in terms:
+            if term == "1":
+                sd.append(self._get(update, f"sd.{group}"))
+            elif term == "question":
+                sd.extend(np.asarray(self._get(update, "sd.question"))[:n_question - 1])
+            elif term == "modality":
+                sd.append(self._get(update, "sd.modality"))
+        return np.asarray(sd, dtype=float)
+
+    def _chol(self, group:str, terms:list, update:dict, n_question:int) -> np.ndarray:
+        """Cholesky factor of the random-effect covariance D corr D"""
+        sd = self._sd(group, terms, update, n_question)
+        corr = self._get(update, f"corr.{group}")
+        corr = np.eye(len(sd)) if corr is None else np.asarray(corr, dtype=float)
+        return np.linalg.cholesky(corr) * sd[:, None]
+
+    def _draw(self, rng, group:str, terms:list, update:dict, n_iter:int, n_group:int, n_question:int):
+        """Random effects for every replicate at once, shape (n_iter, n_group, k)"""
+        chol = self._chol(group, terms, update, n_question)
+        return rng.standard_normal((n_iter, n_group, len(chol))) @ chol.T
+
+    def _normals(self, seed, shapes:dict) -> dict:
+        """Standard normals of the given shapes, one independent stream each.
+
+        The last draw is kept, so consecutive nested cells with the same
+        seed and largest design reuse it instead of drawing again.
+        """
+        if seed is None:
+            raise ValueError("Nested replicates need a seed shared by every cell")
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        key = (seed.entropy, seed.spawn_key, tuple(shapes.items()))
+        if getattr(self, "_nested", (None,))[0] != key:
+            # fixed child keys rather than seed.spawn(), which depends on how often it was called
+            draws = {
+                name: np.random.default_rng(np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (k,))).standard_normal(shape)
+                for k, (name, shape) in enumerate(shapes.items())
+            }
+            self._nested = (key, draws)
+        return self._nested[1]
+
+    def mean(self, update:dict, n_question:int) -> np.ndarray:
+        """Fixed part mu[modality, question]"""
+        return np.stack([
+            self._get(update, f"{m}.perceptual") + self._get(update, f"{m}.conceptual")
+            + np.asarray(self._get(update, f"{m}.task"), dtype=float)[:n_question]
+            for m in LEVELS
+        ])
+
+    def replicates(self, n_iter:int, params:dict=None, seed=None, nest:tuple=None) -> tuple[pd.DataFrame, np.ndarray]:
+        """Simulate `n_iter` replicates of one design cell.
+
+        Parameters
+        ----------
+        n_iter: int
+            Number of replicates.
+        params: dict
+            Overrides for this cell (e.g. the `update` built in `run`).
+        seed: int, np.random.SeedSequence or np.random.Generator
+            Seed for the draws.
+        nest: tuple[int, int]
+            Largest (n_subject, n_item) of the sweep. If given, draws are
+            nested across cells (see module docstring); `seed` must then be
+            an int or SeedSequence shared by those cells.
+
+        Returns
+        -------
+        tuple[pd.DataFrame, np.ndarray]
+            The shared design and a `(n_iter, len(design))` array of rt.
+            `Y[j]` is a view, not a copy.
+        """
+        update = params or {}
+        S, I, Q = (int(self._get(update, f"n.{k}")) for k in ("subject", "item", "question"))
+        terms = parse_re_formula(self._get(update, "sd.re_formula", ""))
+        if nest is not None:
+            return self._nested_replicates(n_iter, update, seed, nest, S, I, Q, terms)
+        rng = np.random.default_rng(seed)
+
+        Y = np.empty((n_iter, 2, S, Q, I))
+        Y[:] = self.mean(update, Q)[None, :, None, :, None]
+        if "subject" in terms:
+            b = self._draw(rng, "subject", terms["subject"], update, n_iter, S, Q)
+            Y += np.einsum("nsk,mqk->nmsq", b, self._terms(terms["subject"], Q))[..., None]
+        if "item" in terms:
+            b = self._draw(rng, "item", terms["item"], update, n_iter, I, Q)
+            Y += np.einsum("nik,mqk->nmqi", b, self._terms(terms["item"], Q))[:, :, None]
+        Y += rng.normal(0, self._get(update, "sd.error"), Y.shape)
+
+        return self.design(S, I, Q), Y.reshape(n_iter, -1)
+
+    def _nested_replicates(self, n_iter, update, seed, nest, S, I, Q, terms):
+        S_max, I_max = (int(n) for n in nest)
+        if S > S_max or I > I_max:
+            raise ValueError(f"Cell ({S} subjects, {I} items) is larger than the nesting design {nest}")
+
+        chol = {group: self._chol(group, terms[group], update, Q) for group in ("subject", "item") if group in terms}
+        shapes = {"error": (n_iter, 2, S_max, Q, I_max)}
+        shapes.update({group: (n_iter, {"subject": S_max, "item": I_max}[group], len(L)) for group, L in chol.items()})
+        z = self._normals(seed, shapes)
+
+        Y = np.empty((n_iter, 2, S, Q, I))
+        Y[:] = self.mean(update, Q)[None, :, None, :, None]
+        if "subject" in chol:
+            b = z["subject"][:, :S] @ chol["subject"].T
+            Y += np.einsum("nsk,mqk->nmsq", b, self._terms(terms["subject"], Q))[..., None]
+        if "item" in chol:
+            b = z["item"][:, :I] @ chol["item"].T
+            Y += np.einsum("nik,mqk->nmqi", b, self._terms(terms["item"], Q))[:, :, None]
+        Y += self._get(update, "sd.error") * z["error"][:, :, :S, :, :I]
+
+        return self.design(S, I, Q), Y.reshape(n_iter, -1)
@@ -0,0 +1,187 @@
+"""Durable, resumable store for power simulation results.
+
+Every finished iteration and every finished cell is written to a local
+SQLite database as soon as it completes, keyed by the design cell, a hash
+of the generating parameters and the seed. The database runs in WAL mode,
+so partial results can be read from another process while a sweep is
+still writing to it:
+
+>>> ResultStore("power.db", params).progress()
+"""
+
+import copy
+import json
+import hashlib
+import sqlite3
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CELL = ("n_subjects", "n_items", "n_questions")
+RESULT = ("power", "power_lower", "power_upper", "decision", "iterations_run")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS iterations (
+    n_subjects INTEGER, n_items INTEGER, n_questions INTEGER,
+    param_hash TEXT, seed TEXT, iteration INTEGER, success INTEGER,
+    PRIMARY KEY (n_subjects, n_items, n_questions, param_hash, seed, iteration)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    n_subjects INTEGER, n_items INTEGER, n_questions INTEGER,
+    param_hash TEXT, seed TEXT,
+    power REAL, power_lower REAL, power_upper REAL, decision TEXT, iterations_run INTEGER,
+    PRIMARY KEY (n_subjects, n_items, n_questions, param_hash, seed)
+);
+"""
+
+
+# numpy and pandas are only touched through duck typing or imported where
+# DataFrames are built, so progress checks do not pay for importing them
+
+def _jsonable(x):
+    if hasattr(x, "tolist"): # numpy arrays and scalars
+        return x.tolist()
+    if callable(x):
+        return f"{getattr(x, '__module__', '')}.{getattr(x, '__qualname__', x)}"
+    return str(x)
+
+def param_hash(params:dict) -> str:
+    """Stable short hash of a parameter dictionary (numpy arrays included)"""
+    blob = json.dumps(params, sort_keys=True, default=_jsonable)
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+# `agg`/`run` options that change how a sweep is executed, not its results
+EXECUTION = frozenset({"parallelize", "n_jobs", "verbose", "scheduler", "pool", "r_workers", "mp_context",
+                       "metrics", "store", "resume", "window", "seed"})
+# defaults of `run`, so spelling out a default keeps the key
+DEFAULTS = {"n_iter": 10, "backend": "R", "stopping": "heuristic", "alpha": 0.05, "min_iter": 5, "crn": False,
+            "nest": None, "warm_start": False, "refit": True}
+
+def result_key(params:dict, question_sd, p_threshold, desired_power, **settings) -> dict:
+    """Everything that determines a stored cell result besides the cell and the seed.
+
+    `settings` are the sweep's `n_iter`, `backend`, `generator` and its
+    `agg`/`run` options. Options in `EXECUTION` are dropped; the others
+    are filled in with `run`'s defaults. Pass the result to `ResultStore`.
+    """
+    settings = {**DEFAULTS, **{k: v for k, v in settings.items() if k not in EXECUTION}}
+    return {"params": params, "question_sd": question_sd, "p_threshold": p_threshold,
+            "desired_power": desired_power, **settings}
+
+
+class ResultStore:
+    """SQLite-backed store of per-iteration and per-cell results.
+
+    Parameters
+    ----------
+    path: str
+        Database file. Created if it does not exist.
+    params: dict
+        Everything that determines the results besides the cell and the
+        seed, as built by `result_key`. Only its hash is stored.
+
+    Notes
+    -----
+    Connections are opened lazily, one per thread, and are not pickled, so
+    a store can be shared with threads or passed to loky/process-pool
+    workers.
+    """
+    def __init__(self, path:str, params:dict=None):
+        self.path = path
+        self.param_hash = param_hash(params or {})
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != "_local"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def with_params(self, params:dict) -> "ResultStore":
+        """View of the same database for cells with extra parameter overrides (`sweep.Cell.params`)"""
+        if not params:
+            return self
+        view = copy.copy(self) # shares the per-thread connections
+        view.param_hash = param_hash({"base": self.param_hash, **params})
+        return view
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        return conn
+
+    def _key(self, row, seed) -> tuple:
+        return tuple(int(n) for n in row) + (self.param_hash, str(seed))
+
+    def add_iteration(self, row, seed, iteration:int, success:int):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO iterations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              self._key(row, seed) + (int(iteration), int(success)))
+
+    def add_cell(self, row, seed, result:"pd.DataFrame"):
+        values = tuple(v.item() if hasattr(v, "item") else v for v in result.iloc[0][list(RESULT)])
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              self._key(row, seed) + values)
+
+    def iterations(self, row, seed) -> dict:
+        """Finished iterations of a cell as {iteration: success}"""
+        rows = self.conn.execute(
+            "SELECT iteration, success FROM iterations WHERE n_subjects=? AND n_items=? AND n_questions=? "
+            "AND param_hash=? AND seed=?", self._key(row, seed)).fetchall()
+        return dict(rows)
+
+    def cell(self, row, seed) -> "pd.DataFrame":
+        """Stored result of a finished cell, in the format returned by `run`, or None"""
+        import pandas as pd
+        out = pd.read_sql_query(
+            f"SELECT {', '.join(CELL + RESULT)} FROM cells WHERE n_subjects=? AND n_items=? AND n_questions=? "
+            "AND param_hash=? AND seed=?", self.conn, params=self._key(row, seed))
+        return out if len(out) else None
+
+    def cells(self, all_params:bool=False) -> "pd.DataFrame":
+        """Every finished cell (for this parameter hash unless `all_params`)"""
+        import pandas as pd
+        where, args = ("", ()) if all_params else (" WHERE param_hash=?", (self.param_hash,))
+        return pd.read_sql_query(f"SELECT * FROM cells{where}", self.conn, params=args)
+
+    def status(self, seed) -> dict:
+        """Progress of every cell stored for `seed`, under any parameter hash.
+
+        Returns
+        -------
+        dict
+            {(n_subjects, n_items, n_questions, param_hash): (iterations stored, finished)}
+        """
+        out = {}
+        for *key, n in self.conn.execute(
+                "SELECT n_subjects, n_items, n_questions, param_hash, COUNT(*) FROM iterations WHERE seed=? "
+                "GROUP BY n_subjects, n_items, n_questions, param_hash", (str(seed),)):
+            out[tuple(key)] = (n, False)
+        for key in self.conn.execute(
+                "SELECT n_subjects, n_items, n_questions, param_hash FROM cells WHERE seed=?", (str(seed),)):
+            out[tuple(key)] = (out.get(tuple(key), (0, False))[0], True)
+        return out
+
+    def progress(self) -> "pd.DataFrame":
+        """Running success counts per cell, including cells that are still in flight"""
+        import pandas as pd
+        return pd.read_sql_query(
+            "SELECT n_subjects, n_items, n_questions, seed, COUNT(*) AS iterations, "
+            "AVG(success) AS power FROM iterations WHERE param_hash=? "
+            "GROUP BY n_subjects, n_items, n_questions, seed", self.conn, params=(self.param_hash,))
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,178 @@
+"""Surrogate power surface over design sizes and variance parameters.
+
+Sweeping `sd.item`, `sd.subject`, `sd.error` and `sd.question` jointly with
+the design sizes by brute force is out of reach. `active_learning` instead
+fits a logistic regression to the success counts of simulated cells and
+spends each new round of simulation where the surface is most uncertain
+about which side of `desired_power` a cell falls:
+
+    logit P(success) = f(log n.subject, log n.item, log n.question, log sd.*)
+
+with f quadratic (main effects, squares and pairwise products) and a
+ridge penalty. The Laplace approximation of the posterior gives the
+uncertainty of every prediction; candidates are scored by
+
+    z * sd(logit p) - |logit p - logit desired_power|
+
+(the "straddle" heuristic), so the next batch sits on the estimated
+boundary where the surface is least certain. The fitted `PowerSurface`
+is a handful of coefficients and answers a query in microseconds.
+
+    >>> space = {"n.subject": (10, 200), "n.item": (10, 60), "n.question": (2, 4),
+    ...          "sd.item": (10, 60), "sd.error": (20, 100)}
+    >>> surface, history = active_learning(DG, 0.05, 0.8, space, question_sd, backend="numpy")
+    >>> surface.predict({"n.subject": 80, "n.item": 30, "n.question": 2, "sd.item": 30, "sd.error": 50})
+"""
+
+from itertools import combinations_with_replacement
+import numpy as np
+import pandas as pd
+from scipy.special import expit, logit
+
+from sweep import Cell
+
+DESIGN = ("n.subject", "n.item", "n.question")
+
+
+class PowerSurface:
+    """Quadratic logistic model of the success probability.
+
+    Parameters
+    ----------
+    space: dict
+        Bounds (low, high) of every input; design sizes must be among them.
+    ridge: float
+        Penalty on every coefficient but the intercept.
+    """
+    def __init__(self, space:dict, ridge:float=1e-2):
+        for name in DESIGN:
+            if name not in space:
+                raise KeyError(f"space needs bounds for {name}")
+        self.names = list(space)
+        self.space = {name: tuple(float(v) for v in space[name]) for name in self.names}
+        low, high = np.log(np.array([self.space[n] for n in self.names])).T
+        self._center, self._scale = (low + high) / 2, np.maximum((high - low) / 2, 1e-12)
+        self._i, self._j = np.array(list(combinations_with_replacement(range(len(self.names)), 2))).T
+        self.ridge = ridge
+        self.coef = self.cov = None
+
+    def _inputs(self, X) -> np.ndarray:
+        if isinstance(X, dict) or isinstance(X, pd.DataFrame):
+            X = np.column_stack([np.ravel(X[name]) for name in self.names])
+        return np.atleast_2d(np.asarray(X, dtype=float))
+
+    def features(self, X) -> np.ndarray:
+        z = (np.log(self._inputs(X)) - self._center) / self._scale
+        return np.hstack([np.ones((len(z), 1)), z, z[:, self._i] * z[:, self._j]])
+
+    def fit(self, X, k, n, maxiter:int=100) -> "PowerSurface":
+        """Fit to `k` successes out of `n` iterations at inputs `X` (Newton / IRLS)"""
+        F, k, n = self.features(X), np.asarray(k, dtype=float), np.asarray(n, dtype=float)
+        penalty = np.full(F.shape[1], self.ridge)
+        penalty[0] = 0
+        beta = np.zeros(F.shape[1])
+        for _ in range(maxiter):
+            p = expit(F @ beta)
+            H = F.T @ (F * (n * p * (1 - p))[:, None]) + np.diag(penalty)
+            step = np.linalg.solve(H, F.T @ (k - n * p) - penalty * beta)
+            beta += step
+            if np.max(np.abs(step)) < 1e-8:
+                break
+        p = expit(F @ beta)
+        H = F.T @ (F * (n * p * (1 - p))[:, None]) + np.diag(penalty)
+        self.coef, self.cov = beta, np.linalg.inv(H)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        """Success probability (power) at `X`: an (n, d) array in `names` order or a dict/DataFrame of columns"""
+        return expit(self.features(X) @ self.coef)
+
+    def logit_sd(self, X) -> np.ndarray:
+        """Posterior SD of the logit at `X` (Laplace approximation)"""
+        F = self.features(X)
+        return np.sqrt(np.einsum("ij,jk,ik->i", F, self.cov, F))
+
+    def acquisition(self, X, desired_power:float, z:float=1.96) -> np.ndarray:
+        """Straddle score: high where the boundary may pass through `X`"""
+        F = self.features(X)
+        return z * np.sqrt(np.einsum("ij,jk,ik->i", F, self.cov, F)) - np.abs(F @ self.coef - logit(desired_power))
+
+    def sample(self, n:int, rng=None) -> np.ndarray:
+        """Log-uniform draws from `space`, design sizes rounded to integers"""
+        rng = np.random.default_rng(rng)
+        low, high = np.log(np.array([self.space[name] for name in self.names])).T
+        X = np.exp(rng.uniform(low, high, (n, len(self.names))))
+        for j, name in enumerate(self.names):
+            if name in DESIGN:
+                X[:, j] = np.round(X[:, j])
+        return X
+
+
+def _cells(surface:PowerSurface, X:np.ndarray, start:int=0) -> list[Cell]:
+    """Simulation cells for inputs `X`; a scalar `sd.question` is used for every question slope"""
+    out = []
+    for i, x in enumerate(X):
+        values = dict(zip(surface.names, x))
+        S, I, Q = (int(values.pop(name)) for name in DESIGN)
+        if "sd.question" in values:
+            values["sd.question"] = np.full(max(Q - 1, 1), values["sd.question"])
+        out.append(Cell(start + i, S, I, Q, values))
+    return out
+
+
+def active_learning(DG, p_threshold, desired_power, space:dict, question_sd, n_init:int=16, n_rounds:int=8,
+                    batch:int=4, n_iter:int=20, n_candidates:int=2000, ridge:float=1e-2, seed=None,
+                    **kwargs) -> tuple[PowerSurface, pd.DataFrame]:
+    """Fit a `PowerSurface` by simulating the cells it is least sure about.
+
+    Parameters
+    ----------
+    DG, p_threshold, desired_power, question_sd
+        As in `agg`. Variance parameters in `space` override the
+        generator's for each simulated cell.
+    space: dict
+        Bounds (low, high) per input: `n.subject`, `n.item`, `n.question`
+        and any of `sd.item`, `sd.subject`, `sd.error`, `sd.question`.
+    n_init: int
+        Cells simulated before the first fit.
+    n_rounds, batch: int
+        Rounds of active learning and cells simulated per round.
+    n_iter: int
+        Iterations per cell. All of them are run (no early stopping), so
+        every cell contributes a binomial count.
+    n_candidates: int
+        Random candidates scored per round.
+    **kwargs
+        Passed on to `agg` (e.g. `backend`, `n_jobs`, `pool`).
+
+    Returns
+    -------
+    tuple[PowerSurface, pd.DataFrame]
+        The fitted surface and every simulated cell with its inputs,
+        successes and iterations.
+    """
+    rng = np.random.default_rng(seed)
+    surface = PowerSurface(space, ridge)
+    kwargs = {"stopping": "wilson", "min_iter": n_iter, "verbose": False, **kwargs}
+    from utils import agg
+
+    def simulate(X):
+        specs = _cells(surface, X, len(history))
+        results = agg(DG, p_threshold, desired_power, specs, question_sd, n_iter=n_iter,
+                      seed=int(rng.integers(2**63)), **kwargs)
+        n = results["iterations_run"].to_numpy()
+        frame = pd.DataFrame(X, columns=surface.names).assign(
+            successes=np.round(results["power"].to_numpy() * n).astype(int), iterations=n)
+        history.extend(frame.to_dict("records"))
+
+    history = []
+    simulate(surface.sample(n_init, rng))
+    for _ in range(n_rounds):
+        frame = pd.DataFrame(history)
+        surface.fit(frame[surface.names], frame["successes"], frame["iterations"])
+        candidates = surface.sample(n_candidates, rng)
+        simulate(candidates[np.argsort(-surface.acquisition(candidates, desired_power))[:batch]])
+
+    frame = pd.DataFrame(history)
+    surface.fit(frame[surface.names], frame["successes"], frame["iterations"])
+    return surface, frame
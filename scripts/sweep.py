@@ -0,0 +1,149 @@
+"""Lazy sweep specifications.
+
+`grid()` builds the whole Cartesian product as one numpy array before any
+work starts, and every axis has to share its dtype. A `Sweep` only keeps
+its axes and builds each cell when it is asked for, so its memory grows
+with the number of axis values, not the number of cells.
+
+Cells are `Cell` records: the (n_subjects, n_items, n_questions) design
+plus a dict of generating-parameter overrides. Axis values can be any
+object (scalars, SD vectors, correlation matrices). Values that depend on
+the design are cut to size per cell by `utils.cell_update`: an
+`sd.question` vector is sliced to `[:n_question - 1]`, and a callable is
+called with `n_question` (e.g. `np.eye`).
+
+    >>> spec = Sweep(subjects=range(10, 101, 10), items=[20, 40], questions=[2, 3],
+    ...              **{"sd.item": [20, 30], "sd.question": [[10, 12], [20, 24]]})
+    >>> len(spec), spec[0]
+    >>> results = agg(DG, 0.05, 0.8, spec.shard(3, 16), question_sd)
+
+The design axes vary in the order `grid` uses (questions slowest, then
+subjects, then items); parameter axes vary fastest, in the order given.
+Slices and shards are views that keep the global `Cell.index`.
+"""
+
+import math
+from typing import NamedTuple
+
+
+class Cell(NamedTuple):
+    """One cell of a sweep"""
+    index: int
+    n_subjects: int
+    n_items: int
+    n_questions: int
+    params: dict
+
+    @property
+    def row(self) -> tuple:
+        return (self.n_subjects, self.n_items, self.n_questions)
+
+
+def label(value):
+    """Table-friendly form of a parameter value (used for result columns)"""
+    if callable(value):
+        return getattr(value, "__name__", repr(value))
+    if hasattr(value, "tolist"): # numpy arrays and scalars
+        value = value.tolist()
+    return str(value) if isinstance(value, (list, tuple)) else value
+
+
+def tag(result, params:dict=None):
+    """`result` with a column per parameter override"""
+    if not params:
+        return result
+    return result.assign(**{name: label(value) for name, value in params.items()})
+
+
+class Sweep:
+    """Lazy Cartesian product of design sizes and generating parameters.
+
+    Parameters
+    ----------
+    subjects, items, questions: array-like
+        Design sizes, as passed to `grid`.
+    **params
+        Generating-parameter axes (e.g. `sd.item=[20, 30]`); every value
+        is one setting of that parameter.
+    """
+    def __init__(self, subjects, items, questions, **params):
+        self.subjects = [int(n) for n in subjects]
+        self.items = [int(n) for n in items]
+        self.questions = [int(n) for n in questions]
+        self.params = {name: list(values) for name, values in params.items()}
+        self._axes = [self.questions, self.subjects, self.items, *self.params.values()]
+        self._inner = math.prod(len(values) for values in self.params.values())
+        self.indices = range(math.prod(len(axis) for axis in self._axes))
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __repr__(self) -> str:
+        axes = [f"subjects={len(self.subjects)}", f"items={len(self.items)}", f"questions={len(self.questions)}"]
+        axes += [f"{name}={len(values)}" for name, values in self.params.items()]
+        return f"Sweep({', '.join(axes)}; {len(self)} cells)"
+
+    def _cell(self, i:int) -> Cell:
+        position = []
+        rest = i
+        for axis in reversed(self._axes):
+            rest, k = divmod(rest, len(axis))
+            position.append(axis[k])
+        q, s, n, *values = reversed(position)
+        return Cell(i, s, n, q, dict(zip(self.params, values)))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            view = object.__new__(Sweep)
+            view.__dict__.update(self.__dict__)
+            view.indices = self.indices[key]
+            return view
+        return self._cell(self.indices[key])
+
+    def __iter__(self):
+        for i in self.indices:
+            yield self._cell(i)
+
+    def cost(self, i:int) -> int:
+        """Relative fitting cost (n_subject * n_item * n_question) of cell `i`"""
+        rest, n = divmod(i // self._inner, len(self.items))
+        q, s = divmod(rest, len(self.subjects))
+        return self.questions[q] * self.subjects[s] * self.items[n]
+
+    def shard(self, shard:int, n_shards:int, balanced:bool=True) -> "Sweep":
+        """View of one of `n_shards` disjoint shards of the cells.
+
+        With `balanced`, cells are dealt to the shards by decreasing cost
+        in snake order (0..n-1, n-1..0, ...), so every shard gets a similar
+        amount of work; the shard's indices are then held in a list.
+        Otherwise the view is every `n_shards`-th cell starting at
+        `shard`, which stays lazy.
+        """
+        if not 0 <= shard < n_shards:
+            raise ValueError(f"shard must be in [0, {n_shards}), got {shard}")
+        if not balanced:
+            return self[shard::n_shards]
+        order = sorted(self.indices, key=lambda i: (-self.cost(i), i))
+        lanes = (shard, 2 * n_shards - 1 - shard)
+        view = object.__new__(Sweep)
+        view.__dict__.update(self.__dict__)
+        view.indices = sorted(i for p, i in enumerate(order) if p % (2 * n_shards) in lanes)
+        return view
+
+    @property
+    def largest(self) -> tuple:
+        """Largest (n_subject, n_item) of the full sweep, e.g. for common random numbers"""
+        return max(self.subjects), max(self.items)
+
+
+def cells(combinations):
+    """Iterate over `Cell`s of a `Sweep`, a list of `Cell`s or an array of (n_subject, n_item, n_question) rows"""
+    if isinstance(combinations, Sweep):
+        yield from combinations
+        return
+    for i, row in enumerate(combinations):
+        if isinstance(row, Cell):
+            yield row
+            continue
+        n_subject, n_item, n_question = (int(n) for n in row)
+        yield Cell(i, n_subject, n_item, n_question, {})
@@ -0,0 +1,232 @@
+"""Columnar binary format for simulated data.
+
+Used both to hand datasets to R and to store them on disk (`.wscb` files,
+see `save` and `convert`). On disk, `meta` holds the generating params and
+seed. Each column is a single aligned block, so `read` can memory-map it.
+
+Layout (all little-endian)
+--------------------------
+    magic     4 bytes  b"WSCB"
+    version   int32
+    nrow      int32
+    ncol      int32
+    meta      int32 length + UTF-8 JSON (may be empty)
+    columns   ncol x [int32 length + name, int32 type, float64 offset,
+                      int32 nlevels, nlevels x (int32 length + level)]
+    data      one contiguous block per column starting at `offset`,
+              each block aligned to 8 bytes
+
+Column types: 1 int8, 2 int16, 3 int32, 4 float32, 5 float64 and
+6 factor (uint8 codes into `levels`). Integer codes (subject, item,
+question) are int16 when they fit, modality is a 1-byte factor and rt is
+float64, or float32 on request.
+
+Convert existing CSVs with
+
+    python transport.py data/*.csv [--float32]
+"""
+
+import os
+import sys
+import json
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+
+MAGIC = b"WSCB"
+VERSION = 1
+DTYPES = {1: "<i1", 2: "<i2", 3: "<i4", 4: "<f4", 5: "<f8", 6: "<u1"}
+FACTOR = 6
+LEVELS = {"modality": ["word", "image"]} # level order used by the models
+
+# R reader for the layout above; returns a data.frame with integer codes and factors
+READER = r"""
+read_wiscs <- function(path, remove = FALSE) {
+  con <- file(path, "rb")
+  on.exit({close(con); if (remove) unlink(path)})
+  int <- function() readBin(con, "integer", 1, size = 4, endian = "little")
+  str <- function() rawToChar(readBin(con, "raw", int()))
+  if (rawToChar(readBin(con, "raw", 4)) != "WSCB") stop("not a WSCB file: ", path)
+  version <- int(); nrow <- int(); ncol <- int(); meta <- str()
+  what <- c("integer", "integer", "integer", "double", "double", "integer")
+  size <- c(1, 2, 4, 4, 8, 1)
+  cols <- vector("list", ncol)
+  for (k in seq_len(ncol)) {
+    name <- str(); type <- int()
+    offset <- readBin(con, "double", 1, size = 8, endian = "little")
+    nlev <- int()
+    lev <- vapply(seq_len(nlev), function(i) str(), "")
+    cols[[k]] <- list(name = name, type = type, offset = offset, levels = lev)
+  }
+  out <- list()
+  for (col in cols) {
+    seek(con, where = col$offset)
+    x <- readBin(con, what[col$type], nrow, size = size[col$type],
+                 signed = col$type != 6, endian = "little")
+    if (col$type == 6) x <- factor(col$levels[x + 1], levels = col$levels)
+    out[[col$name]] <- x
+  }
+  df <- as.data.frame(out, stringsAsFactors = FALSE)
+  attr(df, "meta") <- meta
+  df
+}
+"""
+
+def _jsonable(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    return str(x)
+
+def _pack_str(s:str) -> bytes:
+    b = s.encode("utf-8")
+    return struct.pack("<i", len(b)) + b
+
+def _column(name:str, values:pd.Series, float32:bool=False):
+    """Return (type, array, levels) for one DataFrame column"""
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values):
+        levels = LEVELS.get(name, sorted(pd.unique(values.astype(str))))
+        codes = pd.Categorical(values.astype(str), categories=levels).codes
+        if (codes < 0).any() or len(levels) > 255:
+            raise ValueError(f"Column {name!r} cannot be stored as a factor")
+        return FACTOR, codes.astype(DTYPES[FACTOR]), levels
+    if pd.api.types.is_bool_dtype(values):
+        return 1, values.to_numpy().astype(DTYPES[1]), []
+    if pd.api.types.is_integer_dtype(values):
+        lo, hi = (values.min(), values.max()) if len(values) else (0, 0)
+        t = 2 if np.iinfo(np.int16).min <= lo and hi <= np.iinfo(np.int16).max else 3
+        return t, values.to_numpy().astype(DTYPES[t]), []
+    if pd.api.types.is_float_dtype(values):
+        t = 4 if float32 else 5
+        return t, values.to_numpy().astype(DTYPES[t]), []
+    raise TypeError(f"Unsupported dtype {values.dtype} for column {name!r}")
+
+def write(df:pd.DataFrame, path:str=None, meta:dict=None, float32:bool=False) -> str:
+    """Write `df` in the WSCB layout.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Data to write. Integer columns are narrowed to int16 when they fit,
+        string columns become factors.
+    path: str
+        Output file. Default is a new temporary file.
+    meta: dict
+        Metadata stored in the header as JSON. Numpy values are converted
+        to lists/scalars, anything else not serializable to its string.
+    float32: bool
+        Store float columns as float32. Default is False.
+
+    Returns
+    -------
+    str
+        Path of the written file.
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".wscb")
+        os.close(fd)
+
+    columns = [(str(name),) + _column(str(name), df[name], float32) for name in df.columns]
+    meta_bytes = _pack_str(json.dumps(meta, default=_jsonable) if meta else "")
+
+    # header size is known before the offsets are filled in
+    header = len(MAGIC) + 12 + len(meta_bytes)
+    for name, _, _, levels in columns:
+        header += len(_pack_str(name)) + 16 + sum(len(_pack_str(l)) for l in levels)
+
+    offsets, offset = [], header
+    for _, _, array, _ in columns:
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += array.nbytes
+
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<iii", VERSION, len(df), len(columns)) + meta_bytes)
+        for (name, t, _, levels), off in zip(columns, offsets):
+            f.write(_pack_str(name) + struct.pack("<idi", t, off, len(levels)))
+            f.write(b"".join(_pack_str(l) for l in levels))
+        for (_, _, array, _), off in zip(columns, offsets):
+            f.write(b"\0" * (off - f.tell()))
+            f.write(array.tobytes())
+    return path
+
+def to_r_binary(df:pd.DataFrame, remove:bool=True) -> str:
+    """Binary counterpart of `rinterface.utils.to_r`.
+
+    Writes `df` to a temporary file and returns the R expression that loads
+    it. The script must also contain `READER`. With `remove`, R deletes the
+    file once it has been read.
+    """
+    path = write(df).replace(os.sep, "/")
+    return f'read_wiscs("{path}", remove = {"TRUE" if remove else "FALSE"})'
+
+def _read_str(f) -> str:
+    n, = struct.unpack("<i", f.read(4))
+    return f.read(n).decode("utf-8")
+
+def read_header(path:str) -> tuple[int, dict, list]:
+    """Row count, metadata and column descriptions (name, type, offset, levels)"""
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"Not a WSCB file: {path}")
+        version, nrow, ncol = struct.unpack("<iii", f.read(12))
+        if version != VERSION:
+            raise ValueError(f"Unsupported WSCB version {version} in {path}")
+        meta = _read_str(f)
+        columns = []
+        for _ in range(ncol):
+            name = _read_str(f)
+            t, offset, nlevels = struct.unpack("<idi", f.read(16))
+            columns.append((name, t, int(offset), [_read_str(f) for _ in range(nlevels)]))
+    return nrow, json.loads(meta) if meta else {}, columns
+
+def read(path:str, columns:list[str]=None, mmap:bool=True) -> pd.DataFrame:
+    """Read a WSCB file written by `write`.
+
+    Parameters
+    ----------
+    path: str
+        File to read.
+    columns: list[str]
+        Subset of columns to load. Default is all.
+    mmap: bool
+        Memory-map the column blocks instead of reading them. Pages are
+        only read when touched. Default is True.
+
+    Returns
+    -------
+    pd.DataFrame
+        Integer columns keep their stored width, factors become
+        categoricals. The metadata is in `df.attrs["meta"]`.
+    """
+    nrow, meta, described = read_header(path)
+    data = {}
+    for name, t, offset, levels in described:
+        if columns is not None and name not in columns:
+            continue
+        if mmap:
+            values = np.memmap(path, dtype=DTYPES[t], mode="r", offset=offset, shape=(nrow,))
+        else:
+            values = np.fromfile(path, dtype=DTYPES[t], count=nrow, offset=offset)
+        data[name] = pd.Categorical.from_codes(values, categories=levels) if t == FACTOR else values
+    df = pd.DataFrame(data, copy=False)
+    df.attrs["meta"] = meta
+    return df
+
+def save(df:pd.DataFrame, path:str, params:dict=None, seed=None, float32:bool=False) -> str:
+    """Write a simulated dataset to disk with its generating params and seed"""
+    return write(df, path, meta={"params": params, "seed": seed}, float32=float32)
+
+def convert(csv:str, out:str=None, params:dict=None, seed=None, float32:bool=False) -> str:
+    """Convert a dataset CSV (e.g. in `data/`) to a `.wscb` file next to it"""
+    df = pd.read_csv(csv)
+    df = df.drop(columns=[c for c in df.columns if c.startswith("Unnamed:")]) # saved indices
+    return save(df, out or os.path.splitext(csv)[0] + ".wscb", params, seed, float32)
+
+if __name__ == "__main__":
+    float32 = "--float32" in sys.argv
+    for csv in (a for a in sys.argv[1:] if a != "--float32"):
+        out = convert(csv, float32=float32)
+        print(f"{csv} ({os.path.getsize(csv) / 2**20:.2f} MB) -> {out} ({os.path.getsize(out) / 2**20:.2f} MB)")
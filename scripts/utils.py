@@ -2,18 +2,28 @@ import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
-from rinterface.utils import to_r
-import rinterface.rinterface as R
+# rinterface, lmm (scipy) and joblib are imported where they are used, so
+# workers only load the engine they fit with
+
 from wiscs.utils import make_tasks
+from transport import READER, to_r_binary, write
+from simulate import BatchGenerator
+import sequential
+from metrics import Record
+from sweep import Sweep, cells, tag
+from store import param_hash
 
 from tqdm import tqdm
-from joblib import Parallel, delayed
 import os
 import pandas as pd
+from copy import deepcopy
 
 
 def grid(**kwargs):
     """Generate all possible combinations of elements in K arrays
+
+    The product is built in memory; see `sweep.Sweep` for a lazy version
+    that also sweeps generating parameters.
     
     **kwargs
     -------
@@ -22,17 +32,27 @@ def grid(**kwargs):
     """
     return np.array(np.meshgrid(*list(kwargs.values()))).T.reshape(-1, len(kwargs))
 
-# code for model eval in R
-def code(df, p_threshold):
-    return (f"""
-    suppressMessages(library(lme4))
-    suppressMessages(library(dplyr))
-    suppressMessages(library(lmerTest))
+# lmer with starting values from an earlier fit; falls back to lme4's default
+# start if the warm fit errors (e.g. wrong theta length) or fails to converge
+WARM_LMER = """
+    warm_lmer <- function(formula, data, control, theta = NULL) {
+        fit <- NULL
+        if (!is.null(theta)) {
+            fit <- tryCatch(lmer(formula, data = data, REML = FALSE, control = control, start = list(theta = theta)),
+                            error = function(e) NULL)
+            if (!is.null(fit) && length(fit@optinfo$conv$lme4$messages) > 0) fit <- NULL
+        }
+        if (is.null(fit)) fit <- lmer(formula, data = data, REML = FALSE, control = control)
+        fit
+    }
+"""
 
-    # import data from Python
-    df <- {to_r(df)}
+def r_vector(x):
+    """R source for a numeric vector, or NULL"""
+    return "NULL" if x is None else "c(" + ", ".join(repr(float(v)) for v in np.ravel(x)) + ")"
 
-    # factorize + treatment coding
+# factorize + treatment coding of a data frame `df` loaded in R
+FACTORIZE = """
     df$question <- as.factor(df$question)
     df$subject <- as.factor(df$subject)
     df$item <- as.factor(df$item)
@@ -42,15 +62,24 @@ def code(df, p_threshold):
     #  set reference levels
     df$question <- relevel(df$question, ref = "0")
     df$item <- relevel(df$item, ref = "0")
+"""
 
-    # load data
-    df <- {to_r(df)}
-
+def _models(start):
+    return f"""
     # model
     # supress singular fit warnings
     control <- lmerControl(optimizer = "bobyqa", check.conv.singular = "ignore")
-    shared <- lmer(rt ~ modality + question + (1 + question | subject) + (1 + question | item), data = df, REML = FALSE, control = control) # nolint
-    separate <- lmer(rt ~ modality * question + (1 + question | subject) + (1 + question | item), data = df, REML = FALSE, control = control) # nolint
+    {WARM_LMER}
+    shared <- warm_lmer(rt ~ modality + question + (1 + question | subject) + (1 + question | item), df, control, {r_vector(start)}) # nolint
+    separate <- warm_lmer(rt ~ modality * question + (1 + question | subject) + (1 + question | item), df, control, getME(shared, "theta")) # nolint
+"""
+
+def _compare(p_threshold):
+    return f"""
+    theta <- getME(shared, "theta")
+    nfev <- shared@optinfo$feval + separate@optinfo$feval
+    converged <- as.integer(length(shared@optinfo$conv$lme4$messages) == 0 && length(separate@optinfo$conv$lme4$messages) == 0)
+    singular <- as.integer(isSingular(shared) || isSingular(separate))
 
     # compare
     aicvalues <- c("Shared" = AIC(shared), "Separate" = AIC(separate))
@@ -60,36 +89,303 @@ def code(df, p_threshold):
 
     # @grab{{int}}
     success <- ifelse(p_value > {p_threshold}, 1, 0)
-    """)
+    """
 
-def run(DG, p_threshold, desired_power, row, question_sd, n_iter=10, verbose=True):
-    
-    iter = tqdm(np.arange(0, n_iter+1)) # instantiate iter obj
+# code for model eval in R
+def code(df, p_threshold, start=None):
+    """R script fitting both models to `df`; `success` is 1 if the shared model wins.
+
+    `start` is a theta from an earlier fit of the shared model (e.g. the
+    previous iteration). The shared fit then starts from it and the
+    separate fit starts from the shared theta. `theta` holds the shared
+    theta for the next warm start.
+    """
+    return (f"""
+    suppressMessages(library(lme4))
+    suppressMessages(library(dplyr))
+    suppressMessages(library(lmerTest))
+
+    # import data from Python
+    {READER}
+    df <- {to_r_binary(df)}
+
+    # factorize + treatment coding
+    {FACTORIZE}
+    {_models(start)}
+    {_compare(p_threshold)}""")
+
+def refit_code(rt, design, p_threshold, start=None, keep=8):
+    """R script like `code` for one dataset of a cell with a fixed design.
+
+    `design` is the cell's design written with `transport.write` (every
+    column but rt, in the row order of `rt`). Each R worker keeps the
+    fitted models of its `keep` most recent designs; further datasets of
+    the same design only swap in the response and `refit()`, which skips
+    rebuilding the model frame and Z and starts from the last estimates.
+    A refit that errors or does not converge is redone as a full fit.
+    """
+    return (f"""
+    suppressMessages(library(lme4))
+    suppressMessages(library(dplyr))
+    suppressMessages(library(lmerTest))
+
+    # import response from Python
+    {READER}
+    rt <- {to_r_binary(pd.DataFrame({"rt": np.asarray(rt, dtype=float)}))}$rt
+
+    # fitted models per design, kept across scripts in the worker's global env
+    key <- "{design}"
+    if (!exists(".wiscs_models", envir = globalenv())) assign(".wiscs_models", list(), envir = globalenv())
+    cache <- get(".wiscs_models", envir = globalenv())
+
+    fits <- cache[[key]]
+    if (!is.null(fits)) {{
+        fits <- tryCatch(lapply(fits, refit, newresp = rt), error = function(e) NULL)
+        if (!is.null(fits) && any(sapply(fits, function(m) length(m@optinfo$conv$lme4$messages) > 0))) fits <- NULL
+    }}
+    if (is.null(fits)) {{
+        df <- read_wiscs("{design}", remove = FALSE)
+        df$rt <- rt
+        {FACTORIZE}
+        {_models(start)}
+        fits <- list(shared = shared, separate = separate)
+    }}
+    cache[[key]] <- NULL
+    cache[[key]] <- fits # most recent last
+    assign(".wiscs_models", tail(cache, {keep}), envir = globalenv())
+    shared <- fits$shared
+    separate <- fits$separate
+    {_compare(p_threshold)}""")
+
+def cell_update(row, question_sd, params:dict=None) -> dict:
+    """Generator parameter overrides for one (n_subject, n_item, n_question) cell.
+
+    `params` are further overrides, e.g. `sweep.Cell.params`. An
+    `sd.question` among them replaces `question_sd`; callables are called
+    with n_question.
+    """
+    n_subject, n_item, n_question = row
+    params = dict(params or {})
+    question_sd = params.pop("sd.question", question_sd)
+    task = make_tasks(low=100, high=200, n=n_question, seed=2025)
+    update = {'word.task':task, 'image.task':task, 'sd.question': question_sd[:n_question-1], 'corr.subject': np.eye(n_question), 'corr.item':np.eye(n_question), 'n.question': n_question, 'n.item': n_item, 'n.subject': n_subject}
+    update.update({k: v(n_question) if callable(v) else v for k, v in params.items()})
+    return update
+
+def unit_seed(seed, row, j) -> np.random.SeedSequence:
+    """Seed of iteration `j` of a cell, independent of the order units run in"""
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + tuple(int(n) for n in row) + (int(j),))
+
+def iteration_seed(seed, row, j, params=None, nest=None) -> np.random.SeedSequence:
+    """Seed of iteration `j` of the cell `row` with overrides `params`, the same whichever path runs it.
+
+    With `nest`, iteration j of every cell shares one seed (common random
+    numbers); cells of one design with different `params` get their own.
+    """
+    if nest is not None:
+        return unit_seed(seed, (), j)
+    if params:
+        return unit_seed(seed, tuple(row) + (int(param_hash(params), 16),), j)
+    return unit_seed(seed, row, j)
+
+def seed_key(seed:np.random.SeedSequence):
+    """Store key of a root seed"""
+    return seed.entropy if not seed.spawn_key else f"{seed.entropy}/{'.'.join(map(str, seed.spawn_key))}"
+
+def wiscs_seed(seed) -> int:
+    """Integer seed for wiscs' `DataGenerator.fit_transform` from an iteration's seed (int or SeedSequence)"""
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return int(seed.generate_state(1)[0])
+
+def fit(df, p_threshold, backend="R", pool=None, warm=None, record=None) -> int:
+    """Fit shared and separate models to one dataset; 1 if the shared model wins.
+
+    `warm` is a dict carried across datasets of one cell. Fits start from
+    the theta it holds and store their own for the next call. After
+    `fix_design`, it also holds the cell's model structures, so only the
+    response changes between fits. Warm starts and refits need the numpy
+    backend or a `pool`; the rinterface path only returns `success`.
+
+    A `metrics.Record` gets the script, execute and parse timings and the
+    fit's nfev, converged and singular flags (not on the rinterface path).
+    """
+    record = Record() if record is None else record
+    start = warm.get("theta") if warm is not None else None
+    if backend == "numpy":
+        import lmm
+        with record.phase("execute"):
+            result = lmm.compare(df, {"shared": start}, warm.get("models") if warm is not None else None)
+        with record.phase("parse"):
+            theta = result["theta_shared"]
+            success = int(result["p_value"] > p_threshold)
+            record.update(nfev=result["nfev"], converged=result["converged"], singular=result["singular"])
+    elif pool is not None:
+        with record.phase("script"):
+            if warm is not None and "design" in warm:
+                script = refit_code(df["rt"], warm["design"], p_threshold, start)
+            else:
+                script = code(df, p_threshold, start)
+        with record.phase("execute"):
+            out = pool.eval(script, grab="success;theta;nfev;converged;singular")
+        with record.phase("parse"):
+            success, theta, nfev, converged, singular = out.split(";")
+            success, theta = int(success), np.array(theta.split(","), dtype=float)
+            record.update(nfev=int(float(nfev)), converged=bool(int(converged)), singular=bool(int(singular)))
+    else:
+        import rinterface.rinterface as R
+        with record.phase("script"):
+            script = code(df, p_threshold)
+        with record.phase("execute"):
+            out = R(script, grab=True)
+        with record.phase("parse"):
+            return int(out)
+    if warm is not None:
+        warm["theta"] = theta
+    return success
+
+def fix_design(warm:dict, design, backend="R"):
+    """Build the model structures of a cell whose design is the same for every dataset.
+
+    Numpy models are kept in `warm`; for R the design is written once and
+    each worker builds (and keeps) the models on its first fit.
+    """
+    if backend == "numpy" and "models" not in warm:
+        import lmm
+        warm["models"] = lmm.build_models(design)
+    elif backend != "numpy" and "design" not in warm:
+        warm["design"] = write(design)
+
+def release_design(warm:dict):
+    """Drop what `fix_design` built"""
+    warm.pop("models", None)
+    path = warm.pop("design", None)
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+def run(DG, p_threshold, desired_power, row, question_sd, n_iter=10, verbose=True, pool=None, backend="R", seed=None,
+        stopping="heuristic", alpha=0.05, min_iter=5, store=None, resume=True, nest=None,
+        warm_start=False, refit=True, metrics=None, params=None):
+    """Estimate power for a single (n_subject, n_item, n_question) cell.
+
+    `params` are the cell's generating-parameter overrides (see
+    `cell_update` and `sweep.Sweep`). They are added to the result as
+    columns and keep the cell apart from others of the same design in
+    `store`.
+
+    `backend` selects the fitting engine: "R" (lme4 through rinterface, or
+    through the warm workers of `pool`, an `rpool.RPool`) or "numpy" (the
+    in-process engine in `lmm.py`).
+
+    `DG` is a wiscs `DataGenerator` or a `simulate.BatchGenerator`.
+    Iteration j draws its data from `iteration_seed(seed, row, j, params,
+    nest)`, as the same unit does under `schedule.sweep`, so both
+    schedulers simulate the same datasets. `nest` is passed on to
+    `BatchGenerator.replicates` for common random numbers across cells.
+
+    With `warm_start`, each fit starts from the variance components of the
+    previous iteration (see `fit`). The optimum is then meant to be the
+    same as from the default start, but where the likelihood has several
+    optima a warm start can settle in another one and flip the LRT, so
+    fits start cold by default. With `refit` and a `BatchGenerator`, the
+    models are built once per cell and each iteration only refits the
+    response (see `fix_design`).
+
+    `stopping` is "heuristic" (the original rule) or a confidence interval
+    method from `sequential.METHODS`. With an interval, the cell stops as
+    soon as the (1 - `alpha`) interval for power lies above or below
+    `desired_power`, after at least `min_iter` iterations. The interval,
+    decision and iterations used are reported either way.
+
+    With a `store` (a `store.ResultStore`), every iteration and the final
+    cell are written as they finish. If `resume`, a finished cell is read
+    back instead of simulated and finished iterations are not re-fitted.
+
+    With `metrics` (a `metrics.Metrics`), the phase timings and fit
+    diagnostics of every fitted iteration are recorded.
+    """
+
+    iter = tqdm(np.arange(n_iter)) # instantiate iter obj
 
     n_subject, n_item, n_question = row 
+    batched = isinstance(DG, BatchGenerator)
+    if nest is not None and not batched:
+        raise TypeError("nest needs a simulate.BatchGenerator")
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    key = seed_key(seed)
+    if store is not None:
+        store = store.with_params(params)
+    if store is not None and resume:
+        cached = store.cell(row, key)
+        if cached is not None:
+            return tag(cached, params)
+    done = store.iterations(row, key) if store is not None and resume else {}
+
     if verbose:
         print(f"{n_subject} subjects | {n_item} items | {n_question} questions")
     success = np.zeros(n_iter, dtype=int)
+    warm = {} if warm_start or refit else None
 
     power = 0
+    decision = "undecided"
+
+    record = Record() # cell-level phases go to the first fitted iteration
+    with record.phase("update"):
+        update = cell_update(row, question_sd, params)
 
     j = -1
     for j, _ in enumerate(iter):
 
-        task = make_tasks(low=100, high=200, n=n_question, seed=2025)
-        # update data
-        update = {'word.task':task, 'image.task':task, 'sd.question': question_sd[:n_question-1], 'corr.subject': np.eye(n_question), 'corr.item':np.eye(n_question), 'n.question': n_question, 'n.item': n_item, 'n.subject': n_subject}
-        DG.fit_transform(update, overwrite=True)
+        if j in done:
+            success[j] = done[j]
+        else:
+            child = iteration_seed(seed, row, j, params, nest)
+            if batched:
+                with record.phase("generate"):
+                    design, Y = DG.replicates(1, update, seed=child, nest=nest)
+                with record.phase("convert"):
+                    df = design.assign(rt=Y[0])
+                    if refit and (backend == "numpy" or pool is not None):
+                        fix_design(warm, design, backend)
+            else:
+                # update data
+                with record.phase("generate"):
+                    DG.fit_transform(update, overwrite=True, seed=wiscs_seed(child))
+
+                # convert to dataframe
+                with record.phase("convert"):
+                    df = DG.to_pandas()
 
-        # convert to dataframe
-        df = DG.to_pandas()
+            # Fit the models and determine winner
+            success[j] = fit(df, p_threshold, backend, pool, warm, record)
+            if not warm_start and warm is not None:
+                warm.pop("theta", None) # `refit` alone keeps the models, not the start
+            if metrics is not None:
+                metrics.add(row, j, record, params)
+            record = Record()
 
-        # Run the R model and determine winner
-        success[j] = R(code(df, p_threshold), grab=True)
+            if store is not None:
+                store.add_iteration(row, key, j, success[j])
+
+        n_run, n_success = j + 1, np.sum(success[:j+1])
+
+        if stopping != "heuristic":
+            power = n_success / n_run
+            decision, lower, upper = sequential.decide(n_success, n_run, desired_power, stopping, alpha, min_iter)
+            iter.set_postfix({
+                "Power": round(power, 3),
+                "CI": f"[{lower:.2f}, {upper:.2f}]",
+                "Iteration": n_run,
+            })
+            if decision != "undecided":
+                iter.set_postfix({"Power": round(power, 3), "Status": f"Stopping: target {decision}"})
+                break
+            continue
 
         # Calculate current power
         power = np.sum(success) / n_iter
-        
+        decision = "undecided"
+
         # update tqdm
         iter.set_postfix({
             "Power": round(power, 3), 
@@ -101,44 +397,106 @@ def run(DG, p_threshold, desired_power, row, question_sd, n_iter=10, verbose=Tru
         # Check power / if power is possible
         if np.sum(success[:j+1] == 0) >= n_iter - (0.8 * n_iter) + 1:
             iter.set_postfix({"Power": round(power, 3), "Status": "Stopping: Power not possible"})
+            decision = "ruled out"
             break
 
         if power >= desired_power:
             iter.set_postfix({"Power": round(power, 3), "Status": "Stopping early"})
+            decision = "met"
             break
+
+    if warm is not None:
+        release_design(warm)
+
+    n_run = j + 1
+    lower, upper = sequential.interval(np.sum(success[:n_run]), n_run, "wilson" if stopping == "heuristic" else stopping, alpha)
     results_df = pd.DataFrame({
             "n_subjects": [n_subject],
             "n_items": [n_item],
             "n_questions": [n_question],
             "power": [power],
-            "iterations_run": [j + 1]
+            "power_lower": [lower],
+            "power_upper": [upper],
+            "decision": [decision],
+            "iterations_run": [n_run]
         })
+    if store is not None:
+        store.add_cell(row, key, results_df)
 
-    return results_df
+    return tag(results_df, params)
 
-def agg(DG, p_threshold, desired_power, combinations, question_sd, n_jobs=8, n_iter=10, parallelize=True, verbose=True):
+def agg(DG, p_threshold, desired_power, combinations, question_sd, n_jobs=8, n_iter=10, parallelize=True, verbose=True, pool=None, backend="R",
+        scheduler="iteration", crn=False, **kwargs):
     """
     Aggregates power calculations. Option to parallelize.
+
+    With a `pool`, work is dispatched on threads (one per R worker) since
+    the fitting itself happens in the pool's R processes. See `run` for
+    `backend`; other keyword arguments (e.g. `stopping`) are passed on to
+    `run`.
+
+    `scheduler` picks the parallel work unit: "iteration" (default) queues
+    every (cell, iteration) largest cell first (see `schedule.sweep`);
+    "cell" hands each grid row to one joblib task.
+
+    With `crn` (common random numbers, `BatchGenerator` only), every cell
+    reuses the draws of the largest design in `combinations`, so cells that
+    differ only in n_subject or n_item see nested datasets.
+
+    `combinations` is an array of (n_subject, n_item, n_question) rows
+    (e.g. from `grid`), a list of `sweep.Cell`s or a lazy `sweep.Sweep`,
+    whose cells are consumed as a stream and may carry
+    generating-parameter overrides.
+
+    A `metrics` keyword (a `metrics.Metrics`) collects per-phase timings
+    and fit diagnostics of every iteration; see `metrics.py` for how
+    records reach it from worker processes.
     """
+    if crn:
+        if not isinstance(DG, BatchGenerator):
+            raise TypeError("crn=True needs a simulate.BatchGenerator")
+        if isinstance(combinations, Sweep):
+            kwargs["nest"] = combinations.largest
+        else:
+            rows = np.array([cell.row for cell in cells(combinations)])
+            kwargs["nest"] = (rows[:, 0].max(), rows[:, 1].max())
+        if kwargs.get("seed") is None:
+            kwargs["seed"] = np.random.SeedSequence() # one stream shared by every cell
     
     if parallelize:
-        os.environ["JOBLIB_TEMP_FOLDER"] = "/scratch/$USER/tmp" # default
-        os.environ["TMPDIR"] = "/scratch/$USER/tmp" # default
-        results = _parallel_agg(DG, p_threshold, desired_power, combinations, question_sd, n_iter=n_iter, n_jobs=n_jobs)
+        tmp = os.path.expandvars("/scratch/$USER/tmp") # default
+        os.environ.setdefault("JOBLIB_TEMP_FOLDER", tmp)
+        os.environ.setdefault("TMPDIR", tmp)
+        if scheduler == "iteration":
+            from schedule import sweep
+            return sweep(DG, p_threshold, desired_power, combinations, question_sd, n_iter=n_iter, n_jobs=n_jobs, pool=pool, backend=backend, verbose=verbose, **kwargs)
+        results = _parallel_agg(DG, p_threshold, desired_power, combinations, question_sd, n_iter=n_iter, n_jobs=n_jobs, pool=pool, backend=backend, **kwargs)
     else:
         results = []
-        for row in combinations:
-            result_df = run(DG, p_threshold, desired_power, row, question_sd, n_iter=n_iter)
+        for cell in cells(combinations):
+            result_df = run(DG, p_threshold, desired_power, cell.row, question_sd, n_iter=n_iter, pool=pool, backend=backend, params=cell.params, **kwargs)
             results.append(result_df)
 
     # Concatenate results from all parallel runs
     results_df = pd.concat(results, ignore_index=True)
     return results_df
 
-def _parallel_agg(DG, p_threshold, desired_power, combinations, question_sd, n_iter=10, n_jobs=8):
+def _parallel_agg(DG, p_threshold, desired_power, combinations, question_sd, n_iter=10, n_jobs=8, pool=None, backend="R", **kwargs):
+    from joblib import Parallel, delayed
+
+    if backend != "R":
+        pool = None
+
+    if pool is not None:
+        # R workers are separate processes and cannot be pickled into loky workers
+        parallel = Parallel(n_jobs=len(pool), backend="threading")
+    else:
+        parallel = Parallel(n_jobs=n_jobs, backend="loky")
 
-    results = Parallel(n_jobs=n_jobs, backend="loky")(
-        delayed(run)(DG, p_threshold, desired_power, row, question_sd, n_iter) for row in tqdm(combinations, desc="Processing Grid")
+    results = parallel(
+        # each task gets its own generator, as loky would via pickling
+        delayed(run)(deepcopy(DG), p_threshold, desired_power, cell.row, question_sd, n_iter, pool=pool, backend=backend, params=cell.params, **kwargs)
+        for cell in tqdm(cells(combinations), total=len(combinations) if hasattr(combinations, "__len__") else None, desc="Processing Grid")
     )
 
     return results
\ No newline at end of file
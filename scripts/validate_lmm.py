@@ -0,0 +1,69 @@
+"""Compare the numpy engine in `lmm.py` with lme4 on the CSVs in `data/`.
+
+This comparison needs R and has not been run yet, so agreement with lme4
+is still pending. What is checked is the deviance itself: tests/test_lmm.py
+matches `CrossedLMM.deviance` and its fixed effects to a dense GLS
+evaluation of the same profiled likelihood, and its gradient to finite
+differences.
+
+`--out` records the comparison (file, field, numpy, lme4, abs_diff). At
+`lmm.VALIDATION`, and within `lmm.AGREEMENT`, the record makes the numpy
+backend selectable in `power.py`; commit it with the lme4 version used.
+
+Usage: python validate_lmm.py [csv ...] [--out validate_lmm.csv]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+import lmm
+from utils import code
+from rpool import RWorker
+
+FILES = ["../data/data_10_2.csv", "../data/data_15_3.csv", "../data/simulated_shared.csv"]
+FIELDS = ["loglik_shared", "loglik_separate", "aic_shared", "aic_separate", "chisq", "p_value"]
+
+# appended to `code()` so the worker can return every number at once
+EXTRACT = """
+    result <- c(logLik(shared), logLik(separate), aicvalues,
+                anova(shared, separate, test="Chisq")$Chisq[2], p_value)
+"""
+
+def validate(path:str, worker:RWorker) -> pd.DataFrame:
+    df = pd.read_csv(path)
+
+    start = time.perf_counter()
+    python = lmm.compare(df)
+    python_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    r = worker.eval(code(df, 0.05) + EXTRACT, grab="result")
+    r_time = time.perf_counter() - start
+
+    out = pd.DataFrame({
+        "numpy": [python[f] for f in FIELDS] + [python_time],
+        "lme4": [float(v) for v in r.split(",")] + [r_time],
+    }, index=FIELDS + ["seconds"])
+    out["abs_diff"] = np.abs(out["numpy"] - out["lme4"])
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", default=FILES)
+    parser.add_argument("--out", help="write the comparison here (lmm.VALIDATION to enable the numpy backend)")
+    args = parser.parse_args()
+    worker = RWorker()
+    results = []
+    try:
+        for path in args.files:
+            print(f"\n{path}")
+            out = validate(path, worker)
+            print(out.to_string())
+            results.append(out.rename_axis("field").reset_index().assign(file=path))
+    finally:
+        worker.close()
+    if args.out:
+        record = pd.concat(results, ignore_index=True)
+        record[["file", "field", "numpy", "lme4", "abs_diff"]].to_csv(args.out, index=False)
+        print(f"\nlme4 agreement {'within' if lmm.validated(args.out) else 'OUTSIDE'} lmm.AGREEMENT; written to {args.out}")
@@ -0,0 +1,98 @@
+"""Compare `simulate.BatchGenerator` with `wiscs.simulate.DataGenerator`.
+
+Both generators simulate the same cell from the same parameters; the
+script reports the column layout and, averaged over replicates, the cell
+means and moment estimates of the variance components (`components`).
+`components` also works on any dataset, e.g. the CSVs in `data/`.
+
+Only `wiscs` and the default cell overrides (`utils.cell_update`, whose
+task means come from `wiscs.utils.make_tasks`) need wiscs; `components`
+and `batch` with explicit overrides do not.
+
+Usage: python validate_simulate.py [n_replicates]
+"""
+import sys
+import numpy as np
+import pandas as pd
+
+from simulate import BatchGenerator
+
+PARAMS = {"word.perceptual": 100, "image.perceptual": 95, "word.conceptual": 100, "image.conceptual": 100,
+          "sd.item": 30, "sd.subject": 20, "sd.modality": 10, "sd.error": 50,
+          "sd.re_formula": "(1 + question | subject) + (1 + question | item)"}
+QUESTION_SD = np.array([10, 12, 15, 18, 11])
+CELL = (100, 30, 3)
+
+
+def components(df:pd.DataFrame) -> pd.Series:
+    """Moment estimates of the variance components of one balanced dataset.
+
+    For each grouping factor (subject, item): the variance of its effect
+    at the first question, of its question-k slope relative to the first
+    question and of its image - word difference, after removing the
+    sampling error of the cell means. With the terms of
+    `(1 + question | group)` and identity correlations these are
+    sd.<group>^2, sd.question[k-1]^2 and 0. Also sd.error and the
+    (modality, question) cell means.
+    """
+    S, Q, I = (df[c].nunique() for c in ("subject", "question", "item"))
+    df = df.assign(modality=pd.Categorical(df["modality"], categories=["word", "image"]))
+    Y = df.sort_values(["modality", "subject", "question", "item"])["rt"].to_numpy(dtype=float).reshape(2, S, Q, I)
+    mu = Y.mean(axis=(1, 3))
+    R = Y - mu[:, None, :, None]
+    means = {"subject": R.mean(axis=3), "item": R.mean(axis=1).transpose(0, 2, 1)} # (modality, level, question)
+    E = R - means["subject"][..., None] - R.mean(axis=1)[:, None]
+    error = E.var() * S * I / ((S - 1) * (I - 1))
+
+    out = {"sd.error": np.sqrt(error)}
+    for group, n_other in (("subject", I), ("item", S)):
+        m = means[group]
+        noise = error / n_other
+        out[f"var.{group}"] = m[:, :, 0].var(axis=1, ddof=1).mean() - noise
+        for k in range(1, Q):
+            out[f"var.{group}.question{k}"] = (m[:, :, k] - m[:, :, 0]).var(axis=1, ddof=1).mean() - 2 * noise
+        out[f"var.{group}.modality"] = (m[1] - m[0]).mean(axis=1).var(ddof=1) - 2 * noise / Q
+    out.update({f"mean.{level}.{q}": mu[m, q] for m, level in enumerate(["word", "image"]) for q in range(Q)})
+    return pd.Series(out)
+
+
+def cell_params(cell=CELL) -> dict:
+    """Overrides for `cell`, as a sweep builds them (`utils.cell_update`)"""
+    from utils import cell_update
+    return cell_update(cell, QUESTION_SD)
+
+
+def batch(n:int, params:dict=PARAMS, cell=CELL, seed=2025, update:dict=None) -> tuple[list, pd.DataFrame]:
+    """Columns and per-replicate `components` of `BatchGenerator` data (`update` defaults to `cell_params(cell)`)"""
+    update = cell_params(cell) if update is None else update
+    design, Y = BatchGenerator(params).replicates(n, update, seed=seed)
+    return list(design.assign(rt=Y[0])), pd.DataFrame([components(design.assign(rt=y)) for y in Y])
+
+
+def wiscs(n:int, params:dict=PARAMS, cell=CELL, seed=2025) -> tuple[list, pd.DataFrame]:
+    """Columns and per-replicate `components` of `wiscs.simulate.DataGenerator` data"""
+    import wiscs
+    from wiscs.simulate import DataGenerator
+    update = {**params, **cell_params(cell)}
+    wiscs.set_params(update, verbose=False)
+    DG = DataGenerator()
+    rows, columns = [], None
+    for j in range(n):
+        df = DG.fit_transform(update, overwrite=True, seed=seed + j).to_pandas()
+        columns = list(df)
+        rows.append(components(df))
+    return columns, pd.DataFrame(rows)
+
+
+def validate(n:int=50) -> pd.DataFrame:
+    """Mean and standard error of every component under both generators"""
+    (b_columns, b), (w_columns, w) = batch(n), wiscs(n)
+    print(f"columns: batch {b_columns} | wiscs {w_columns}")
+    out = pd.DataFrame({"batch": b.mean(), "wiscs": w.mean()})
+    out["se"] = np.sqrt(b.var() / len(b) + w.var() / len(w))
+    out["z"] = (out["batch"] - out["wiscs"]) / out["se"]
+    return out
+
+
+if __name__ == "__main__":
+    print(validate(int(sys.argv[1]) if len(sys.argv) > 1 else 50).to_string())
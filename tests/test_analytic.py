@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("wiscs")
+import analytic
+import lmm
+from simulate import BatchGenerator
+from utils import cell_update
+
+PARAMS = {"word.perceptual": 100, "image.perceptual": 95, "word.conceptual": 100, "image.conceptual": 100,
+          "sd.item": 30, "sd.subject": 20, "sd.modality": 10, "sd.error": 50,
+          "sd.re_formula": "(1 + question | subject) + (1 + question | item)"}
+CELL = (8, 8, 2)
+
+
+def update(interaction):
+    """Cell overrides with the image - word difference `interaction` larger at the second question"""
+    out = cell_update(CELL, [10])
+    out["image.task"] = np.asarray(out["word.task"], dtype=float) + [0, interaction]
+    return out
+
+
+@pytest.mark.parametrize("interaction", [0, 25])
+def test_success_rate_matches_simulation(interaction):
+    n = 200
+    design, Y = BatchGenerator(PARAMS).replicates(n, update(interaction), seed=1)
+    models = lmm.build_models(design.assign(rt=Y[0]))
+    simulated = np.mean([lmm.compare(design.assign(rt=y), models=models)["p_value"] > 0.05 for y in Y])
+    for method in ("f", "chisq"):
+        approx = analytic.success_rate({**PARAMS, **update(interaction)}, 0.05, method)
+        assert abs(simulated - approx) < 4 * np.sqrt(approx * (1 - approx) / n), method
+
+
+def test_noncentrality():
+    lam, df, ddf = analytic.noncentrality({**PARAMS, **update(25)})
+    # S I sum_q (delta_q - mean delta)^2 / (2 sd.error^2) with delta = (-5, 20)
+    assert lam == pytest.approx(64 * 2 * 12.5**2 / (2 * 50**2))
+    assert df == 1 and ddf > 0
+    assert analytic.noncentrality({**PARAMS, **update(0)})[0] == pytest.approx(0)
+    assert analytic.success_rate({**PARAMS, **update(0)}, 0.05, "chisq") == pytest.approx(0.95)
+    with pytest.raises(ValueError):
+        analytic.success_rate({**PARAMS, **update(0)}, 0.05, "wald")
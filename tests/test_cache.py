@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for module in ("rinterface", "ipywidgets", "wiscs"):
+    pytest.importorskip(module)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "notebooks"))
+from src import cache
+
+
+def data(rt=None):
+    df = pd.DataFrame({"subject": [0, 0, 1, 1], "item": [0, 1, 0, 1], "question": 0,
+                       "modality": ["word", "image"] * 2, "rt": [400.0, 420.0, 390.0, 450.0]})
+    return df if rt is None else df.assign(rt=rt)
+
+
+@pytest.fixture
+def fits(monkeypatch):
+    """Stub the R run: `fit_script` returns the output directory and `R` writes the three tables there"""
+    calls = []
+    monkeypatch.setattr(cache, "fit_script", lambda df, outdir, **spec: outdir)
+
+    def R(outdir):
+        calls.append(outdir)
+        for name in ("stats", "varcorr", "anova"):
+            pd.DataFrame({"model": ["shared", "separate"], "value": [len(calls), 0]}).to_csv(
+                os.path.join(outdir, f"{name}.csv"), index=False)
+
+    monkeypatch.setattr(cache, "R", R)
+    return calls
+
+
+def test_fit_key():
+    key = cache.fit_key(data(), shared_re="(1 | subject)")
+    assert key == cache.fit_key(data(), shared_re="(1 | subject)")
+    assert key != cache.fit_key(data([400.0, 420.0, 390.0, 451.0]), shared_re="(1 | subject)")
+    assert key != cache.fit_key(data(), shared_re="(1 | item)")
+    assert key != cache.fit_key(data().rename(columns={"rt": "y"}), shared_re="(1 | subject)")
+
+
+def test_cached_fit_hits_and_misses(tmp_path, fits):
+    store = cache.FitCache(str(tmp_path))
+    first = cache.cached_fit(data(), "(1 | subject)", cache=store)
+    assert set(first) == {"stats", "varcorr", "anova"} and len(fits) == 1
+    pd.testing.assert_frame_equal(cache.cached_fit(data(), "(1 | subject)", cache=store)["stats"], first["stats"])
+    assert len(fits) == 1
+    cache.cached_fit(data([1.0, 2.0, 3.0, 4.0]), "(1 | subject)", cache=store)
+    cache.cached_fit(data(), "(1 | item)", cache=store)
+    cache.cached_fit(data(), "(1 | subject)", optimizer="Nelder_Mead", cache=store)
+    assert len(fits) == 4
+
+
+def test_lru_eviction(tmp_path):
+    store = cache.FitCache(str(tmp_path), max_bytes=2**20)
+    blob = np.zeros(2**20 // 8 // 2 - 100) # a bit under half of max_bytes pickled
+    store.put("a", blob)
+    store.put("b", blob)
+    for age, key in enumerate("ab", 1):
+        os.utime(store._file(key), (age, age))
+    assert store.get("a") is not None # now the most recently used
+    store.put("c", blob)
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+def test_corrupt_or_missing_entry(tmp_path, fits):
+    store = cache.FitCache(str(tmp_path))
+    assert store.get("missing") is None
+    first = cache.cached_fit(data(), "(1 | subject)", cache=store)
+    key = cache.fit_key(data(), shared_re="(1 | subject)", separate_re="(1 | subject)",
+                        shared_fixed="rt ~ modality + question", separate_fixed=" rt ~ modality * question", add=None,
+                        optimizer="bobyqa", maxfun=10000)
+    with open(store._file(key), "rb+") as f:
+        f.truncate(10)
+    assert store.get(key) is None and not os.path.exists(store._file(key))
+    with open(store._file(key), "wb") as f:
+        f.write(b"not a pickle")
+    again = cache.cached_fit(data(), "(1 | subject)", cache=store)
+    assert len(fits) == 2 and again["stats"]["value"].iloc[0] == 2 != first["stats"]["value"].iloc[0]
+    assert store.get(key) is not None
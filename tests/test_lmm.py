@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import lmm
+
+
+def design(n_subject=4, n_item=5, k=3, seed=0):
+    """Balanced (modality, subject, question, item) design with a response, rows shuffled"""
+    rng = np.random.default_rng(seed)
+    m, s, q, i = np.indices((2, n_subject, k, n_item)).reshape(4, -1)
+    df = pd.DataFrame({"modality": np.array(lmm.LEVELS)[m], "subject": s, "question": q, "item": i})
+    df["rt"] = 100 + 10 * m + 5 * q + rng.normal(0, 20, n_subject)[s] + rng.normal(0, 15, n_item)[i] \
+        + rng.normal(0, 50, len(df))
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def model(df, interaction):
+    return lmm.CrossedLMM(df["subject"], df["item"], df["question"], df["modality"], interaction)
+
+
+def dense(model, theta, y):
+    """Profiled ML deviance, penalized RSS and GLS fixed effects from the dense marginal covariance"""
+    Ls, Li = model._lambda(np.asarray(theta))
+    Z = np.hstack([model.Zs.toarray() @ np.kron(np.eye(model.n_subject), Ls),
+                   model.Zi.toarray() @ np.kron(np.eye(model.n_item), Li)])
+    V = Z @ Z.T + np.eye(model.n) # marginal covariance / sigma^2
+    Vi = np.linalg.inv(V)
+    X = model.X
+    beta = np.linalg.solve(X.T @ Vi @ X, X.T @ Vi @ y)
+    e = y - X @ beta
+    r2 = e @ Vi @ e
+    dev = np.linalg.slogdet(V)[1] + model.n * (1 + np.log(2 * np.pi * r2 / model.n))
+    return dev, r2, beta
+
+
+def thetas(model, n=4, seed=1):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        theta = rng.normal(0, 0.5, model.n_theta)
+        theta[model._diag] = np.abs(theta[model._diag]) + 0.1
+        theta[len(model._tril[0]) + model._diag] = np.abs(theta[len(model._tril[0]) + model._diag]) + 0.1
+        yield theta
+
+
+@pytest.mark.parametrize("interaction", [False, True])
+def test_deviance_matches_dense_gls(interaction):
+    df = design()
+    m = model(df, interaction)
+    assert m.balanced and m._order is not None
+    y = df["rt"].to_numpy()
+    for theta in thetas(m):
+        dev, r2, beta = dense(m, theta, y)
+        for cross in (m.cross(y), m.cross(m.reduce(y))):
+            d, r, b = m.deviance(theta, cross, fixef=True)
+            assert abs(d - dev) < 1e-9 * abs(dev)
+            assert abs(r - r2) < 1e-9 * r2
+            np.testing.assert_allclose(b, beta, rtol=1e-9, atol=1e-9)
+
+
+def test_unbalanced_deviance_matches_dense_gls():
+    df = design().iloc[7:].reset_index(drop=True)
+    m = model(df, True)
+    assert not m.balanced
+    y = df["rt"].to_numpy()
+    for theta in thetas(m):
+        dev, r2, beta = dense(m, theta, y)
+        d, r, b = m.deviance(theta, m.cross(y), fixef=True)
+        assert abs(d - dev) < 1e-9 * abs(dev)
+        np.testing.assert_allclose(b, beta, rtol=1e-9, atol=1e-9)
+
+
+def test_fit_reports_the_optimum():
+    df = design(6, 8, 2)
+    m = model(df, False)
+    y = df["rt"].to_numpy()
+    fit = m.fit(y)
+    dev, r2, beta = dense(m, fit["theta"], y)
+    assert fit["converged"]
+    assert abs(fit["deviance"] - dev) < 1e-9 * abs(dev)
+    assert abs(fit["sigma"] - np.sqrt(r2 / m.n)) < 1e-9 * fit["sigma"]
+    np.testing.assert_allclose(fit["beta"], beta, rtol=1e-9, atol=1e-9)
+    assert len(fit["beta"]) == len(m.names)
+    # the default start does not beat the optimum
+    start = np.zeros(m.n_theta)
+    start[m._diag] = start[len(m._tril[0]) + m._diag] = 1
+    assert fit["deviance"] <= dense(m, start, y)[0] + 1e-8
+
+
+@pytest.mark.parametrize("interaction", [False, True])
+def test_gradient_matches_finite_differences(interaction):
+    df = design()
+    m = model(df, interaction)
+    cross = m.cross(df["rt"].to_numpy())
+    singular = next(thetas(m, 1, seed=3))
+    singular[m._diag[-1]] = 0 # a subject variance on its bound
+    for theta in [*thetas(m, 2), singular]:
+        dev, grad = m.gradient(theta, cross)
+        assert dev == m.deviance(theta, cross)[0]
+        h = 1e-6
+        fd = [(m.deviance(theta + h * e, cross)[0] - m.deviance(theta - h * e, cross)[0]) / (2 * h)
+              for e in np.eye(m.n_theta)]
+        np.testing.assert_allclose(grad, fd, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("seed", [3, 11])
+def test_fit_reaches_the_same_optimum_from_any_start(seed):
+    """Warm starts from other fits and from random points end where the cold fit does"""
+    df = design(12, 8, 3, seed=seed)
+    y = df["rt"].to_numpy()
+    m = model(df, True)
+    cold = m.fit(y)
+    assert cold["converged"]
+    starts = [model(df, False).fit(y)["theta"], m.fit(design(12, 8, 3, seed=seed + 1)["rt"].to_numpy())["theta"]]
+    for start in [*starts, *thetas(m, 3, seed)]:
+        warm = m.fit(y, start)
+        assert warm["converged"]
+        assert abs(warm["deviance"] - cold["deviance"]) < 1e-6
+
+
+def test_optimality_check():
+    """Rounding can leave a gradient above gtol on large data, so a small Newton step also passes"""
+    df = design(40, 10, 2)
+    m = model(df, False)
+    y = df["rt"].to_numpy()
+    cross = m.cross(y)
+    theta = m.fit(y)["theta"]
+    grad = m.gradient(theta, cross)[1]
+    gtol = np.max(np.abs(grad)) / 2
+    assert m._optimal(theta, grad, cross, gtol)
+    start = m.default_start()
+    assert not m._optimal(start, m.gradient(start, cross)[1], cross, 1e-3)
@@ -0,0 +1,82 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# notebooks/src/order.py has no dependencies of its own; load it without the notebook package
+_spec = importlib.util.spec_from_file_location(
+    "order", os.path.join(os.path.dirname(__file__), os.pardir, "notebooks", "src", "order.py"))
+order = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(order)
+
+
+# row-wise versions from diagnostics.ipynb and order_effects.ipynb
+
+def recode_qorder(row):
+    # questions are 1-based here
+    if row["tag"] == 0:
+        if row["modality"] == "word":
+            return 1 if row["question"] == 1 else 2
+        else:
+            return 3 if row["question"] == 1 else 4
+    else:
+        if row["modality"] == "image":
+            return 1 if row["question"] == 2 else 2
+        else:
+            return 3 if row["question"] == 2 else 4
+
+
+def get_qorder(row):
+    tag, modality, question = row["tag"], row["modality"], row["question"]
+    first, second = ("word", "image") if tag.startswith("word") else ("image", "word")
+    q1, q2 = (0, 1) if tag.endswith("Q1Q2") else (1, 0)
+    return {(first, q1): 1, (first, q2): 2, (second, q1): 3, (second, q2): 4}[(modality, question)]
+
+
+def shift_rt(row, shift=300):
+    return row["rt"] + shift if row["first_image_block"] else row["rt"]
+
+
+def shift_rt_questions(row, shift=300):
+    return row["rt"] + shift if row["modality"] == "image" and row["question"] == row["tag"] else row["rt"]
+
+
+@pytest.fixture
+def df():
+    m, s, q, i = np.indices((2, 8, 2, 3)).reshape(4, -1)
+    return pd.DataFrame({"subject": s, "question": q, "item": i, "modality": np.array(order.MODALITIES)[m],
+                         "rt": np.random.default_rng(0).normal(600, 50, len(s))})
+
+
+def test_question_table_matches_rows(df):
+    groups = np.arange(8) % 2
+    columns, _ = order.OrderEffects(order.question_table(2)).columns(df, groups, np.ones(8, dtype=bool))
+    tagged = df.assign(tag=groups[df["subject"]])
+    np.testing.assert_array_equal(columns["qorder"], np.where(tagged["question"] == tagged["tag"], 0, 1))
+
+
+def test_block_table_matches_rows(df):
+    table = order.block_table(2)
+    labels = order.group_labels(table)
+    assert labels == ["word-image_Q1Q2", "word-image_Q2Q1", "image-word_Q1Q2", "image-word_Q2Q1"]
+    groups = np.arange(8) % 4
+    columns, _ = order.OrderEffects(table).columns(df, groups, np.ones(8, dtype=bool))
+    rows = df.assign(tag=np.array(labels)[groups[df["subject"]]])
+    np.testing.assert_array_equal(columns["qorder"], rows.apply(get_qorder, axis=1))
+    # recode_qorder's two groups are word-image_Q1Q2 and image-word_Q2Q1
+    groups = np.array([0, 3])[np.arange(8) % 2]
+    columns, _ = order.OrderEffects(table).columns(df, groups, np.ones(8, dtype=bool))
+    rows = df.assign(tag=np.arange(8)[df["subject"]] % 2, question=df["question"] + 1)
+    np.testing.assert_array_equal(columns["qorder"], rows.apply(recode_qorder, axis=1))
+
+
+@pytest.mark.parametrize("table, reference", [(order.block_table(2), shift_rt),
+                                              (order.question_table(2), shift_rt_questions)])
+def test_transform_matches_rows(df, table, reference):
+    stage = order.OrderEffects(table, shift=300, noise_sd=0)
+    out = stage.transform(df, seed=44)
+    expected = out.assign(rt=df["rt"]).apply(reference, axis=1)
+    np.testing.assert_allclose(out["rt"], expected)
+    assert (out["rt"] != df["rt"]).sum() == 8 * 3 # one block of every subject is shifted
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("wiscs")
+import planner
+
+SUBJECTS, ITEMS, QUESTIONS = np.arange(10, 210, 10), [4, 8, 12, 16, 20], [2, 3]
+
+
+def power(n_subject, n_item, n_question):
+    """Synthetic surface, monotone in n_subject and n_item and not in n_question"""
+    return 1 - np.exp(-n_subject * n_item / (300 * (5 - n_question)))
+
+
+@pytest.fixture
+def probed(monkeypatch):
+    """Stub `run` with the surface; returns the rows it was called with"""
+    rows = []
+
+    def run(DG, p_threshold, desired_power, row, question_sd, **kwargs):
+        rows.append(tuple(int(n) for n in row))
+        return pd.DataFrame({"n_subjects": [row[0]], "n_items": [row[1]], "n_questions": [row[2]],
+                             "power": [power(*row)]})
+
+    monkeypatch.setattr(planner, "run", run)
+    return rows
+
+
+@pytest.mark.parametrize("over", planner.AXES)
+def test_frontier_matches_the_full_grid(probed, over):
+    # a pool makes the search run `run` on threads, where the stub is visible
+    edge, cells = planner.frontier(None, 0.05, 0.8, SUBJECTS, ITEMS, QUESTIONS, None, over=over, pool=[None] * 3)
+    searched, other = (SUBJECTS, ITEMS) if over == "subjects" else (ITEMS, SUBJECTS)
+    expected = []
+    for q in QUESTIONS:
+        for n in other:
+            passing = [m for m in searched if power(*((m, n) if over == "subjects" else (n, m)), q) >= 0.8]
+            expected.append(passing[0] if passing else np.nan)
+    np.testing.assert_array_equal(edge[f"min_{over}"], expected)
+    assert len(cells) == len(probed) == len(set(probed))
+    # at most one bisection per line, and fewer cells than the full grid
+    assert len(probed) <= len(QUESTIONS) * len(other) * np.ceil(np.log2(len(searched) + 1))
+    assert len(probed) < len(SUBJECTS) * len(ITEMS) * len(QUESTIONS)
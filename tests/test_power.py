@@ -0,0 +1,80 @@
+import json
+
+import pandas as pd
+import pytest
+
+import power
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "sweep.json"
+    power.main(["init", str(path)])
+    return power.load(path)
+
+
+def finish(config, db):
+    """Store every cell of the config as finished"""
+    store = power.open_store(config, db)
+    for cell in power.spec(config):
+        result = pd.DataFrame({"n_subjects": [cell.n_subjects], "n_items": [cell.n_items],
+                               "n_questions": [cell.n_questions], "power": [0.5], "power_lower": [0.2],
+                               "power_upper": [0.8], "decision": ["undecided"], "iterations_run": [3]})
+        store.with_params(cell.params).add_cell(cell.row, config["seed"], result)
+
+
+def status(config, db):
+    return power.status(config, power.spec(config), power.open_store(config, db))
+
+
+def test_finished_sweep_resumes(config, tmp_path):
+    db = str(tmp_path / "power.db")
+    finish(config, db)
+    assert set(status(config, db)) == {"done"}
+
+
+@pytest.mark.parametrize("change", [
+    {"desired_power": 0.2},
+    {"p_threshold": 0.01},
+    {"n_iter": 5},
+    {"backend": "numpy"},
+    {"generator": "batch"},
+    {"question_sd": [1, 2, 3, 4, 5]},
+    {"params": {"sd.error": 10}},
+    {"options": {"stopping": "clopper-pearson"}},
+    {"options": {"alpha": 0.1}},
+    {"options": {"min_iter": 2}},
+    {"options": {"crn": True}},
+])
+def test_changed_settings_invalidate_resume(config, tmp_path, change):
+    db = str(tmp_path / "power.db")
+    finish(config, db)
+    changed = json.loads(json.dumps(config))
+    for key, value in change.items():
+        changed[key] = {**changed[key], **value} if isinstance(value, dict) else value
+    assert set(status(changed, db)) == {"todo"}
+
+
+@pytest.mark.parametrize("options", [{"parallelize": True, "n_jobs": 2}, {"stopping": "heuristic"}])
+def test_execution_options_keep_resume(config, tmp_path, options):
+    db = str(tmp_path / "power.db")
+    finish(config, db)
+    assert set(status({**config, "options": {**config["options"], **options}}, db)) == {"done"}
+
+
+def test_numpy_backend_needs_lme4_agreement(config, tmp_path, monkeypatch):
+    import lmm
+    record = tmp_path / "validate_lmm.csv"
+    monkeypatch.setattr(lmm, "VALIDATION", str(record))
+    path = tmp_path / "numpy.json"
+    path.write_text(json.dumps({**config, "backend": "numpy"}))
+    with pytest.raises(SystemExit):
+        power.main(["run", str(path), "-o", str(tmp_path / "power.csv")])
+    power.main(["run", str(path), "--dry-run", "--db", str(tmp_path / "power.db")])
+
+    rows = pd.DataFrame({"file": "a.csv", "field": list(lmm.AGREEMENT), "numpy": 0.0, "lme4": 0.0, "abs_diff": 0.0})
+    rows.to_csv(record, index=False)
+    assert lmm.validated(str(record))
+    rows.loc[rows["field"] == "loglik_separate", "abs_diff"] = 0.5
+    rows.to_csv(record, index=False)
+    assert not lmm.validated(str(record))
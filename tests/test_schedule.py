@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("wiscs")
+import schedule
+from metrics import Metrics
+from simulate import BatchGenerator
+from utils import agg, grid, unit_seed
+
+PARAMS = {"word.perceptual": 100, "image.perceptual": 95, "word.conceptual": 100, "image.conceptual": 100,
+          "sd.item": 30, "sd.subject": 20, "sd.modality": 10, "sd.error": 50,
+          "sd.re_formula": "(1 + question | subject) + (1 + question | item)"}
+QUESTION_SD = np.array([10, 12, 15, 18, 11])
+
+
+COMBINATIONS = grid(subjects=[4, 6], items=[3, 5], questions=[2, 3])
+
+
+def sweep(n_jobs, DG=None, **kwargs):
+    return schedule.sweep(DG or BatchGenerator(PARAMS), 0.05, 0.8, COMBINATIONS, QUESTION_SD, n_iter=6, n_jobs=n_jobs,
+                          backend="numpy", seed=2025, verbose=False, **kwargs)
+
+
+@pytest.mark.parametrize("stopping", ["heuristic", "wilson"])
+def test_results_do_not_depend_on_worker_count(stopping):
+    # fits start cold by default, so refitting the models a worker kept does not change the results
+    pd.testing.assert_frame_equal(sweep(1, stopping=stopping, min_iter=2), sweep(3, stopping=stopping, min_iter=2))
+
+
+def test_metrics_cover_every_kept_iteration():
+    metrics = Metrics()
+    results = sweep(2, metrics=metrics)
+    counted = metrics.frame().groupby(["n_subjects", "n_items", "n_questions"]).size()
+    kept = results.set_index(["n_subjects", "n_items", "n_questions"])["iterations_run"]
+    assert (counted.reindex(kept.index) >= kept).all()
+
+
+def test_closed_cells_release_warm_state():
+    schedule._WARM.clear()
+    schedule._WARM.update({0: {"theta": 1}, 1: {"theta": 2}, 2: {"theta": 3}})
+    schedule._release(frozenset({1}))
+    assert list(schedule._WARM) == [1]
+    schedule._WARM.clear()
+
+
+class Recording:
+    """DataGenerator-like: draws with a BatchGenerator from the seed `fit_transform` gets, and records it"""
+    def __init__(self):
+        self.seeds = []
+
+    def fit_transform(self, params=None, overwrite=False, seed=None):
+        self.seeds.append(seed)
+        design, Y = BatchGenerator(PARAMS).replicates(1, params, seed=seed)
+        self.df = design.assign(rt=Y[0])
+        return self
+
+    def to_pandas(self):
+        return self.df
+
+
+def test_wiscs_units_are_seeded():
+    DG = Recording()
+    for j in (0, 0, 1):
+        schedule._unit(DG, 0.05, (4, 3, 2), QUESTION_SD, unit_seed(2025, (4, 3, 2), j), "numpy", None)
+    assert all(isinstance(s, int) for s in DG.seeds)
+    assert DG.seeds[0] == DG.seeds[1] != DG.seeds[2]
+
+
+@pytest.mark.parametrize("generator", [BatchGenerator, Recording])
+def test_cell_scheduler_simulates_the_same_data(generator):
+    """`run` seeds iteration j of a cell as `sweep` seeds that unit"""
+    DG = generator(PARAMS) if generator is BatchGenerator else generator()
+    by_cell = agg(DG, 0.05, 0.8, COMBINATIONS, QUESTION_SD, n_iter=6, parallelize=False, verbose=False,
+                  backend="numpy", seed=2025)
+    pd.testing.assert_frame_equal(by_cell, sweep(1, DG))
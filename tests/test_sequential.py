@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from scipy.stats import binom
+
+import sequential
+
+
+@pytest.mark.parametrize("k, n, expected", [(8, 10, (0.4901625, 0.9433178)), (0, 10, (0.0, 0.2775328)),
+                                            (20, 20, (0.8388748, 1.0)), (45, 100, (0.3561454, 0.5475540))])
+def test_wilson(k, n, expected):
+    np.testing.assert_allclose(sequential.wilson(k, n), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("k, n, expected", [(8, 10, (0.4439045, 0.9747893)), (0, 10, (0.0, 0.3084971)),
+                                            (10, 10, (0.6915029, 1.0)), (45, 100, (0.3503202, 0.5527198))])
+def test_clopper_pearson(k, n, expected):
+    np.testing.assert_allclose(sequential.clopper_pearson(k, n), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("method", sequential.METHODS)
+def test_interval_bounds(method):
+    assert sequential.interval(0, 0, method) == (0.0, 1.0)
+    for n in (1, 7, 40):
+        for k in range(n + 1):
+            lower, upper = sequential.interval(k, n, method)
+            assert 0 <= lower <= k / n <= upper <= 1
+            # narrower at a larger alpha
+            l2, u2 = sequential.interval(k, n, method, alpha=0.2)
+            assert lower <= l2 + 1e-12 and u2 <= upper + 1e-12
+
+
+def test_clopper_pearson_coverage():
+    """The exact interval covers p with probability at least 1 - alpha for every p"""
+    n, alpha = 30, 0.05
+    bounds = np.array([sequential.clopper_pearson(k, n, alpha) for k in range(n + 1)])
+    for p in np.linspace(0.01, 0.99, 50):
+        covered = (bounds[:, 0] <= p) & (p <= bounds[:, 1])
+        assert binom.pmf(np.arange(n + 1), n, p)[covered].sum() >= 1 - alpha - 1e-12
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError, match="Unknown interval method"):
+        sequential.interval(1, 2, "wald")
+
+
+@pytest.mark.parametrize("method", sequential.METHODS)
+def test_decide(method):
+    # target met only once the lower bound clears it
+    assert sequential.decide(20, 20, 0.8, method)[0] == "met"
+    assert sequential.decide(9, 10, 0.8, method)[0] == "undecided"
+    # ruled out once the upper bound is below it
+    assert sequential.decide(2, 20, 0.8, method)[0] == "ruled out"
+    # no decision before min_iter, whatever the interval
+    assert sequential.decide(0, 4, 0.8, method, min_iter=5)[0] == "undecided"
+    assert sequential.decide(0, 5, 0.8, method, min_iter=5)[0] == "ruled out"
+    decision, lower, upper = sequential.decide(12, 20, 0.8, method)
+    assert (lower, upper) == sequential.interval(12, 20, method)
+
+
+def test_decide_alpha():
+    """A wider interval (smaller alpha) needs more evidence"""
+    assert sequential.decide(19, 20, 0.7, alpha=0.2)[0] == "met"
+    assert sequential.decide(19, 20, 0.7, alpha=0.001)[0] == "undecided"
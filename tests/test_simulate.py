@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import validate_simulate
+from simulate import BatchGenerator
+
+
+def update(cell):
+    """Cell overrides as `utils.cell_update` builds them, with fixed task means instead of wiscs' `make_tasks`"""
+    n_subject, n_item, n_question = cell
+    task = np.linspace(100, 200, n_question)
+    return {"word.task": task, "image.task": task, "sd.question": validate_simulate.QUESTION_SD[:n_question - 1],
+            "corr.subject": np.eye(n_question), "corr.item": np.eye(n_question), "n.question": n_question,
+            "n.item": n_item, "n.subject": n_subject}
+
+
+def test_layout():
+    design, Y = BatchGenerator(validate_simulate.PARAMS).replicates(2, update((3, 4, 2)), seed=0)
+    assert list(design) == ["subject", "question", "item", "modality"]
+    assert Y.shape == (2, 2 * 3 * 2 * 4)
+    expected = np.indices((2, 3, 2, 4)).reshape(4, -1)
+    np.testing.assert_array_equal(design["modality"].cat.codes, expected[0])
+    for k, column in enumerate(["subject", "question", "item"], 1):
+        np.testing.assert_array_equal(design[column], expected[k])
+    assert list(design["modality"].cat.categories) == ["word", "image"]
+
+
+def test_components_match_parameters():
+    """The generator reproduces the means and variances of (1 + question | subject) + (1 + question | item)"""
+    _, b = validate_simulate.batch(40, update=update(validate_simulate.CELL))
+    est, se = b.mean(), b.std() / np.sqrt(len(b))
+    params, sd = validate_simulate.PARAMS, validate_simulate.QUESTION_SD
+    mu = BatchGenerator(params).mean(update(validate_simulate.CELL), validate_simulate.CELL[2])
+    expected = {"sd.error": params["sd.error"],
+                **{f"var.{g}": params[f"sd.{g}"]**2 for g in ("subject", "item")},
+                **{f"var.{g}.question{k}": sd[k - 1]**2 for g in ("subject", "item") for k in (1, 2)},
+                **{f"var.{g}.modality": 0 for g in ("subject", "item")},
+                **{f"mean.{m}.{q}": mu[i, q] for i, m in enumerate(["word", "image"]) for q in range(3)}}
+    for name, value in expected.items():
+        assert abs(est[name] - value) < 4 * se[name] + 1e-9, name
+
+
+def test_matches_wiscs():
+    pytest.importorskip("wiscs.simulate")
+    b_columns, b = validate_simulate.batch(30)
+    w_columns, w = validate_simulate.wiscs(30)
+    assert sorted(b_columns) == sorted(w_columns)
+    z = (b.mean() - w.mean()) / np.sqrt(b.var() / len(b) + w.var() / len(w))
+    assert (z.abs() < 4).all(), z[z.abs() >= 4].to_dict()
@@ -0,0 +1,79 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from store import ResultStore, param_hash, result_key, EXECUTION, DEFAULTS
+
+PARAMS = {"sd.error": 50, "question_sd": np.array([10, 12])}
+KEY = (PARAMS, [10, 12, 15], 0.05, 0.8)
+
+
+def test_param_hash_is_stable():
+    # a changed hash orphans every stored result, so the format is pinned
+    assert param_hash(PARAMS) == "5b735391a403cb82"
+    assert param_hash({"question_sd": [10, 12], "sd.error": 50}) == param_hash(PARAMS)
+    assert param_hash({"f": np.eye}) == param_hash({"f": np.eye})
+    assert param_hash({**PARAMS, "sd.error": 51}) != param_hash(PARAMS)
+
+
+def test_result_key_fills_defaults_and_drops_execution():
+    key = result_key(*KEY)
+    assert {name: key[name] for name in DEFAULTS} == DEFAULTS
+    assert param_hash(result_key(*KEY, **DEFAULTS)) == param_hash(key)
+    execution = {name: object() for name in EXECUTION}
+    assert param_hash(result_key(*KEY, **execution)) == param_hash(key)
+
+
+@pytest.mark.parametrize("settings", [{"n_iter": 20}, {"backend": "numpy"}, {"generator": "batch"},
+                                      {"stopping": "wilson"}, {"alpha": 0.1}, {"min_iter": 3}, {"crn": True},
+                                      {"warm_start": True}, {"refit": False}])
+def test_result_key_keeps_settings(settings):
+    assert param_hash(result_key(*KEY, **settings)) != param_hash(result_key(*KEY))
+
+
+@pytest.mark.parametrize("position", range(4))
+def test_result_key_covers_every_argument(position):
+    changed = list(KEY)
+    changed[position] = {"other": 1} if position == 0 else [1] if position == 1 else 0.5
+    assert param_hash(result_key(*changed)) != param_hash(result_key(*KEY))
+
+
+def result(power=0.5):
+    return pd.DataFrame({"n_subjects": [10], "n_items": [20], "n_questions": [3], "power": [power],
+                         "power_lower": [0.2], "power_upper": [0.8], "decision": ["undecided"],
+                         "iterations_run": [4]})
+
+
+def test_round_trip(tmp_path):
+    store = ResultStore(str(tmp_path / "power.db"), result_key(*KEY))
+    row = (10, 20, 3)
+    assert store.cell(row, 7) is None and store.iterations(row, 7) == {}
+    for j, success in enumerate([1, 0, 1]):
+        store.add_iteration(row, 7, j, success)
+    assert store.iterations(row, 7) == {0: 1, 1: 0, 2: 1}
+    assert store.status(7) == {row + (store.param_hash,): (3, False)}
+    store.add_cell(row, 7, result())
+    pd.testing.assert_frame_equal(store.cell(row, 7), result())
+    assert store.status(7) == {row + (store.param_hash,): (3, True)}
+    # other seeds and keys do not see it
+    assert store.cell(row, 8) is None
+    assert ResultStore(store.path, result_key(*KEY, n_iter=20)).cell(row, 7) is None
+    # reopened and unpickled stores do
+    pd.testing.assert_frame_equal(ResultStore(store.path, result_key(*KEY)).cell(row, 7), result())
+    pd.testing.assert_frame_equal(pickle.loads(pickle.dumps(store)).cell(row, 7), result())
+
+
+def test_with_params(tmp_path):
+    store = ResultStore(str(tmp_path / "power.db"), result_key(*KEY))
+    assert store.with_params({}) is store
+    view = store.with_params({"sd.item": 20})
+    assert view.param_hash not in (store.param_hash, store.with_params({"sd.item": 30}).param_hash)
+    assert view.param_hash == store.with_params({"sd.item": 20}).param_hash
+    view.add_cell((10, 20, 3), 7, result(0.9))
+    assert store.cell((10, 20, 3), 7) is None
+    assert view.cell((10, 20, 3), 7)["power"].item() == 0.9
+    # the same overrides on another base key are another cell
+    other = ResultStore(store.path, result_key(*KEY, n_iter=20)).with_params({"sd.item": 20})
+    assert other.cell((10, 20, 3), 7) is None
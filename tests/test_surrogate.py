@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.special import expit
+
+import surrogate
+
+SPACE = {"n.subject": (10, 200), "n.item": (10, 60), "n.question": (2, 4), "sd.item": (10, 60)}
+
+
+def truth(surface):
+    """Known coefficients: power rises with subjects and items and falls with sd.item"""
+    beta = np.zeros(surface.features(surface.sample(1, 0)).shape[1])
+    beta[:5] = [0.5, 1.5, 1.0, -0.3, -0.8]
+    beta[5] = -0.4 # n.subject^2
+    return beta
+
+
+def test_fit_recovers_a_logistic_surface():
+    surface = surrogate.PowerSurface(SPACE, ridge=1e-8)
+    rng = np.random.default_rng(3)
+    X = surface.sample(400, rng)
+    beta = truth(surface)
+    n = np.full(len(X), 200)
+    k = rng.binomial(n, expit(surface.features(X) @ beta))
+    surface.fit(X, k, n)
+    se = np.sqrt(np.diag(surface.cov))
+    assert np.all(np.abs(surface.coef - beta) < 4 * se)
+    grid = surface.sample(200, 4)
+    np.testing.assert_allclose(surface.predict(grid), expit(surface.features(grid) @ beta), atol=0.03)
+    assert np.all(surface.logit_sd(grid) > 0)
+
+
+def test_active_learning_round(monkeypatch):
+    pytest.importorskip("wiscs")
+    import utils
+    calls = []
+    reference = surrogate.PowerSurface(SPACE)
+    beta = truth(reference)
+
+    def agg(DG, p_threshold, desired_power, specs, question_sd, n_iter=10, seed=None, **kwargs):
+        calls.append((specs, kwargs))
+        rng = np.random.default_rng(seed)
+        X = [[c.n_subjects, c.n_items, c.n_questions, c.params["sd.item"]] for c in specs]
+        k = rng.binomial(n_iter, expit(reference.features(X) @ beta))
+        return pd.DataFrame({"power": k / n_iter, "iterations_run": n_iter})
+
+    monkeypatch.setattr(utils, "agg", agg)
+    surface, history = surrogate.active_learning(None, 0.05, 0.8, SPACE, None, n_init=12, n_rounds=1, batch=3,
+                                                 n_iter=20, n_candidates=200, seed=0, backend="numpy")
+    assert [len(specs) for specs, _ in calls] == [12, 3]
+    assert [c.index for specs, _ in calls for c in specs] == list(range(15))
+    assert calls[0][1] == {"stopping": "wilson", "min_iter": 20, "verbose": False, "backend": "numpy"}
+    assert list(history) == [*SPACE, "successes", "iterations"] and len(history) == 15
+    assert (history["iterations"] == 20).all() and history["successes"].between(0, 20).all()
+    # the round simulates where the surface fitted to the first cells was least sure
+    first = surrogate.PowerSurface(SPACE).fit(history[list(SPACE)][:12], history["successes"][:12],
+                                              history["iterations"][:12])
+    chosen = history[list(SPACE)].to_numpy()[12:]
+    others = first.sample(200, np.random.default_rng(1))
+    assert first.acquisition(chosen, 0.8).min() >= np.median(first.acquisition(others, 0.8))
+    assert surface.coef is not None
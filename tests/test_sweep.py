@@ -0,0 +1,70 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from sweep import Sweep, Cell, cells, label, tag
+
+AXES = dict(subjects=[10, 20, 30], items=[4, 8], questions=[2, 3])
+PARAMS = {"sd.item": [20, 30], "sd.question": [[10, 12], [20, 24]]}
+
+
+@pytest.fixture
+def spec():
+    return Sweep(**AXES, **PARAMS)
+
+
+def test_order(spec):
+    """Questions vary slowest, then subjects, then items, then the parameter axes in order"""
+    expected = list(itertools.product(AXES["questions"], AXES["subjects"], AXES["items"], *PARAMS.values()))
+    assert len(spec) == len(expected) == 48
+    for i, (cell, (q, s, n, item_sd, question_sd)) in enumerate(zip(spec, expected)):
+        assert cell == Cell(i, s, n, q, {"sd.item": item_sd, "sd.question": question_sd})
+        assert spec[i] == cell and spec.cost(i) == s * n * q
+    assert spec[-1].index == 47
+
+
+def test_slices_keep_global_index(spec):
+    view = spec[5:20:3]
+    assert [c.index for c in view] == list(range(5, 20, 3))
+    assert view[1] == spec[8]
+    assert len(view[1:]) == len(view) - 1
+
+
+@pytest.mark.parametrize("balanced", [True, False])
+def test_shards_partition(spec, balanced):
+    shards = [spec.shard(k, 5, balanced) for k in range(5)]
+    indices = [c.index for shard in shards for c in shard]
+    assert sorted(indices) == list(range(len(spec)))
+    for shard in shards:
+        assert all(shard[j].index == i for j, i in enumerate(shard.indices))
+    if not balanced:
+        assert list(shards[2].indices) == list(range(2, len(spec), 5))
+
+
+def test_balanced_shards_share_the_cost():
+    spec = Sweep(subjects=range(10, 201, 10), items=[10, 20, 40], questions=[2, 3, 4])
+    costs = [sum(spec.cost(i) for i in spec.shard(k, 8).indices) for k in range(8)]
+    strided = [sum(spec.cost(i) for i in spec.shard(k, 8, balanced=False).indices) for k in range(8)]
+    assert max(costs) / min(costs) < 1.05
+    assert max(costs) - min(costs) < max(strided) - min(strided)
+
+
+def test_shard_range(spec):
+    with pytest.raises(ValueError):
+        spec.shard(5, 5)
+
+
+def test_cells_of_arrays():
+    grid = np.array([[10, 4, 2], [20, 8, 3]])
+    assert list(cells(grid)) == [Cell(0, 10, 4, 2, {}), Cell(1, 20, 8, 3, {})]
+    assert list(cells([Cell(7, 1, 2, 3, {"a": 1})])) == [Cell(7, 1, 2, 3, {"a": 1})]
+
+
+def test_tag():
+    import pandas as pd
+    df = pd.DataFrame({"power": [0.5]})
+    assert tag(df) is df
+    tagged = tag(df, {"sd.question": np.array([10, 12]), "sd.corr": np.eye, "sd.item": 20})
+    assert tagged.iloc[0].to_dict() == {"power": 0.5, "sd.question": "[10, 12]", "sd.corr": "eye", "sd.item": 20}
+    assert label(np.float64(2.5)) == 2.5
@@ -0,0 +1,60 @@
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import transport
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    n = 48
+    return pd.DataFrame({"subject": np.repeat(np.arange(4), 12), "item": np.tile(np.arange(6), 8),
+                         "question": np.tile(np.repeat(np.arange(2), 6), 4),
+                         "modality": np.tile(["word", "image"], n // 2), "rt": rng.normal(500, 50, n)})
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(df, tmp_path, mmap):
+    path = transport.save(df, str(tmp_path / "data.wscb"), params={"sd.error": 50}, seed=7)
+    out = transport.read(path, mmap=mmap)
+    assert list(out) == list(df)
+    for column in ("subject", "item", "question"):
+        np.testing.assert_array_equal(out[column], df[column])
+    assert out["modality"].astype(str).tolist() == df["modality"].tolist()
+    assert list(out["modality"].cat.categories) == transport.LEVELS["modality"]
+    np.testing.assert_array_equal(out["rt"], df["rt"])
+    assert out.attrs["meta"] == {"params": {"sd.error": 50}, "seed": 7}
+
+
+def test_csv_round_trip(df, tmp_path):
+    csv = tmp_path / "data.csv"
+    df.to_csv(csv)
+    out = transport.read(transport.convert(str(csv)))
+    back = pd.read_csv(csv, index_col=0)
+    assert list(out) == list(back)
+    np.testing.assert_array_equal(out["rt"], back["rt"])
+    assert out["modality"].astype(str).tolist() == back["modality"].tolist()
+
+
+def test_column_subset(df, tmp_path):
+    out = transport.read(transport.write(df, str(tmp_path / "data.wscb")), columns=["rt", "subject"])
+    assert sorted(out) == ["rt", "subject"]
+
+
+def test_float32(df, tmp_path):
+    out = transport.read(transport.write(df, str(tmp_path / "data.wscb"), float32=True))
+    assert out["rt"].dtype == np.float32
+    np.testing.assert_allclose(out["rt"], df["rt"], rtol=1e-6)
+
+
+@pytest.mark.parametrize("offset, value", [(0, b"CSV,"), (4, struct.pack("<i", transport.VERSION + 1))])
+def test_bad_header(df, tmp_path, offset, value):
+    path = transport.write(df, str(tmp_path / "data.wscb"))
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(value)
+    with pytest.raises(ValueError):
+        transport.read(path)